@@ -1,14 +1,54 @@
 from google import genai
-from typing import List, Dict
-import json
+from typing import Awaitable, Callable, List, Dict, Optional, Tuple
+import asyncio
+import contextvars
+import difflib
+import heapq
+import os
 import re
+import time
+import uuid
 from datetime import datetime
 
-
+import metrics
+from artifacts import ArtifactStore, write_result_json
+from cassette import CASSETTE_MODES, Cassette
+from checkpoints import CheckpointStore
+from client_pool import REQUEST_TIMING, ClientPool, hash_api_key
+from context_cache import ContextCache
+from fingerprints import FingerprintIndex, fingerprint
+from model_health import ModelHealthRegistry, StageLatencies, classify_error
+from prescore import local_prescore_async
+from prompt_builder import PromptCompactor, estimate_tokens
+from rate_limiter import ModelConcurrency, RateLimiter, flow as fair_share_flow
+from resilience import hedge_async, retry_async, with_deadline
+from response_cache import ResponseCache, cache_key
+from scheduler import SCHEDULERS, AdaptiveScheduler, ModelStatsStore, chain_observations
+
+
+
+# Clients are pooled per API key so every call reuses the same client and connections
+CLIENT_POOL = ClientPool(
+    factory=lambda api_key: genai.Client(api_key=api_key),
+    max_size=int(os.getenv("GENAI_CLIENT_POOL_SIZE", "64")),
+    idle_ttl=float(os.getenv("GENAI_CLIENT_IDLE_TTL", "900")),
+)
+
+# Record/replay of provider calls below call_model (see cassette.py):
+# CASSETTE_MODE=record writes every call to CASSETTE_PATH, replay serves them back
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "").lower()
+CASSETTE = Cassette(
+    path=os.getenv("CASSETTE_PATH", os.path.join(os.getenv("DEVGENIE_DATA_DIR", ".devgenie"), "cassette.jsonl")),
+    mode=CASSETTE_MODE,
+    speed=float(os.getenv("CASSETTE_SPEED", "1.0")),
+) if CASSETTE_MODE in CASSETTE_MODES else None
+if CASSETTE is not None:
+    CLIENT_POOL.factory = CASSETTE.wrap(CLIENT_POOL.factory)
+    print(f"📼 Cassette {CASSETTE_MODE}: {CASSETTE.path}")
 
 # Initialize client
 def get_client(api_key: str):
-    return genai.Client(api_key=api_key)
+    return CLIENT_POOL.get(api_key)
 
 # Define your 30+ models in sequential order
 MODEL_CHAIN1 = [
@@ -241,15 +281,164 @@ def get_model_chain_by_mode(mode: str = "fast") -> List[str]:
         return MODEL_CHAIN3
 
 
+MODE_ALIASES = {
+    "fullpower": "full power",
+    "full": "full power",
+    "advanced": "advance",
+}
+KNOWN_MODES = ("fast", "advance", "full power", "optimized", "aggressive", "balanced", "strongest")
+
+
+def canonical_mode(mode: str = "fast") -> str:
+    """Normalize a user-supplied mode name (aliases and unknown names map like get_model_chain_by_mode)"""
+    mode = MODE_ALIASES.get((mode or "fast").lower(), (mode or "fast").lower())
+    return mode if mode in KNOWN_MODES else "fast"
+
+
+# Round boundaries of each chain (as marked by the comments above), used by
+# the tournament execution mode. Chains not listed are cut into rounds of
+# DEFAULT_ROUND_SIZE models.
+CHAIN_ROUND_SIZES = {
+    "fast": [2, 2],
+    "advance": [3, 3],
+    "full power": [3] * 10,
+    "optimized": [3, 3, 3, 3],
+    "aggressive": [2, 2, 2, 3],
+    "balanced": [4, 4, 4, 3],
+}
+DEFAULT_ROUND_SIZE = 3
+
+
+def split_into_rounds(models: List[str], sizes: Optional[List[int]] = None) -> List[List[str]]:
+    """Cut a flat chain into rounds; models beyond the listed sizes go in DEFAULT_ROUND_SIZE rounds"""
+    rounds = []
+    start = 0
+    for size in sizes or []:
+        if start >= len(models):
+            break
+        rounds.append(models[start:start + size])
+        start += size
+    while start < len(models):
+        rounds.append(models[start:start + DEFAULT_ROUND_SIZE])
+        start += DEFAULT_ROUND_SIZE
+    return rounds
+
+
+def get_model_rounds_by_mode(mode: str = "fast") -> List[List[str]]:
+    """The mode's model chain grouped into tournament rounds"""
+    return split_into_rounds(get_model_chain_by_mode(mode), CHAIN_ROUND_SIZES.get(canonical_mode(mode)))
+
+
+# Early termination per mode. A chain stops when the best raw judge score
+# has not improved by more than min_delta for `patience` scored steps, when
+# a step's output is at least `similarity` alike to the previous one, or
+# when a step scores target_score or more. None runs every model.
+EARLY_STOP_POLICIES = {
+    "fast": None,
+    "advance": {"patience": 3, "min_delta": 2, "similarity": 0.98, "target_score": 95},
+    "full power": {"patience": 6, "min_delta": 2, "similarity": 0.98, "target_score": 97},
+    "optimized": {"patience": 4, "min_delta": 2, "similarity": 0.98, "target_score": 96},
+    "aggressive": {"patience": 4, "min_delta": 2, "similarity": 0.98, "target_score": 96},
+    "balanced": {"patience": 5, "min_delta": 2, "similarity": 0.98, "target_score": 96},
+    "strongest": {"patience": 5, "min_delta": 2, "similarity": 0.97, "target_score": 97},
+}
+
+
+def get_early_stop_policy(mode: str = "fast") -> Optional[Dict]:
+    """Early-stop policy for a mode, or None when the whole chain should run"""
+    return EARLY_STOP_POLICIES.get(canonical_mode(mode))
+
+
+def output_similarity(previous: str, current: str) -> float:
+    """Similarity ratio (0-1) of two outputs after whitespace normalization
+
+    Compared line by line: character-level matching is quadratic on long,
+    repetitive code and took seconds per step on large outputs.
+    """
+    a = [" ".join(line.split()) for line in previous.splitlines() if line.strip()]
+    b = [" ".join(line.split()) for line in current.splitlines() if line.strip()]
+    if a == b:
+        return 1.0
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    # quick_ratio is a cheap upper bound; skip the quadratic ratio when it can't qualify
+    if matcher.real_quick_ratio() < 0.9 or matcher.quick_ratio() < 0.9:
+        return matcher.quick_ratio()
+    return matcher.ratio()
+
+
+class EarlyStopTracker:
+    """Applies an EARLY_STOP_POLICIES entry to the scores and outputs of a running chain
+
+    Each observe_score call is one unit of patience: a step, or a round in
+    the tournament engine (unit names it in the stop reason).
+    """
+
+    def __init__(self, policy: Optional[Dict], unit: str = "steps"):
+        self.policy = policy
+        self.unit = unit
+        self.best_raw_score = None
+        self.stale_steps = 0
+        self.scored_steps = 0
+        self.reason = None
+
+    def observe_score(self, raw_score: int) -> Optional[str]:
+        if not self.policy:
+            return None
+        self.scored_steps += 1
+        target = self.policy.get("target_score")
+        if target is not None and raw_score >= target:
+            self.reason = f"target score {target} reached"
+        elif self.best_raw_score is None or raw_score > self.best_raw_score + self.policy.get("min_delta", 0):
+            self.best_raw_score = raw_score if self.best_raw_score is None else max(self.best_raw_score, raw_score)
+            self.stale_steps = 0
+        else:
+            self.best_raw_score = max(self.best_raw_score, raw_score)
+            self.stale_steps += 1
+            if self.stale_steps >= self.policy.get("patience", 3):
+                self.reason = f"no improvement above {self.policy.get('min_delta', 0)} for {self.stale_steps} {self.unit}"
+        return self.reason
+
+    def state(self) -> Dict:
+        return {"best_raw_score": self.best_raw_score, "stale_steps": self.stale_steps, "scored_steps": self.scored_steps, "reason": self.reason}
+
+    def restore(self, state: Dict):
+        self.best_raw_score = state.get("best_raw_score")
+        self.stale_steps = state.get("stale_steps", 0)
+        self.scored_steps = state.get("scored_steps", 0)
+        self.reason = state.get("reason")
+
+    async def observe_outputs(self, previous: str, current: str) -> Optional[str]:
+        threshold = (self.policy or {}).get("similarity")
+        if not threshold or not previous:
+            return None
+        similarity = await asyncio.to_thread(output_similarity, previous, current)
+        if similarity >= threshold:
+            self.reason = f"output converged (similarity {similarity:.3f})"
+        return self.reason
+
 
 
 
 
 
 
-def call_model(model_name: str, prompt: str, api_key: str) -> Dict:
+
+def response_usage(response) -> Dict:
+    """Token counts from a response's usage metadata (None when the SDK doesn't report them)"""
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "input_tokens": getattr(usage, "prompt_token_count", None),
+        "output_tokens": getattr(usage, "candidates_token_count", None),
+        "cached_input_tokens": getattr(usage, "cached_content_token_count", None),
+    }
+
+
+def call_model(model_name: str, prompt: str, api_key: str, stage: str = "generation") -> Dict:
     """Call a single model and return result"""
     client = get_client(api_key)
+    started = time.monotonic()
+    timing = {}
+    token = REQUEST_TIMING.set(timing)
     
     try:
         response = client.models.generate_content(
@@ -257,19 +446,340 @@ def call_model(model_name: str, prompt: str, api_key: str) -> Dict:
             contents=prompt
         )
         
-        return {
+        result = {
             "model": model_name,
             "output": response.text,
             "success": True,
-            "error": None
+            "error": None,
+            **response_usage(response)
         }
     except Exception as e:
-        return {
+        result = {
             "model": model_name,
             "output": "",
             "success": False,
             "error": str(e)
         }
+    finally:
+        REQUEST_TIMING.reset(token)
+    result["latency"] = round(time.monotonic() - started, 3)
+    result["ttfb"] = timing.get("ttfb")
+    metrics.record_call(stage, result)
+    return result
+
+# Content-addressed cache of successful model outputs (memory LRU + SQLite)
+# Off by default while a cassette is active, so every call is recorded / replayed
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0" if CASSETTE is not None else "1") == "1"
+RESPONSE_CACHE = ResponseCache(
+    path=os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.getenv("DEVGENIE_DATA_DIR", ".devgenie"), "responses.db")) or None,
+    memory_entries=int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_bytes=int(os.getenv("RESPONSE_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))),
+) if RESPONSE_CACHE_ENABLED else None
+
+
+# Replacement for a chain entry whose circuit breaker is open
+MODEL_FALLBACKS = {
+    "gemini-2.0-flash-thinking-exp": "gemini-2.5-flash",
+    "gemini-2.0-flash-thinking-exp-01-21": "gemini-2.5-flash",
+    "gemini-2.0-flash-thinking-exp-1219": "gemini-2.5-flash",
+    "gemini-2.0-flash-exp": "gemini-2.0-flash",
+    "gemini-2.0-flash-001": "gemini-2.0-flash",
+    "gemini-2.5-flash-preview-05-20": "gemini-2.5-flash",
+    "gemini-2.5-flash-preview-09-2025": "gemini-2.5-flash",
+    "gemini-2.5-flash-lite-preview-06-17": "gemini-2.5-flash-lite",
+    "gemini-2.5-flash-lite-preview-09-2025": "gemini-2.5-flash-lite",
+    "gemini-pro-latest": "gemini-2.5-pro",
+    "gemini-flash-latest": "gemini-2.5-flash",
+    "gemini-flash-lite-latest": "gemini-2.5-flash-lite",
+}
+
+MODEL_HEALTH = ModelHealthRegistry(
+    window=int(os.getenv("MODEL_HEALTH_WINDOW", "20")),
+    failure_threshold=float(os.getenv("MODEL_HEALTH_FAILURE_THRESHOLD", "0.5")),
+    cooldown=float(os.getenv("MODEL_HEALTH_COOLDOWN", "60")),
+)
+
+
+# Per-call deadline in seconds; models not listed use MODEL_TIMEOUT
+MODEL_TIMEOUTS = {
+    "gemini-2.5-pro": 240,
+    "gemini-pro-latest": 240,
+    "gemini-2.0-flash-thinking-exp": 180,
+    "gemini-2.0-flash-thinking-exp-01-21": 180,
+    "gemini-2.0-flash-thinking-exp-1219": 180,
+}
+DEFAULT_MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", "120"))
+CALL_MAX_ATTEMPTS = int(os.getenv("CALL_MAX_ATTEMPTS", "3"))
+CALL_RETRY_BASE_DELAY = float(os.getenv("CALL_RETRY_BASE_DELAY", "1.0"))
+
+# Hedged requests: when a model hasn't answered by its p95 latency, the same
+# prompt also goes to the backup below and the first answer wins
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "0") == "1"
+HEDGE_MODELS = {
+    "gemini-2.5-pro": "gemini-2.5-flash",
+    "gemini-pro-latest": "gemini-2.5-flash",
+    "gemini-2.0-flash-thinking-exp": "gemini-2.5-flash",
+    "gemini-2.0-flash-thinking-exp-01-21": "gemini-2.5-flash",
+    "gemini-2.0-flash-thinking-exp-1219": "gemini-2.5-flash",
+    "gemma-3-27b-it": "gemini-2.0-flash",
+}
+
+
+# Per-minute (requests, tokens) quotas by model-name prefix and Gemini API
+# tier, enforced per API key before every provider call. Limiting is opt-in:
+# set RATE_LIMIT_TIER to the tier of the keys in use (RATE_LIMIT_SCALE
+# multiplies its quotas).
+RATE_LIMIT_TIERS = {
+    "free": {
+        "gemini-2.5-pro": (5, 250_000),
+        "gemini-pro": (5, 250_000),
+        "gemini-2.5-flash-lite": (15, 250_000),
+        "gemini-2.5-flash": (10, 250_000),
+        "gemini-flash-lite": (15, 250_000),
+        "gemini-flash": (10, 250_000),
+        "gemini-2.0-flash-lite": (30, 1_000_000),
+        "gemini-2.0-flash": (15, 1_000_000),
+        "gemma": (30, 15_000),
+    },
+    "tier1": {
+        "gemini-2.5-pro": (150, 2_000_000),
+        "gemini-pro": (150, 2_000_000),
+        "gemini-2.5-flash-lite": (4_000, 4_000_000),
+        "gemini-2.5-flash": (1_000, 1_000_000),
+        "gemini-flash-lite": (4_000, 4_000_000),
+        "gemini-flash": (1_000, 1_000_000),
+        "gemini-2.0-flash-lite": (4_000, 4_000_000),
+        "gemini-2.0-flash": (2_000, 4_000_000),
+        "gemma": (30, 15_000),
+    },
+}
+RATE_LIMIT_TIER = os.getenv("RATE_LIMIT_TIER", "").lower()
+if RATE_LIMIT_TIER and RATE_LIMIT_TIER not in RATE_LIMIT_TIERS:
+    raise ValueError(f"Unknown RATE_LIMIT_TIER: {RATE_LIMIT_TIER}. Expected one of {', '.join(RATE_LIMIT_TIERS)}")
+MODEL_RATE_LIMITS = RATE_LIMIT_TIERS.get(RATE_LIMIT_TIER or "free")
+RATE_LIMITER = RateLimiter(
+    MODEL_RATE_LIMITS,
+    default=(float(os.getenv("DEFAULT_MODEL_RPM", "10")), float(os.getenv("DEFAULT_MODEL_TPM", "250000"))),
+    scale=float(os.getenv("RATE_LIMIT_SCALE", "1")),
+    burst_seconds=float(os.getenv("RATE_LIMIT_BURST_SECONDS", "60")),
+) if RATE_LIMIT_TIER else None
+# Output tokens assumed when reserving token budget (settled against the reported usage)
+EXPECTED_OUTPUT_TOKENS = int(os.getenv("EXPECTED_OUTPUT_TOKENS", "2000"))
+
+# In-flight provider calls allowed per model, across all chains in the process.
+# Concurrent chains (e.g. a /run/batch) queue here and interleave their steps.
+MODEL_CONCURRENCY_LIMITS = {
+    "gemini-2.5-pro": 4,
+    "gemini-pro": 4,
+    "gemini-2.0-flash-thinking": 4,
+}
+MODEL_CONCURRENCY = ModelConcurrency(MODEL_CONCURRENCY_LIMITS, default=int(os.getenv("MODEL_CONCURRENCY", "8")))
+
+# Gemini context caching: a prompt prefix sent to the same model again and
+# again (the rubric plus the task that start every step and judge prompt of
+# a chain) is uploaded once as cached content and referred to by name.
+# Prefixes shorter than the model's minimum cacheable size are always sent
+# inline.
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "1") == "1"
+CONTEXT_CACHE_MIN_TOKENS = {
+    "gemini-2.5-flash": 1024,
+    "gemini-2.5-pro": 2048,
+}
+CONTEXT_CACHE = ContextCache(
+    CONTEXT_CACHE_MIN_TOKENS,
+    default_min_tokens=int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "4096")),
+    ttl=float(os.getenv("CONTEXT_CACHE_TTL", "600")),
+) if CONTEXT_CACHE_ENABLED else None
+# Errors of a call made with cached content after which it is re-sent with the full prompt
+CONTEXT_CACHE_FALLBACK_ERRORS = ("not_found", "permission_denied", "invalid_argument")
+
+
+async def generate_once(model_name: str, prompt: str, api_key: str, cache_prefix: Optional[str] = None):
+    """One provider call under the model's deadline; records a success in MODEL_HEALTH
+
+    Returns (output, usage) where usage holds the token counts, the time spent
+    queued in RATE_LIMITER and MODEL_CONCURRENCY and, when the transport
+    reports it, the time to first byte. When prompt starts with cache_prefix
+    and CONTEXT_CACHE holds it for this model, only the rest is sent.
+    """
+    client = get_client(api_key)
+    contents, config = prompt, None
+    if cache_prefix and CONTEXT_CACHE is not None and prompt.startswith(cache_prefix):
+        cached_name = await CONTEXT_CACHE.resolve(client, api_key, model_name, cache_prefix)
+        if cached_name is not None:
+            contents, config = prompt[len(cache_prefix):], {"cached_content": cached_name}
+    reserved = estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS
+    queue_wait = await RATE_LIMITER.acquire(api_key, model_name, reserved) if RATE_LIMITER is not None else 0.0
+    started = time.monotonic()
+    timing = {}
+    token = REQUEST_TIMING.set(timing)
+    try:
+        async with MODEL_CONCURRENCY.slot(model_name):
+            # Waiting for a model slot counts as queueing, not as provider latency
+            queue_wait += time.monotonic() - started
+            started = time.monotonic()
+            response = await with_deadline(
+                client.aio.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config=config
+                ),
+                MODEL_TIMEOUTS.get(model_name, DEFAULT_MODEL_TIMEOUT),
+                label=model_name
+            )
+    except asyncio.CancelledError:
+        metrics.CALLS_ABANDONED.inc((model_name,))
+        if RATE_LIMITER is not None:
+            RATE_LIMITER.refund(api_key, model_name, reserved)
+        raise
+    except Exception as e:
+        error_class = classify_error(e)
+        if config is None or error_class not in CONTEXT_CACHE_FALLBACK_ERRORS:
+            if error_class == "rate_limited" and RATE_LIMITER is not None:
+                RATE_LIMITER.penalize(api_key, model_name)
+            raise
+        # The cached content expired or was rejected: forget it and send the full prompt
+        print(f"🧊 {model_name} rejected cached content ({error_class}), resending the full prompt")
+        CONTEXT_CACHE.invalidate(api_key, model_name, cache_prefix)
+        if RATE_LIMITER is not None:
+            # The rejected request counted but processed no tokens; the resend reserves its own
+            RATE_LIMITER.settle(api_key, model_name, reserved, 0)
+        response = None
+    finally:
+        REQUEST_TIMING.reset(token)
+    if response is None:
+        return await generate_once(model_name, prompt, api_key)
+    MODEL_HEALTH.record_success(model_name, time.monotonic() - started)
+    usage = response_usage(response)
+    if RATE_LIMITER is not None and usage["input_tokens"] is not None:
+        RATE_LIMITER.settle(api_key, model_name, reserved, usage["input_tokens"] + (usage["output_tokens"] or 0))
+    return response.text, {**usage, "ttfb": timing.get("ttfb"), "queue_wait": round(queue_wait, 3)}
+
+
+async def generate_with_retries(model_name: str, prompt: str, api_key: str, cache_prefix: Optional[str] = None):
+    """generate_once with jittered exponential backoff on retryable errors; returns ((output, usage), attempts)
+
+    MODEL_HEALTH gets one outcome per call, not per attempt: a failure only
+    once the retries are used up.
+    """
+    try:
+        return await retry_async(
+            lambda: generate_once(model_name, prompt, api_key, cache_prefix),
+            classify=classify_error,
+            max_attempts=CALL_MAX_ATTEMPTS,
+            base_delay=CALL_RETRY_BASE_DELAY,
+            on_retry=lambda attempt, error, delay: print(f"🔁 {model_name} attempt {attempt} failed ({classify_error(error)}), retrying in {delay:.1f}s")
+        )
+    except asyncio.CancelledError:
+        # The run was cancelled (e.g. the client disconnected): drop the call, it says nothing about the model
+        MODEL_HEALTH.release(model_name)
+        raise
+    except Exception as e:
+        MODEL_HEALTH.record_failure(model_name, classify_error(e), str(e))
+        raise
+
+
+def route_model(model_name: str) -> Optional[str]:
+    """Model that should serve a call: the requested one, its fallback, or None if both are open"""
+    if MODEL_HEALTH.allow(model_name):
+        return model_name
+    fallback = MODEL_FALLBACKS.get(model_name)
+    if fallback and MODEL_HEALTH.allow(fallback):
+        return fallback
+    return None
+
+
+async def call_model_async(model_name: str, prompt: str, api_key: str, use_cache: bool = True, stage: str = "generation", cache_prefix: Optional[str] = None) -> Dict:
+    """Call a single model without blocking the event loop and return result
+
+    The call is recorded in the metrics under stage ("generation" or "evaluation").
+    cache_prefix marks the stable start of prompt for CONTEXT_CACHE.
+    """
+    result = await dispatch_model_call(model_name, prompt, api_key, use_cache, cache_prefix)
+    metrics.record_call(stage, result)
+    if result["success"] and not result.get("cached") and result.get("latency") is not None:
+        STAGE_LATENCIES.record(stage, result["model"], result["latency"])
+    return result
+
+
+async def dispatch_model_call(model_name: str, prompt: str, api_key: str, use_cache: bool = True, cache_prefix: Optional[str] = None) -> Dict:
+    """Serve one model call from the cache, a healthy model, a fallback or a hedge
+
+    Identical (model, prompt) pairs are answered from RESPONSE_CACHE unless use_cache is False.
+    Models whose circuit is open in MODEL_HEALTH are swapped for their MODEL_FALLBACKS
+    entry, or skipped without a network round trip when no healthy fallback exists.
+    Each attempt has a per-model deadline, retryable errors are retried with
+    backoff, and with HEDGING_ENABLED a slow call is raced against HEDGE_MODELS.
+    """
+    key = None
+    if use_cache and RESPONSE_CACHE is not None:
+        key = cache_key(model_name, prompt)
+        cached = await RESPONSE_CACHE.get_async(key)
+        if cached is not None:
+            return {
+                "model": model_name,
+                "output": cached,
+                "success": True,
+                "error": None,
+                "cached": True
+            }
+
+    target = route_model(model_name)
+    if target is None:
+        return {
+            "model": model_name,
+            "output": "",
+            "success": False,
+            "error": f"Circuit open for {model_name}: skipped",
+            "skipped": True
+        }
+    if target != model_name:
+        print(f"↪️ {model_name} is unhealthy, using fallback {target}")
+
+    started = time.monotonic()
+    backup = HEDGE_MODELS.get(target) if HEDGING_ENABLED else None
+    if backup and MODEL_HEALTH.state(backup) != "closed":
+        backup = None
+    hedge_after = MODEL_HEALTH.latency_percentile(target, 95) if backup else None
+
+    try:
+        if hedge_after is not None:
+            ((output, usage), attempts), hedge_fired, backup_won = await hedge_async(
+                lambda: generate_with_retries(target, prompt, api_key, cache_prefix),
+                lambda: generate_with_retries(backup, prompt, api_key, cache_prefix),
+                hedge_after
+            )
+        else:
+            ((output, usage), attempts), hedge_fired, backup_won = await generate_with_retries(target, prompt, api_key, cache_prefix), False, False
+    except Exception as e:
+        return {
+            "model": target,
+            "output": "",
+            "success": False,
+            "error": str(e),
+            "latency": round(time.monotonic() - started, 3)
+        }
+
+    served_by = backup if backup_won else target
+    if backup_won:
+        print(f"🏁 Hedge: {backup} answered before {target}")
+    if key is not None and output and served_by == model_name:
+        await RESPONSE_CACHE.put_async(key, model_name, output)
+    result = {
+        "model": served_by,
+        "output": output,
+        "success": True,
+        "error": None,
+        "attempts": attempts,
+        "hedge_fired": hedge_fired,
+        "backup_won": backup_won,
+        "latency": round(time.monotonic() - started, 3),
+        **usage
+    }
+    if served_by != model_name:
+        result["requested_model"] = model_name
+    return result
 
 def sequential_model_chain(
     initial_task: str,
@@ -378,7 +888,7 @@ def display_chain_results(result: Dict, show_all_steps: bool = False):
             print(f"Step {step['step']}: {step['model']}")
             print(f"Status: {'✅ Success' if step['success'] else '❌ Failed'}")
             if step["success"]:
-                print(f"Output preview:\n{step['output'][:300]}...")
+                print(f"Output preview:\n{load_output(step)[:300]}...")
             else:
                 print(f"Error: {step['error']}")
     
@@ -395,9 +905,7 @@ def display_chain_results(result: Dict, show_all_steps: bool = False):
     print(f"Success rate: {(result['successful_models']/result['total_models']*100):.1f}%")
 
 def save_chain_results(result: Dict, filename: str = "chain_output"):
-    """Save results to file"""
-    import os
-    
+    """Save results to file (all_steps.json is streamed step by step, outputs read back from ARTIFACTS)"""
     os.makedirs(f"{filename}_results", exist_ok=True)
     
     # Save final output
@@ -406,7 +914,7 @@ def save_chain_results(result: Dict, filename: str = "chain_output"):
     
     # Save all steps
     with open(f"{filename}_results/all_steps.json", "w") as f:
-        json.dump(result, f, indent=2)
+        write_result_json(result, f, load_output)
     
     # Save summary
     with open(f"{filename}_results/summary.txt", "w") as f:
@@ -424,37 +932,536 @@ def save_chain_results(result: Dict, filename: str = "chain_output"):
 # Example usage
 
 
-def super_code_generator(task: str, api_key: str, mode: str = "fast") -> str:
+def super_code_generator(task: str, api_key: str, mode: str = "fast", execution: str = "sequential") -> str:
     """Generate a super code for the task
     
     Args:
         task: The task description
         api_key: Google AI Studio API key
         mode: "fast", "advance", or "full power" - determines which model chain to use
+        execution: "sequential", "pipelined" or "tournament" - how steps and their scoring are scheduled
+    """
+    return asyncio.run(super_code_generator_async(task, api_key, mode, execution=execution))
+
+
+async def super_code_generator_async(task: str, api_key: str, mode: str = "fast", on_step: Optional[Callable[[Dict], None]] = None, execution: str = "sequential", **engine_options) -> str:
+    """Async variant of super_code_generator, safe to await from the API event loop
+
+    on_step is forwarded to the chain so callers can observe each step as it finishes;
+    engine_options (e.g. use_cache) go to sequential_model_chain_with_full_history_async.
     """
+    result = await run_chain_async(task, api_key, mode, execution=execution, on_step=on_step, **engine_options)
+    return result["final_output"]
+
+
+EXECUTION_MODES = ("sequential", "pipelined", "tournament")
+
+# Chain state is checkpointed after every step so an interrupted run can be resumed
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "1") == "1"
+CHECKPOINTS = CheckpointStore(
+    os.getenv("CHECKPOINT_PATH", os.path.join(os.getenv("DEVGENIE_DATA_DIR", ".devgenie"), "checkpoints.db")),
+    ttl=float(os.getenv("CHECKPOINT_TTL", str(7 * 24 * 3600))),
+) if CHECKPOINT_ENABLED else None
+# Step outputs of the async engines live in ARTIFACTS; results, all_responses
+# and checkpoints only carry their handle (output_ref)
+ARTIFACTS_ENABLED = os.getenv("ARTIFACTS_ENABLED", "1") == "1"
+ARTIFACTS = ArtifactStore(
+    os.getenv("ARTIFACTS_PATH", os.path.join(os.getenv("DEVGENIE_DATA_DIR", ".devgenie"), "artifacts")),
+    segment_bytes=int(os.getenv("ARTIFACTS_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+    max_bytes=int(os.getenv("ARTIFACTS_MAX_BYTES", str(1024 * 1024 * 1024))),
+) if ARTIFACTS_ENABLED else None
+
+
+async def stash_output(entry: Dict) -> Dict:
+    """Move entry["output"] into ARTIFACTS, leaving its handle in entry["output_ref"]
+
+    The write runs on a worker thread; entry keeps its inline output until the
+    handle is set, so readers never see it without either.
+    """
+    if ARTIFACTS is not None and entry.get("output"):
+        entry["output_ref"] = await ARTIFACTS.put_async(entry["output"])
+        del entry["output"]
+    return entry
+
+
+def load_output(entry: Dict) -> str:
+    """Output text of a step or scored response, inline or from ARTIFACTS"""
+    if "output" in entry:
+        return entry["output"]
+    if not entry.get("output_ref"):
+        return ""
+    if ARTIFACTS is None:
+        raise RuntimeError("Step output is in the artifact store but ARTIFACTS_ENABLED=0")
+    return ARTIFACTS.get(entry["output_ref"])
+
+
+# Engine options stored with a checkpoint and re-applied on resume
+RESUMABLE_OPTIONS = ("use_cache", "prompt_token_budget", "prescore", "reconcile_policy")
+
+# Every finished run adds its steps' score gain, latency and failures per
+# (model, position) to MODEL_STATS; the adaptive scheduler builds chains from
+# them, with the static chain of the mode as its prior
+MODEL_STATS_ENABLED = os.getenv("MODEL_STATS_ENABLED", "1") == "1"
+MODEL_STATS = ModelStatsStore(
+    os.getenv("MODEL_STATS_PATH", os.path.join(os.getenv("DEVGENIE_DATA_DIR", ".devgenie"), "model_stats.db"))
+) if MODEL_STATS_ENABLED else None
+CHAIN_SCHEDULER = os.getenv("CHAIN_SCHEDULER", "static").lower()
+ADAPTIVE_SCHEDULER = AdaptiveScheduler(
+    MODEL_STATS,
+    exploration=float(os.getenv("SCHEDULER_EXPLORATION", "0.1")),
+    prior_latency=float(os.getenv("SCHEDULER_PRIOR_LATENCY", "10")),
+    min_gain=float(os.getenv("SCHEDULER_MIN_GAIN", "0.5")),
+) if MODEL_STATS is not None else None
+
+
+def plan_model_chain(mode: str = "fast", scheduler: Optional[str] = None) -> Dict:
+    """Models to run for a mode: the static chain, or the adaptive scheduler's pick"""
+    scheduler = (scheduler or CHAIN_SCHEDULER).lower()
+    if scheduler not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler: {scheduler}. Expected one of {', '.join(SCHEDULERS)}")
+    static_chain = get_model_chain_by_mode(mode)
+    if scheduler == "static" or ADAPTIVE_SCHEDULER is None:
+        return {"strategy": "static", "models": static_chain, "explored": []}
+    return {"strategy": "adaptive", **ADAPTIVE_SCHEDULER.build_chain(static_chain)}
+
+
+# Per-request budgets (RunRequest.deadline_ms / max_cost). Steps are planned
+# with the DEADLINE_PERCENTILE of each model's recent call latency; models with
+# too few samples are assumed to take DEFAULT_STEP_SECONDS per step.
+DEADLINE_PERCENTILE = float(os.getenv("DEADLINE_PERCENTILE", "90"))
+DEADLINE_MIN_SAMPLES = int(os.getenv("DEADLINE_MIN_SAMPLES", "5"))
+# Only used before the process has seen any generation call
+DEFAULT_STEP_SECONDS = float(os.getenv("DEFAULT_STEP_SECONDS", "20"))
+# Per-(stage, model) latencies of served calls; budgets plan with these
+STAGE_LATENCIES = StageLatencies()
+# Kept free at the end of a deadline for selecting the best output and answering
+DEADLINE_SELECTION_RESERVE = float(os.getenv("DEADLINE_SELECTION_RESERVE_MS", "500")) / 1000
+# Template text around the task and previous output in step and judge prompts
+PROMPT_OVERHEAD_TOKENS = 300
+JUDGE_MODEL = "gemini-2.5-flash"
+
+# Tasks a chain engine spawns besides its own (pipelined generation and scoring);
+# run_within_budget cancels them together with the engine
+CHAIN_TASKS: contextvars.ContextVar = contextvars.ContextVar("devgenie_chain_tasks", default=None)
+
+
+def spawn_chain_task(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    tasks = CHAIN_TASKS.get()
+    if tasks is not None:
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    return task
+
+
+def estimate_step_seconds(model: str) -> float:
+    """Expected time of one step on model (generation plus judge), from running latency percentiles
+
+    A model with too few generation samples of its own is estimated from the
+    generation latencies of all models, so it can still be planned (and
+    measured); DEFAULT_STEP_SECONDS applies only when there are none at all.
+    """
+    generation = (
+        STAGE_LATENCIES.percentile("generation", model, DEADLINE_PERCENTILE, DEADLINE_MIN_SAMPLES)
+        or STAGE_LATENCIES.pooled_percentile("generation", DEADLINE_PERCENTILE, min_samples=1)
+    )
+    if generation is None:
+        return DEFAULT_STEP_SECONDS
+    judge = (
+        STAGE_LATENCIES.percentile("evaluation", JUDGE_MODEL, DEADLINE_PERCENTILE, DEADLINE_MIN_SAMPLES)
+        or STAGE_LATENCIES.pooled_percentile("evaluation", DEADLINE_PERCENTILE, min_samples=1)
+        or 0.0
+    )
+    return generation + judge
+
+
+def estimate_step_tokens(task: str, step: int, prompt_token_budget: Optional[int] = None) -> int:
+    """Expected input + output tokens of one step and its judge call"""
+    budget = PROMPT_TOKEN_BUDGET if prompt_token_budget is None else prompt_token_budget
+    previous = 0 if step == 1 else min(EXPECTED_OUTPUT_TOKENS, budget or EXPECTED_OUTPUT_TOKENS)
+    task_tokens = estimate_tokens(task)
+    generation = task_tokens + previous + PROMPT_OVERHEAD_TOKENS + EXPECTED_OUTPUT_TOKENS
+    judge = task_tokens + EXPECTED_OUTPUT_TOKENS + PROMPT_OVERHEAD_TOKENS
+    return generation + judge
+
+
+def fit_chain_to_budget(rounds: List[List[str]], task: str, seconds: Optional[float], tokens: Optional[int], skip: bool = True, prompt_token_budget: Optional[int] = None) -> Dict:
+    """Models of the chain expected to finish within seconds and tokens
+
+    A round takes as long as its slowest step (sequential chains are rounds of
+    one). With skip, a model that does not fit is dropped and later, faster
+    ones are still tried; otherwise (tournament) the chain is cut after the
+    first round that does not fit completely. The first model always runs.
+    """
+    kept_rounds, dropped = [], []
+    elapsed, spent = 0.0, 0
+    for index, round_models in enumerate(rounds):
+        kept, round_seconds = [], 0.0
+        for model in round_models:
+            step = sum(len(r) for r in kept_rounds) + len(kept) + 1
+            cost = estimate_step_tokens(task, step, prompt_token_budget)
+            needed = max(round_seconds, estimate_step_seconds(model))
+            fits = (seconds is None or elapsed + needed <= seconds) and (tokens is None or spent + cost <= tokens)
+            if fits or step == 1:
+                kept.append(model)
+                round_seconds = needed
+                spent += cost
+            else:
+                dropped.append(model)
+        if kept:
+            kept_rounds.append(kept)
+            elapsed += round_seconds
+        if not skip and len(kept) < len(round_models):
+            dropped.extend(m for later in rounds[index + 1:] for m in later)
+            break
+    return {
+        "models": [m for r in kept_rounds for m in r],
+        "dropped": dropped,
+        "expected_seconds": round(elapsed, 3),
+        "expected_tokens": spent,
+    }
+
+
+class BudgetExhausted(Exception):
+    """Raised at a step boundary when the next step would overrun the run's deadline or max_cost"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+async def run_within_budget(engine: Awaitable[Dict], deadline_at: Optional[float] = None) -> Tuple[Optional[Dict], Optional[str]]:
+    """Await a chain engine, stopping it at deadline_at (time.monotonic) or on BudgetExhausted
+
+    Returns (result, None) when the engine finished, otherwise (None, reason)
+    with reason "deadline" or "max_cost". The engine and the tasks it spawned
+    are cancelled when it is stopped or when the caller is cancelled.
+    """
+    children = set()
+    token = CHAIN_TASKS.set(children)
+    try:
+        task = asyncio.ensure_future(engine)
+    finally:
+        CHAIN_TASKS.reset(token)
+    try:
+        timeout = None if deadline_at is None else max(0.0, deadline_at - time.monotonic())
+        await asyncio.wait({task}, timeout=timeout)
+    finally:
+        pending = [t for t in (task, *children) if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.wait(pending)
+    if task.cancelled():
+        return None, "deadline"
+    if isinstance(task.exception(), BudgetExhausted):
+        return None, task.exception().reason
+    return task.result(), None
+
+
+def partial_chain_result(initial_task: str, models: List[str], state: Dict, reason: str, policy: Optional[Dict]) -> Dict:
+    """Chain result from the last completed step of a run stopped by its deadline or max_cost"""
+    results = list(state.get("results", []))
+    all_responses = list(state.get("all_responses", []))
+    if all_responses:
+        final_output, _, _ = find_best_response(all_responses)
+    else:
+        final_output = next((load_output(r) for r in reversed(results) if r["success"]), "")
+    stopper = EarlyStopTracker(policy)
+    if state.get("early_stop"):
+        stopper.restore(state["early_stop"])
+    stopper.reason = "deadline reached" if reason == "deadline" else "max_cost reached"
+    print(f"⏰ Chain stopped after {state.get('steps_run', 0)}/{len(models)} steps: {stopper.reason}")
+    return {
+        **summarize_chain(initial_task, final_output, results, all_responses, models, stopper, state.get("steps_run", 0)),
+        "scoring_enabled": True,
+    }
+
+
+async def run_chain_async(
+    task: str,
+    api_key: str,
+    mode: str = "fast",
+    execution: str = "sequential",
+    on_step: Optional[Callable[[Dict], None]] = None,
+    run_id: Optional[str] = None,
+    resume_state: Optional[Dict] = None,
+    scheduler: Optional[str] = None,
+    models: Optional[List[str]] = None,
+    deadline_ms: Optional[int] = None,
+    max_cost: Optional[int] = None,
+    **engine_options
+) -> Dict:
+    """Run the mode's model chain with the chosen execution strategy and return the full result
+
+    With CHECKPOINTS enabled the chain state is saved under run_id (generated
+    when not given) after every step; see resume_chain_async.
+
+    scheduler ("static" or "adaptive", default CHAIN_SCHEDULER) picks the
+    models unless they are given, as they are on resume.
+
+    deadline_ms and max_cost (input + output tokens of all calls) cut the
+    chain to the models expected to fit, stop before a step that would
+    overrun, and at the deadline return the best output scored so far.
+
+    Cancelling the awaiting task (the API does so when the client disconnects)
+    stops the chain at its current await: in-flight model calls are abandoned,
+    no further steps start, and the skipped steps are counted in the metrics.
+    """
+    execution = (execution or "sequential").lower()
+    if execution not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode: {execution}. Expected one of {', '.join(EXECUTION_MODES)}")
+    if deadline_ms is not None and deadline_ms <= DEADLINE_SELECTION_RESERVE * 1000:
+        raise ValueError(f"deadline_ms must be above the {DEADLINE_SELECTION_RESERVE * 1000:.0f} ms selection reserve")
     # Get the appropriate model chain based on mode
-    models = get_model_chain_by_mode(mode)
-    
-    #result = sequential_model_chain(
-     #   initial_task=task,
-      #  api_key=api_key,
-       # models=models,
-        #verbose=True
-    #)
-    result=sequential_model_chain_with_full_history(
-        initial_task=task,
+    plan = {"strategy": scheduler or "static", "models": models, "explored": []} if models else plan_model_chain(mode, scheduler)
+    models = plan["models"]
+    started = time.monotonic()
+    budget = None
+    if deadline_ms or max_cost:
+        budget = fit_chain_to_budget(
+            split_into_rounds(models, CHAIN_ROUND_SIZES.get(canonical_mode(mode))) if execution == "tournament" else [[m] for m in models],
+            task,
+            deadline_ms / 1000 - DEADLINE_SELECTION_RESERVE if deadline_ms else None,
+            max_cost,
+            skip=execution != "tournament",
+            prompt_token_budget=engine_options.get("prompt_token_budget"),
+        )
+        models = budget["models"]
+        print(f"⏱️ Budget plan: {len(models)} of {len(plan['models'])} models, ~{budget['expected_seconds']}s, ~{budget['expected_tokens']} tokens")
+    deadline_at = started + deadline_ms / 1000 - DEADLINE_SELECTION_RESERVE if deadline_ms else None
+    
+    run_id = run_id or uuid.uuid4().hex
+    if CHECKPOINTS is not None and resume_state is None:
+        options = {k: v for k, v in engine_options.items() if k in RESUMABLE_OPTIONS}
+        options.update(scheduler=plan["strategy"], models=models)
+        await CHECKPOINTS.start_async(run_id, task, canonical_mode(mode), execution, hash_api_key(api_key), options)
+    progress = dict(resume_state or {})
+
+    async def save_progress(state: Dict):
+        # The engine's live lists: a run stopped mid-step still has every scored output
+        progress.clear()
+        progress.update(state)
+        if CHECKPOINTS is not None:
+            await CHECKPOINTS.save_async(run_id, state)
+
+    async def check_budget(steps_run: int):
+        # The first model always runs; after that, only steps expected to fit start
+        if steps_run == 0 or steps_run >= len(models) or budget is None:
+            return
+        if max_cost and run_metrics.tokens_used() + estimate_step_tokens(task, steps_run + 1, engine_options.get("prompt_token_budget")) > max_cost:
+            raise BudgetExhausted("max_cost")
+        if deadline_at is not None and time.monotonic() + estimate_step_seconds(models[steps_run]) > deadline_at:
+            raise BudgetExhausted("deadline")
+
+    engine_options["checkpoint"] = save_progress
+    engine_options["before_step"] = check_budget
+    engine_options = {"early_stop": get_early_stop_policy(mode), **engine_options, "resume_state": resume_state}
+    resumed_from = resume_state["steps_run"] if resume_state else 0
+    if CASSETTE is not None:
+        CASSETTE.record_run(task, canonical_mode(mode), execution)
+    steps_done = resumed_from
+
+    def track_step(event: Dict):
+        nonlocal steps_done
+        steps_done += 1
+        if on_step:
+            on_step(event)
+
+    # Fair-queuing weight inversely proportional to the chain's length: at a
+    # contended lane a 3-step chain gets five times the share of a 15-step one
+    with metrics.collect_run(canonical_mode(mode), execution) as run_metrics, fair_share_flow(weight=1.0 / max(1, len(models))):
+        try:
+            if execution == "tournament":
+                engine = tournament_model_chain_async(
+                    initial_task=task,
+                    api_key=api_key,
+                    rounds=split_into_rounds(models, CHAIN_ROUND_SIZES.get(canonical_mode(mode))),
+                    on_step=track_step,
+                    **engine_options
+                )
+            else:
+                #result = sequential_model_chain(
+                 #   initial_task=task,
+                  #  api_key=api_key,
+                   # models=models,
+                    #verbose=True
+                #)
+                engine = sequential_model_chain_with_full_history_async(
+                    initial_task=task,
+                    api_key=api_key,
+                    models=models,
+                    verbose=True,
+                    scoring_enabled=True,
+                    select_best_from_all=False,
+                    on_step=track_step,
+                    pipelined=execution == "pipelined",
+                    **engine_options
+                )
+            result, stopped_by = await run_within_budget(engine, deadline_at)
+            if result is None:
+                result = partial_chain_result(task, models, progress, stopped_by, engine_options.get("early_stop"))
+        except asyncio.CancelledError:
+            print(f"🛑 Run {run_id[:8]} cancelled after {steps_done}/{len(models)} steps")
+            metrics.record_cancelled(run_metrics.mode, execution, len(models) - steps_done)
+            if CHECKPOINTS is not None:
+                # Synchronous on purpose: the task is already cancelled. The run stays resumable.
+                CHECKPOINTS.finish(run_id, "cancelled")
+            raise
+
+    if CHECKPOINTS is not None:
+        await CHECKPOINTS.finish_async(run_id, "completed")
+    metrics.record_steps(run_metrics.mode, execution, [s for s in result["all_steps"] if s["step"] > resumed_from])
+    if MODEL_STATS is not None:
+        await MODEL_STATS.record_async(chain_observations(result, start_after=resumed_from))
+    result["performance_metrics"] = run_metrics.summary(result["all_steps"])
+    result["scheduler"] = {
+        "strategy": plan["strategy"],
+        "models": models,
+        "explored_steps": plan["explored"],
+        "expected_seconds": plan.get("expected_seconds"),
+    }
+    result["budget"] = {
+        "deadline_ms": deadline_ms,
+        "max_cost": max_cost,
+        "models_planned": len(models),
+        "models_dropped": budget["dropped"],
+        "expected_seconds": budget["expected_seconds"],
+        "expected_tokens": budget["expected_tokens"],
+        "stopped_by": stopped_by,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+        "tokens_used": run_metrics.tokens_used(),
+    } if budget is not None else None
+    result["run_id"] = run_id
+    result["resumed_from_step"] = resumed_from if resume_state else None
+    return result
+
+
+class CheckpointNotFound(KeyError):
+    """No checkpoint is stored for the requested run id"""
+
+
+class CheckpointOutputsMissing(Exception):
+    """Step outputs a checkpoint refers to were dropped from ARTIFACTS"""
+
+
+async def resume_chain_async(run_id: str, api_key: str, on_step: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Continue a checkpointed run after its last completed step
+
+    The API key must be the one the run was started with; the task, mode,
+    execution and options come from the checkpoint. Raises
+    CheckpointOutputsMissing when older artifact segments holding the run's
+    outputs have since been deleted.
+    """
+    if CHECKPOINTS is None:
+        raise RuntimeError("Checkpointing is disabled (CHECKPOINT_ENABLED=0)")
+    checkpoint = await CHECKPOINTS.load_async(run_id)
+    if checkpoint is None:
+        raise CheckpointNotFound(run_id)
+    if checkpoint["key_hash"] != hash_api_key(api_key):
+        raise PermissionError(f"Run {run_id} was started with a different API key")
+    state = checkpoint["state"] or {}
+    missing = sorted({
+        entry["step"] for entry in [*state.get("results", []), *state.get("all_responses", [])]
+        if entry.get("output_ref") and (ARTIFACTS is None or entry["output_ref"] not in ARTIFACTS)
+    })
+    if missing:
+        raise CheckpointOutputsMissing(f"Outputs of run {run_id} (steps {', '.join(map(str, missing))}) are no longer in the artifact store")
+    CHECKPOINTS.counters["resumes"] += 1
+    return await run_chain_async(
+        task=checkpoint["task"],
         api_key=api_key,
-        models=models,
-        verbose=True,
-        scoring_enabled=True,
-        select_best_from_all=False
+        mode=checkpoint["mode"],
+        execution=checkpoint["execution"],
+        on_step=on_step,
+        run_id=run_id,
+        resume_state=checkpoint["state"],
+        **checkpoint["options"]
     )
 
-    return result["final_output"]
+
+def resume_chain(run_id: str, api_key: str) -> Dict:
+    """Blocking variant of resume_chain_async, e.g. after a crashed script run"""
+    return asyncio.run(resume_chain_async(run_id, api_key))
+
+
+
+
+
+def build_chain_prefix(initial_task: str) -> str:
+    """Rubric and task: the start every generation and judge prompt of a chain shares, so it can be cached"""
+    return f"""You are part of a chain of AI models working together on a task. Every response in the chain is scored 1-100 on:
+1. Task completion (30 points): How well does it address the original task?
+2. Code quality (25 points): Is the code clean, efficient, and well-structured?
+3. Documentation (20 points): Is it well-documented and explained?
+4. Error handling (15 points): Does it handle edge cases and errors?
+5. Completeness (10 points): Is the solution complete and usable?
+
+Original Task: {initial_task}
+
+"""
+
+
+def build_step_prompt(step: int, total_models: int, initial_task: str, previous_model: str, current_output: str) -> str:
+    """Build the prompt for one step of the full-history chain"""
+    if step == 1:
+        return build_chain_prefix(initial_task) + f"""You are the first model in a chain of {total_models} AI models.
+
+Your job: Analyze this task and provide your best solution/analysis. The next model will refine your output.
+
+Provide a detailed, complete response."""
+    return build_chain_prefix(initial_task) + f"""You are model {step} in a chain of {total_models} AI models.
+
+Previous Model ({previous_model}) Output:
+{current_output}
+
+Your job: Review the previous output and IMPROVE it by:
+1. Fixing any errors or issues
+2. Adding missing details
+3. Improving clarity and quality
+4. Optimizing the solution
+5. Making it more complete
+
+Provide your improved version. The next model will further refine it."""
 
 
+# Token budget for the previous output embedded in a step prompt (0 disables compaction)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
 
 
+def prepare_step_prompt(step: int, total_models: int, initial_task: str, previous_model: str, current_output: str, compactor: PromptCompactor):
+    """Build a step prompt with the previous output compacted to the budget
+
+    Returns (prompt, estimated input tokens saved by compaction).
+    """
+    tokens_saved = 0
+    if step > 1:
+        current_output, tokens_saved = compactor.compact(current_output)
+        if tokens_saved:
+            print(f"✂️ Step {step}: compacted previous output, ~{tokens_saved} input tokens saved")
+    return build_step_prompt(step, total_models, initial_task, previous_model, current_output), tokens_saved
+
+
+def build_step_event(step: int, models: List[str], result: Dict, all_responses: List[Dict], current_output: str, latency: float = None) -> Dict:
+    """Summarize a finished chain step for progress hooks"""
+    event = {
+        "step": step,
+        "total_steps": len(models),
+        "model": result["model"],
+        "success": result["success"],
+        "error": result["error"],
+        "latency": latency,
+        "score": None,
+        "best_model": None,
+        "best_score": None,
+        "best_output": current_output,
+    }
+    if all_responses and all_responses[-1]["step"] == step:
+        event["score"] = all_responses[-1]["score"]
+    if all_responses:
+        _, event["best_score"], event["best_model"] = find_best_response(all_responses)
+    return event
+
 
 def sequential_model_chain_with_full_history(
     initial_task: str,
@@ -462,186 +1469,578 @@ def sequential_model_chain_with_full_history(
     models: List[str] = None,
     verbose: bool = True,
     scoring_enabled: bool = True,
-    select_best_from_all: bool = False
+    select_best_from_all: bool = False,
+    **engine_options
 ) -> Dict:
+    """Blocking wrapper around sequential_model_chain_with_full_history_async"""
+    return asyncio.run(sequential_model_chain_with_full_history_async(
+        initial_task=initial_task,
+        api_key=api_key,
+        models=models,
+        verbose=verbose,
+        scoring_enabled=scoring_enabled,
+        select_best_from_all=select_best_from_all,
+        **engine_options
+    ))
 
 
-    
-    results = []
-    current_output = initial_task
-    all_responses = []  # Store all successful responses with scores
-    all_outputs_history = []  # Store all outputs for history tracking
-    best_selections = []  # Track when best selection occurs
-    
-    for i, model in enumerate(models, 1):
+# How a pipelined chain reacts when a late score changes the best output:
+# "accept" keeps the step that already started on the fresh output,
+# "restart" re-runs that step on the newly selected best output.
+PIPELINE_RECONCILE_POLICY = os.getenv("PIPELINE_RECONCILE_POLICY", "accept")
 
-        # Create refinement prompt
-        if i == 1:
-            prompt = f"""You are the first model in a chain of {len(models)} AI models working together.
 
-Task: {current_output}
+# Local pre-scoring: the LLM judge only runs when the local score puts a
+# step within PRESCORE_MARGIN points of the current best
+PRESCORE_ENABLED = os.getenv("PRESCORE_ENABLED", "1") == "1"
+PRESCORE_MARGIN = int(os.getenv("PRESCORE_MARGIN", "15"))
 
-Your job: Analyze this task and provide your best solution/analysis. The next model will refine your output.
+# Duplicate detection: a step whose code matches an already scored output
+# exactly, or differs in at most DEDUP_MAX_DISTANCE of 64 simhash bits,
+# reuses that output's judge score
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", "3"))
 
-Provide a detailed, complete response
-HINT:
-1. Task completion (30 points)
-2. Code quality (25 points)
-3. Documentation (20 points)
-4. Error handling (15 points)
-5. Completeness (10 points)
-."""
-        else:
-            # For models after first, we can include history if select_best_from_all is True
-            prompt = f"""You are model {i} in a chain of {len(models)} AI models working together.
 
-            Original Task: {initial_task}
+class ScoredResponses(list):
+    """all_responses list that keeps its best entry and output fingerprints up to date on append
+
+    Best is a heap on (-score, insertion order), so ties go to the earliest
+    entry exactly like the linear scan in find_best_response.
+    """
+
+    def __init__(self, responses=()):
+        super().__init__()
+        self._heap = []
+        self._index = FingerprintIndex(DEDUP_MAX_DISTANCE)
+        for response in responses:
+            self.append(response)
+
+    def append(self, response: Dict):
+        heapq.heappush(self._heap, (-response["score"], len(self), response))
+        super().append(response)
+        if DEDUP_ENABLED:
+            self._index.add(fingerprint(load_output(response)), response)
+
+    def extend(self, responses):
+        for response in responses:
+            self.append(response)
+
+    def best(self) -> Optional[Dict]:
+        return self._heap[0][2] if self._heap else None
+
+    def find_duplicate(self, fp) -> Optional[Tuple[str, Dict]]:
+        """("exact" | "near", scored response) whose output matches fingerprint fp, or None"""
+        return self._index.lookup(fp) if DEDUP_ENABLED else None
+
+    def snapshot(self) -> "ScoredResponses":
+        """Copy for a scoring task running alongside later appends"""
+        copy = ScoredResponses()
+        list.extend(copy, self)
+        copy._heap = list(self._heap)
+        copy._index = self._index.copy()
+        return copy
+
+
+async def score_step_output(output: str, initial_task: str, api_key: str, step: int, all_responses: List[Dict], prescore: bool = True, use_cache: bool = True) -> Dict:
+    """Score a step's output, consulting the LLM judge only when it could become the best"""
+    if DEDUP_ENABLED and isinstance(all_responses, ScoredResponses) and all_responses:
+        match = all_responses.find_duplicate(await asyncio.to_thread(fingerprint, output))
+        if match is not None:
+            kind, original = match
+            print(f"♻️ Step {step}: output is a{'n' if kind == 'exact' else ''} {kind} duplicate of step {original['step']}, reusing its score")
+            return {"score": original["score"] - original["step"], "success": True, "source": "duplicate", "duplicate_of": original["step"], "match": kind}
+
+    if not prescore:
+        return {**await evaluate_response_quality_async(output, initial_task, api_key, use_cache), "source": "llm"}
+
+    local = await local_prescore_async(output, initial_task)
+    if all_responses:
+        _, best_score, _ = find_best_response(all_responses)
+        if local["score"] + step < best_score - PRESCORE_MARGIN:
+            print(f"⏭️ Step {step}: local score {local['score']} is far below best {best_score}, skipping judge")
+            return {"score": local["score"], "success": True, "source": "local", "prescore": local}
+
+    evaluation = await evaluate_response_quality_async(output, initial_task, api_key, use_cache)
+    return {**evaluation, "source": "llm", "prescore": local}
+
+
+async def rescore_pending_steps(results: List[Dict], all_responses: List[Dict], initial_task: str, api_key: str, prescore: bool, use_cache: bool, stopper: "EarlyStopTracker"):
+    """Score successful steps of a resumed chain whose (pipelined) evaluation was lost"""
+    scored = {r["step"] for r in all_responses}
+    for step in results:
+        if step["success"] and step["step"] not in scored:
+            output = load_output(step)
+            evaluation = await score_step_output(output, initial_task, api_key, step["step"], all_responses, prescore, use_cache)
+            await record_scored_response(all_responses, step["step"], step.get("requested_model", step["model"]), output, evaluation)
+            stopper.observe_score(evaluation["score"])
+
+
+async def record_scored_response(all_responses: List[Dict], step: int, model: str, output: str, evaluation: Dict) -> Dict:
+    """Append a scored step to all_responses (later steps get a +step tie-break bonus)"""
+    print(f"score is know model {model} {evaluation['score']}"+"step number is "+str(step))
+    scored_response = {
+        "step": step,
+        "model": model,
+        "output": output,
+        "score": evaluation["score"]+step,
+        "score_source": evaluation.get("source", "llm"),
+        "success": True
+    }
+    all_responses.append(scored_response)
+    await stash_output(scored_response)
+    return scored_response
+
+
+async def sequential_model_chain_with_full_history_async(
+    initial_task: str,
+    api_key: str,
+    models: List[str] = None,
+    verbose: bool = True,
+    scoring_enabled: bool = True,
+    select_best_from_all: bool = False,
+    on_step: Optional[Callable[[Dict], None]] = None,
+    pipelined: bool = False,
+    reconcile_policy: str = None,
+    prescore: Optional[bool] = None,
+    use_cache: bool = True,
+    early_stop: Optional[Dict] = None,
+    prompt_token_budget: Optional[int] = None,
+    checkpoint: Optional[Callable[[Dict], Awaitable[None]]] = None,
+    before_step: Optional[Callable[[int], Awaitable[None]]] = None,
+    resume_state: Optional[Dict] = None
+) -> Dict:
+    """Run the full-history chain; on_step, if given, is called with a summary after every step
+
+    With pipelined=True a step's evaluation runs alongside the next model's
+    generation, which starts from the fresh (not yet scored) output. When the
+    late score makes a different output the best one, reconcile_policy
+    ("accept" or "restart") decides whether the in-flight step is kept or
+    re-run on the new best.
 
-            Previous Model ({results[-1]['model']}) Output:
-            {current_output}
+    With prescore (default PRESCORE_ENABLED) each output is first scored
+    locally and the LLM judge is skipped when it clearly cannot win.
 
+    use_cache=False bypasses the response cache for every call of this run.
 
-            Your job: Review the previous output and IMPROVE it by:
-            1. Fixing any errors or issues
-            2. Adding missing details
-            3. Improving clarity and quality
-            4. Optimizing the solution
-            5. Making it more complete
+    early_stop takes an EARLY_STOP_POLICIES entry; when it triggers the
+    remaining models are skipped and the result reports how many.
 
-            Provide your improved version.
-            HINT:
-            1. Task completion (30 points)
-            2. Code quality (25 points)
-            3. Documentation (20 points)
-            4. Error handling (15 points)
-            5. Completeness (10 points)
-            """   
+    prompt_token_budget (default PROMPT_TOKEN_BUDGET) caps the previous
+    output embedded in each prompt; larger outputs are compacted to their
+    code plus new prose, and each step reports the input tokens saved.
+
+    checkpoint, if given, is awaited with the chain state after every step;
+    passing that state back as resume_state continues after its last step.
+    before_step, if given, is awaited with the number of steps run before
+    each further step starts; it may raise to stop the chain there.
+    """
+
+    if models is None:
+        models = MODEL_CHAIN3  # Default to fast mode
+    reconcile_policy = reconcile_policy or PIPELINE_RECONCILE_POLICY
+    if prescore is None:
+        prescore = PRESCORE_ENABLED
+    if reconcile_policy not in ("accept", "restart"):
+        raise ValueError(f"Unknown reconcile policy: {reconcile_policy}")
+    
+    results = []
+    current_output = initial_task
+    all_responses = ScoredResponses()  # Store all successful responses with scores
+    all_outputs_history = []  # Store all outputs for history tracking
+    best_selections = []  # Track when best selection occurs
+    pending_evaluation = None  # (task, step, model, output) still being scored in pipelined mode
+    divergences = 0
+    restarts = 0
+    stopper = EarlyStopTracker(early_stop)
+    compactor = PromptCompactor(PROMPT_TOKEN_BUDGET if prompt_token_budget is None else prompt_token_budget)
+    previous_success_output = None
+    steps_run = 0
+    if resume_state:
+        results = resume_state["results"]
+        all_responses = ScoredResponses(resume_state["all_responses"])
+        current_output = resume_state["current_output"]
+        previous_success_output = resume_state["previous_success_output"]
+        steps_run = resume_state["steps_run"]
+        divergences = resume_state.get("divergences", 0)
+        restarts = resume_state.get("restarts", 0)
+        stopper.restore(resume_state["early_stop"])
+        if scoring_enabled:
+            await rescore_pending_steps(results, all_responses, initial_task, api_key, prescore, use_cache, stopper)
+        for step in results:
+            if step["success"]:
+                compactor.observe(load_output(step))
+        print(f"⏯️ Resuming chain after step {steps_run}/{len(models)}")
     
+    for i, model in enumerate(models, 1):
+        if i <= steps_run:
+            continue
+        if stopper.reason:  # resumed from a checkpoint written as the chain stopped early
+            break
+        if before_step is not None:
+            await before_step(steps_run)
+
+        # Create refinement prompt
+        previous_model = results[-1]["model"] if results else None
+        prompt, tokens_saved = prepare_step_prompt(i, len(models), initial_task, previous_model, current_output, compactor)
         
         # Call the model
-        result = call_model(model, prompt, api_key)
+        step_started = time.monotonic()
+        generation = spawn_chain_task(call_model_async(model, prompt, api_key, use_cache, cache_prefix=build_chain_prefix(initial_task)))
+
+        if pending_evaluation is not None:
+            # Previous step's score lands while this step is generating
+            evaluation_task, scored_step, scored_model, scored_output = pending_evaluation
+            pending_evaluation = None
+            evaluation = await evaluation_task
+            await record_scored_response(all_responses, scored_step, scored_model, scored_output, evaluation)
+            stopper.observe_score(evaluation["score"])
+            best_output, score, best_model = find_best_response(all_responses)
+            if best_output != current_output:
+                divergences += 1
+                print(f"🔀 Step {i} started from a non-best output (best: {best_model}, {score})")
+                if reconcile_policy == "restart":
+                    generation.cancel()
+                    current_output = best_output
+                    prompt, tokens_saved = prepare_step_prompt(i, len(models), initial_task, previous_model, current_output, compactor)
+                    generation = spawn_chain_task(call_model_async(model, prompt, api_key, use_cache, cache_prefix=build_chain_prefix(initial_task)))
+                    restarts += 1
+
+        result = await generation
+        steps_run = i
         
         if result["success"]:
             
             current_output = result["output"]
+            compactor.observe(current_output)
+            await stopper.observe_outputs(previous_success_output, current_output)
+            previous_success_output = current_output
             
             
             # Evaluate and store with score
-            if scoring_enabled:
-                evaluation = evaluate_response_quality(current_output,initial_task,api_key)
-                print(f"score is know model {model} {evaluation['score']}"+"step number is "+str(i))
-                scored_response = {
-                    "step": i,
-                    "model": model,
-                    "output": current_output,
-                    "score": evaluation["score"]+i,
-                    "success": True
-                }
-                all_responses.append(scored_response)
+            if scoring_enabled and pipelined:
+                pending_evaluation = (
+                    spawn_chain_task(score_step_output(current_output, initial_task, api_key, i, all_responses.snapshot(), prescore, use_cache)),
+                    i, model, current_output
+                )
+            elif scoring_enabled:
+                evaluation = await score_step_output(current_output, initial_task, api_key, i, all_responses, prescore, use_cache)
+                await record_scored_response(all_responses, i, model, current_output, evaluation)
+                stopper.observe_score(evaluation["score"])
                 
-                current_output,score,model=find_best_response(all_responses)
+                current_output,score,best_model=find_best_response(all_responses)
                 print(f"best  score: {score}"+"step number is "+str(i))
-                print(f"best  output: {model}")
-                
-                
-
-
-                
-                
+                print(f"best  output: {best_model}")
         
-        results.append({
+        step_latency = round(time.monotonic() - step_started, 3)
+        results.append(await stash_output({
             **result,
             "step": i,
+            "latency": step_latency,
+            "prompt_tokens": estimate_tokens(prompt),
+            "input_tokens_saved": tokens_saved,
             "timestamp": datetime.now().isoformat()
-        })
-        
-        # BEST SELECTION LOGIC - After each model (except first)
+        }))
+
+        if checkpoint is not None:
+            await checkpoint({
+                "steps_run": i,
+                "results": results,
+                "all_responses": all_responses,
+                "current_output": current_output,
+                "previous_success_output": previous_success_output,
+                "early_stop": stopper.state(),
+                "divergences": divergences,
+                "restarts": restarts,
+            })
+
+        # Notify only once the step is durable, so a resume never repeats a step a client has seen
+        if on_step is not None:
+            on_step(build_step_event(i, models, result, all_responses, current_output, step_latency))
+
+        if stopper.reason:
+            print(f"🛑 Early stop after step {i}/{len(models)}: {stopper.reason}")
+            break
+
+    if pending_evaluation is not None:
+        evaluation_task, scored_step, scored_model, scored_output = pending_evaluation
+        evaluation = await evaluation_task
+        await record_scored_response(all_responses, scored_step, scored_model, scored_output, evaluation)
+        stopper.observe_score(evaluation["score"])
+    if pipelined and all_responses:
+        current_output, score, best_model = find_best_response(all_responses)
+        print(f"best  score: {score}, best  output: {best_model}")
+    
+    return {
+        **summarize_chain(initial_task, current_output, results, all_responses, models, stopper, steps_run),
+        "all_outputs_history": all_outputs_history,
+        "best_selections": best_selections,
+        "scoring_enabled": scoring_enabled,
+        "select_best_from_all": select_best_from_all,
+        "execution": "pipelined" if pipelined else "sequential",
+        "pipeline": {
+            "reconcile_policy": reconcile_policy,
+            "divergences": divergences,
+            "restarts": restarts,
+        } if pipelined else None,
+    }
 
 
-    
+def summarize_chain(initial_task: str, final_output: str, results: List[Dict], all_responses: List[Dict], models: List[str], stopper: "EarlyStopTracker", steps_run: int) -> Dict:
+    """Fields shared by every execution mode's result"""
     return {
         "initial_task": initial_task,
-        "final_output": current_output,
+        "final_output": final_output,
         "all_steps": results,
         "all_responses": all_responses,
-        "all_outputs_history": all_outputs_history,
-        "best_selections": best_selections,
         "total_models": len(models),
         "successful_models": sum(1 for r in results if r["success"]),
-        "scoring_enabled": scoring_enabled,
-        "select_best_from_all": select_best_from_all,
+        "cached_steps": sum(1 for r in results if r.get("cached")),
+        "judge_calls": sum(1 for r in all_responses if r["score_source"] == "llm"),
+        "judge_calls_skipped": sum(1 for r in all_responses if r["score_source"] == "local"),
+        "duplicate_steps": sum(1 for r in all_responses if r["score_source"] == "duplicate"),
+        "input_tokens_saved": sum(r.get("input_tokens_saved", 0) for r in results),
+        "early_stop": {
+            "policy": stopper.policy,
+            "stopped_early": steps_run < len(models),
+            "reason": stopper.reason if steps_run < len(models) else None,
+            "steps_run": steps_run,
+            "steps_skipped": len(models) - steps_run,
+        },
         "completed_at": datetime.now().isoformat()
     }
 
 
+async def tournament_model_chain_async(
+    initial_task: str,
+    api_key: str,
+    rounds: List[List[str]],
+    on_step: Optional[Callable[[Dict], None]] = None,
+    prescore: Optional[bool] = None,
+    use_cache: bool = True,
+    early_stop: Optional[Dict] = None,
+    prompt_token_budget: Optional[int] = None,
+    checkpoint: Optional[Callable[[Dict], Awaitable[None]]] = None,
+    before_step: Optional[Callable[[int], Awaitable[None]]] = None,
+    resume_state: Optional[Dict] = None
+) -> Dict:
+    """Run each round's models concurrently on the current best output
 
+    Every candidate in a round is generated and scored in parallel; the best
+    response so far (find_best_response over all rounds) seeds the next round.
+    Step numbers follow the flattened chain, so scores keep the same +step
+    tie-break as the sequential engine. checkpoint/resume_state and
+    before_step work as in the sequential engine, at round granularity.
+    """
+    if prescore is None:
+        prescore = PRESCORE_ENABLED
+    models = [model for round_models in rounds for model in round_models]
 
-def evaluate_response_quality(response: str, original_task: str, api_key: str) -> Dict:
-    """Evaluate the quality of a response against the original task."""
-    try:
-        evaluation_prompt = f"""
-You are an AI response evaluator. Score this response on a scale of 1-100 based on:
-1. Task completion (30 points): How well does it address the original task?
-2. Code quality (25 points): Is the code clean, efficient, and well-structured?
-3. Documentation (20 points): Is it well-documented and explained?
-4. Error handling (15 points): Does it handle edge cases and errors?
-5. Completeness (10 points): Is the solution complete and usable?
+    results = []
+    all_responses = ScoredResponses()
+    round_summaries = []
+    current_output = initial_task
+    best_model = None
+    stopper = EarlyStopTracker(early_stop, unit="rounds")
+    compactor = PromptCompactor(PROMPT_TOKEN_BUDGET if prompt_token_budget is None else prompt_token_budget)
+    steps_run = 0
+    rounds_done = 0
+    if resume_state:
+        results = resume_state["results"]
+        all_responses = ScoredResponses(resume_state["all_responses"])
+        round_summaries = resume_state["rounds"]
+        current_output = resume_state["current_output"]
+        best_model = resume_state["best_model"]
+        steps_run = resume_state["steps_run"]
+        rounds_done = len(round_summaries)
+        stopper.restore(resume_state["early_stop"])
+        for response in all_responses:
+            compactor.observe(load_output(response))
+        print(f"⏯️ Resuming tournament after round {rounds_done}/{len(rounds)}")
+
+    async def run_candidate(step: int, model: str, prompt: str, prior_responses: List[Dict]):
+        started = time.monotonic()
+        result = await call_model_async(model, prompt, api_key, use_cache, cache_prefix=build_chain_prefix(initial_task))
+        evaluation = None
+        if result["success"]:
+            evaluation = await score_step_output(result["output"], initial_task, api_key, step, prior_responses, prescore, use_cache)
+        return step, model, result, evaluation, round(time.monotonic() - started, 3)
+
+    for round_number, round_models in enumerate(rounds, 1):
+        if round_number <= rounds_done:
+            continue
+        if stopper.reason:  # resumed from a checkpoint written as the chain stopped early
+            break
+        if before_step is not None:
+            await before_step(steps_run)
+        round_started = time.monotonic()
+        seed = current_output
+        first_step = steps_run + 1
+        print(f"🏟️ Round {round_number}/{len(rounds)}: {', '.join(round_models)}")
+        # Every candidate of a round shares the seed, so it is compacted once
+        prompt_seed, tokens_saved = (seed, 0) if round_number == 1 else compactor.compact(seed)
+        if tokens_saved:
+            print(f"✂️ Round {round_number}: compacted seed output, ~{tokens_saved} input tokens saved per candidate")
+        # Round-1 candidates all start from the task, so they all get the first-model prompt;
+        # later rounds refine the best output so far
+        prompts = [
+            build_step_prompt(1 if round_number == 1 else first_step + offset, len(models), initial_task, best_model, prompt_seed)
+            for offset in range(len(round_models))
+        ]
+        outcomes = await asyncio.gather(*[
+            run_candidate(first_step + offset, model, prompts[offset], all_responses.snapshot())
+            for offset, model in enumerate(round_models)
+        ])
+        steps_run += len(round_models)
+
+        for (step, model, result, evaluation, latency), prompt in zip(outcomes, prompts):
+            if evaluation is not None:
+                await record_scored_response(all_responses, step, model, result["output"], evaluation)
+                compactor.observe(result["output"])
+            results.append(await stash_output({
+                **result,
+                "step": step,
+                "round": round_number,
+                "latency": latency,
+                "prompt_tokens": estimate_tokens(prompt),
+                "input_tokens_saved": tokens_saved,
+                "timestamp": datetime.now().isoformat()
+            }))
+
+        round_steps = range(first_step, steps_run + 1)
+        winner = None
+        if any(r["step"] in round_steps for r in all_responses):
+            winner_output, winner_score, winner_model = find_best_response(all_responses, among=round_steps)
+            winner = {"model": winner_model, "score": winner_score}
+            # Patience counts rounds: only the best raw score of the round is observed
+            stopper.observe_score(max(e["score"] for _, _, _, e, _ in outcomes if e is not None))
+            await stopper.observe_outputs(seed if round_number > 1 else None, winner_output)
+        if all_responses:
+            current_output, score, best_model = find_best_response(all_responses)
+            print(f"best  score: {score} after round {round_number}, best  output: {best_model}")
+        round_summaries.append({
+            "round": round_number,
+            "models": round_models,
+            "winner": winner,
+            "latency": round(time.monotonic() - round_started, 3),
+        })
+
+        if checkpoint is not None:
+            await checkpoint({
+                "steps_run": steps_run,
+                "results": results,
+                "all_responses": all_responses,
+                "rounds": round_summaries,
+                "current_output": current_output,
+                "best_model": best_model,
+                "early_stop": stopper.state(),
+            })
+
+        if on_step is not None:
+            for step, model, result, evaluation, latency in outcomes:
+                on_step(build_step_event(step, models, result, all_responses, current_output, latency))
+
+        if stopper.reason and steps_run < len(models):
+            print(f"🛑 Early stop after round {round_number}/{len(rounds)}: {stopper.reason}")
+            break
+
+    return {
+        **summarize_chain(initial_task, current_output, results, all_responses, models, stopper, steps_run),
+        "scoring_enabled": True,
+        "execution": "tournament",
+        "rounds": round_summaries,
+    }
+
+
+
+
+def build_evaluation_prompt(response: str, original_task: str) -> str:
+    """Build the judge prompt used to score a response"""
+    return build_chain_prefix(original_task) + f"""You are the judge. Score the response below on the scale above.
 
 CRITICAL: You MUST respond with ONLY a single number between 1-100. No explanations, no text, just the number.
 
 Example:
 85
 
-Original Task: {original_task}
-
 Response to Evaluate:
 {response}
 
 Your score (number only):"""
+
+
+def parse_evaluation_result(evaluation_result: Dict) -> Dict:
+    """Turn the judge model's raw result into a score dict"""
+    # Debug: چاپ نتیجه کامل
+    print(f"DEBUG - Full evaluation result: {evaluation_result}")
+    
+    if evaluation_result.get("success"):
+        score_text = evaluation_result.get("output", "").strip()
+        print(f"DEBUG - Score text: '{score_text}'")
         
-        evaluation_result = call_model("gemini-2.5-flash", evaluation_prompt, api_key)
-        
-        # Debug: چاپ نتیجه کامل
-        print(f"DEBUG - Full evaluation result: {evaluation_result}")
-        
-        if evaluation_result.get("success"):
-            score_text = evaluation_result.get("output", "").strip()
-            print(f"DEBUG - Score text: '{score_text}'")
+        # روش‌های مختلف برای استخراج عدد
+        # روش 1: اگر فقط عدد باشد
+        if score_text.isdigit():
+            score = int(score_text)
+            #print(f"DEBUG - Method 1 (pure digit): {score}")
+        else:
+            # روش 2: پیدا کردن همه اعداد
+            numbers = re.findall(r'\d+', score_text)
+            #print(f"DEBUG - Found numbers: {numbers}")
             
-            # روش‌های مختلف برای استخراج عدد
-            # روش 1: اگر فقط عدد باشد
-            if score_text.isdigit():
-                score = int(score_text)
-                #print(f"DEBUG - Method 1 (pure digit): {score}")
+            if numbers:
+                # اگر چند عدد هست، آخری را بگیر (معمولاً نمره نهایی است)
+                score = int(numbers[-1])
+                print(f"DEBUG - Method 2 (regex): {score}")
             else:
-                # روش 2: پیدا کردن همه اعداد
-                numbers = re.findall(r'\d+', score_text)
-                #print(f"DEBUG - Found numbers: {numbers}")
-                
-                if numbers:
-                    # اگر چند عدد هست، آخری را بگیر (معمولاً نمره نهایی است)
-                    score = int(numbers[-1])
-                    print(f"DEBUG - Method 2 (regex): {score}")
-                else:
-                    #print("DEBUG - No numbers found, using default 50")
-                    score = 50
-            
-            # محدود کردن به بازه 1-100
-            score = min(100, max(1, score))
-            
-            return {
-                "score": score, 
-                "success": True,
-                "raw_output": score_text  # برای دیباگ
-            }
-        else:
-            error_msg = evaluation_result.get("error", "Unknown error")
-            print(f"DEBUG - Evaluation failed: {error_msg}")
-            return {
-                "score": 50, 
-                "success": False, 
-                "error": f"Evaluation failed: {error_msg}"
-            }
+                #print("DEBUG - No numbers found, using default 50")
+                score = 50
+        
+        # محدود کردن به بازه 1-100
+        score = min(100, max(1, score))
+        
+        return {
+            "score": score, 
+            "success": True,
+            "raw_output": score_text  # برای دیباگ
+        }
+    else:
+        error_msg = evaluation_result.get("error", "Unknown error")
+        print(f"DEBUG - Evaluation failed: {error_msg}")
+        return {
+            "score": 50, 
+            "success": False, 
+            "error": f"Evaluation failed: {error_msg}"
+        }
+
+
+def evaluate_response_quality(response: str, original_task: str, api_key: str) -> Dict:
+    """Evaluate the quality of a response against the original task."""
+    try:
+        evaluation_prompt = build_evaluation_prompt(response, original_task)
+        evaluation_result = call_model(JUDGE_MODEL, evaluation_prompt, api_key, stage="evaluation")
+        return parse_evaluation_result(evaluation_result)
+    
+    except Exception as e:
+        print(f"DEBUG - Exception occurred: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {
+            "score": 50, 
+            "success": False, 
+            "error": f"Exception: {str(e)}"
+        }
+
+
+async def evaluate_response_quality_async(response: str, original_task: str, api_key: str, use_cache: bool = True) -> Dict:
+    """Async variant of evaluate_response_quality"""
+    try:
+        evaluation_prompt = build_evaluation_prompt(response, original_task)
+        evaluation_result = await call_model_async(
+            JUDGE_MODEL, evaluation_prompt, api_key, use_cache=use_cache, stage="evaluation",
+            cache_prefix=build_chain_prefix(original_task)
+        )
+        return parse_evaluation_result(evaluation_result)
     
     except Exception as e:
         print(f"DEBUG - Exception occurred: {str(e)}")
@@ -654,11 +2053,19 @@ Your score (number only):"""
         }
 
 
-def find_best_response(all_responses):
+def find_best_response(all_responses, among=None):
+    """Best (output, score, model) of all_responses; `among` restricts candidates to those steps"""
+    if among is None and isinstance(all_responses, ScoredResponses) and all_responses:
+        best = all_responses.best()
+        return load_output(best), best["score"], best["model"]
     temp = -1
     best_response = None
+    if among is not None:
+        among = set(among)
 
     for r in all_responses:
+        if among is not None and r["step"] not in among:
+            continue
         #print(f"response: {r['model']} {r['score']}")
         if r["score"] > temp:
             #print(f"best response: {r['model']} {r['score']}")
@@ -667,7 +2074,7 @@ def find_best_response(all_responses):
 
         #print(f"current best: {best_response['model']} {best_response['score']}")
 
-    return best_response["output"], temp, best_response["model"]
+    return load_output(best_response), temp, best_response["model"]
 
 
 
@@ -1,12 +1,42 @@
 import os
-from typing import Optional
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, field_validator
 
-from agents import super_code_generator
+from agents import (
+    ARTIFACTS,
+    CASSETTE,
+    CHECKPOINTS,
+    CheckpointNotFound,
+    CheckpointOutputsMissing,
+    CONTEXT_CACHE,
+    CLIENT_POOL,
+    DEADLINE_SELECTION_RESERVE,
+    EXECUTION_MODES,
+    MODEL_CONCURRENCY,
+    MODEL_FALLBACKS,
+    MODEL_HEALTH,
+    MODEL_STATS,
+    ADAPTIVE_SCHEDULER,
+    KNOWN_MODES,
+    RATE_LIMITER,
+    RESPONSE_CACHE,
+    resume_chain_async,
+    get_model_chain_by_mode,
+    run_chain_async,
+)
+from batch import BatchScheduler
+from jobs import JobQueue, JobQueueFull
+from scheduler import SCHEDULERS
+from singleflight import SingleFlight, request_key
+import metrics
+import prescore
 
 class RunRequest(BaseModel):
     task: str
@@ -14,6 +44,78 @@ class RunRequest(BaseModel):
     verbose: Optional[bool] = False
     api_key: Optional[str] = None
     mode: Optional[str] = "fast"
+    execution: Optional[str] = "sequential"
+    use_cache: Optional[bool] = True
+    prompt_token_budget: Optional[int] = None
+    scheduler: Optional[str] = None
+    # Answer within this many milliseconds / spend at most this many tokens (input + output)
+    deadline_ms: Optional[int] = None
+    max_cost: Optional[int] = None
+
+    @field_validator("execution")
+    @classmethod
+    def check_execution(cls, value):
+        if value is not None and value.lower() not in EXECUTION_MODES:
+            raise ValueError(f"execution must be one of {', '.join(EXECUTION_MODES)}")
+        return value
+
+    @field_validator("scheduler")
+    @classmethod
+    def check_scheduler(cls, value):
+        if value is not None and value.lower() not in SCHEDULERS:
+            raise ValueError(f"scheduler must be one of {', '.join(SCHEDULERS)}")
+        return value
+
+    @field_validator("prompt_token_budget")
+    @classmethod
+    def check_prompt_token_budget(cls, value):
+        if value is not None and value < 0:
+            raise ValueError("prompt_token_budget must be >= 0 (0 disables compaction)")
+        return value
+
+    @field_validator("deadline_ms", "max_cost")
+    @classmethod
+    def check_budget(cls, value, info):
+        if value is not None and value <= 0:
+            raise ValueError("must be > 0")
+        if info.field_name == "deadline_ms" and value is not None and value <= DEADLINE_SELECTION_RESERVE * 1000:
+            # Nothing could run: the whole deadline is kept for selecting the result
+            raise ValueError(f"must be above the {DEADLINE_SELECTION_RESERVE * 1000:.0f} ms selection reserve (DEADLINE_SELECTION_RESERVE_MS)")
+        return value
+
+class BatchItem(BaseModel):
+    task: str
+    mode: Optional[str] = None
+    execution: Optional[str] = None
+
+    @field_validator("execution")
+    @classmethod
+    def check_execution(cls, value):
+        if value is not None and value.lower() not in EXECUTION_MODES:
+            raise ValueError(f"execution must be one of {', '.join(EXECUTION_MODES)}")
+        return value
+
+class BatchRequest(BaseModel):
+    tasks: List[BatchItem]
+    api_key: Optional[str] = None
+    # Defaults for items that don't set their own
+    mode: Optional[str] = "fast"
+    execution: Optional[str] = "sequential"
+    use_cache: Optional[bool] = True
+    prompt_token_budget: Optional[int] = None
+    scheduler: Optional[str] = None
+    # Per task, like RunRequest
+    deadline_ms: Optional[int] = None
+    max_cost: Optional[int] = None
+
+    _check_execution = field_validator("execution")(BatchItem.check_execution.__func__)
+    _check_scheduler = field_validator("scheduler")(RunRequest.check_scheduler.__func__)
+    _check_budget = field_validator("deadline_ms", "max_cost")(RunRequest.check_budget.__func__)
+    _check_prompt_token_budget = field_validator("prompt_token_budget")(RunRequest.check_prompt_token_budget.__func__)
+
+class ResumeRequest(BaseModel):
+    run_id: str
+    api_key: Optional[str] = None
 
 app = FastAPI(title="DevGenie API", version="1.0.0", description="AI Code Assistant powered by Google Gemini")
 
@@ -25,16 +127,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Threads backing blocking SDK I/O; each in-flight model call holds one
+CHAIN_IO_THREADS = int(os.getenv("CHAIN_IO_THREADS", "64"))
+
+@app.on_event("startup")
+async def configure_io_executor():
+    """Size the default executor so concurrent chains don't queue behind each other"""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=CHAIN_IO_THREADS, thread_name_prefix="chain-io")
+    )
+
 def trim(text: str, limit: int = 8000):
     if not isinstance(text, str):
         return text
     return text if len(text) <= limit else text[:limit] + "\n\n...[truncated]"
 
-@app.post("/run")
-async def run_task(req: RunRequest):
-    """Run coding task with API key"""
-    print(f"📥 Received request: task='{req.task[:50]}...', has_api_key={bool(req.api_key)}")
-    
+def resolve_api_key(req) -> str:
+    """API key from the request body, falling back to GOOGLE_API_KEY"""
     # Get API key from request body first (required)
     api_key = req.api_key
     
@@ -49,59 +158,434 @@ async def run_task(req: RunRequest):
             status_code=400, 
             detail="Google AI Studio API key is required. Please provide it in the request body or set GOOGLE_API_KEY environment variable."
         )
+    return api_key
+
+def build_run_payload(result):
+    """Shape a chain result (dict or plain string) into the /run response"""
+    # Support both dict and string results from super_code_generator
+    if isinstance(result, dict):
+        return {
+            "requirements": trim(result.get("requirements", ""), 4000),
+            "selected_design": trim(result.get("selected_design", ""), 4000),
+            "final_code": trim(result.get("final_code", result.get("final_output", "")), 8000),
+            "documentation": trim(result.get("documentation", ""), 6000),
+            "security_audit": trim(result.get("security_audit", ""), 4000),
+            "performance_metrics": result.get("performance_metrics", {}),
+            "complexity_score": result.get("complexity_score", 0.0),
+            "total_models_used": result.get("total_models_used", result.get("total_models", 0)),
+            # Step outputs are already folded into final_code; keep the per-step log light
+            "messages": [
+                {k: v for k, v in step.items() if k not in ("output", "output_ref")}
+                for step in result.get("messages", result.get("all_steps", []))
+            ],
+            "early_stop": result.get("early_stop"),
+            "input_tokens_saved": result.get("input_tokens_saved", 0),
+            "scheduler": result.get("scheduler"),
+            "budget": result.get("budget"),
+            "run_id": result.get("run_id"),
+            "resumed_from_step": result.get("resumed_from_step"),
+            "workflow_started": result.get("workflow_started"),
+            "workflow_completed": result.get("workflow_completed", result.get("completed_at")),
+        }
+    # When a plain string is returned, treat it as the final code/output
+    return {
+        "requirements": "",
+        "selected_design": "",
+        "final_code": trim(str(result), 8000),
+        "documentation": "",
+        "security_audit": "",
+        "performance_metrics": {},
+        "complexity_score": 0.0,
+        "total_models_used": 0,
+        "messages": [],
+        "early_stop": None,
+        "input_tokens_saved": 0,
+        "scheduler": None,
+        "budget": None,
+        "run_id": None,
+        "resumed_from_step": None,
+        "workflow_started": None,
+        "workflow_completed": None,
+    }
+
+run_coalescer = SingleFlight()
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before its run finished"""
+
+# Status logged for requests whose client closed the connection (nginx convention)
+CLIENT_CLOSED_REQUEST = 499
+
+async def wait_for_disconnect(request: Request):
+    # The body has already been read, so the next ASGI message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def cancel_on_disconnect(request: Request, work):
+    """Await work, cancelling it (and the chain behind it) if the client disconnects first"""
+    work = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+            await asyncio.wait({work})
+    if work.cancelled():
+        raise ClientDisconnected()
+    return work.result()
+
+@app.post("/run")
+async def run_task(req: RunRequest, request: Request):
+    """Run coding task with API key; closing the connection cancels the chain"""
+    print(f"📥 Received request: task='{req.task[:50]}...', has_api_key={bool(req.api_key)}")
+    
+    api_key = resolve_api_key(req)
     
     try:
         mode = req.mode or "fast"
         print(f"🚀 Starting super_code_generator with api_key length: {len(api_key) if api_key else 0}, mode: {mode}")
-        result = super_code_generator(
-            task=req.task,
-            api_key=api_key,
-            mode=mode
-        )
+        use_cache = req.use_cache is not False
+        # Identical concurrent requests (e.g. client retries) share one chain;
+        # it is only cancelled once every client waiting on it has disconnected
+        result = await cancel_on_disconnect(request, run_coalescer.do(
+            request_key(req.task, mode, api_key, req.execution, use_cache, req.prompt_token_budget, req.scheduler, req.deadline_ms, req.max_cost),
+            lambda: run_chain_async(
+                task=req.task,
+                api_key=api_key,
+                mode=mode,
+                execution=req.execution,
+                scheduler=req.scheduler,
+                deadline_ms=req.deadline_ms,
+                max_cost=req.max_cost,
+                use_cache=use_cache,
+                prompt_token_budget=req.prompt_token_budget
+            )
+        ))
         print("✅ super_code_generator completed successfully")
         
-        # Support both dict and string results from super_code_generator
-        if isinstance(result, dict):
-            payload = {
-                "requirements": trim(result.get("requirements", ""), 4000),
-                "selected_design": trim(result.get("selected_design", ""), 4000),
-                "final_code": trim(result.get("final_code", result.get("final_output", "")), 8000),
-                "documentation": trim(result.get("documentation", ""), 6000),
-                "security_audit": trim(result.get("security_audit", ""), 4000),
-                "performance_metrics": result.get("performance_metrics", {}),
-                "complexity_score": result.get("complexity_score", 0.0),
-                "total_models_used": result.get("total_models_used", result.get("total_models", 0)),
-                "messages": result.get("messages", result.get("all_steps", [])),
-                "workflow_started": result.get("workflow_started"),
-                "workflow_completed": result.get("workflow_completed", result.get("completed_at")),
-            }
-        else:
-            # When a plain string is returned, treat it as the final code/output
-            payload = {
-                "requirements": "",
-                "selected_design": "",
-                "final_code": trim(str(result), 8000),
-                "documentation": "",
-                "security_audit": "",
-                "performance_metrics": {},
-                "complexity_score": 0.0,
-                "total_models_used": 0,
-                "messages": [],
-                "workflow_started": None,
-                "workflow_completed": None,
-            }
-        return payload
+        return build_run_payload(result)
     
+    except ClientDisconnected:
+        print("🔌 Client disconnected, run cancelled")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         print(f"❌ Error in run_task: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.post("/run/resume")
+async def resume_task(req: ResumeRequest, request: Request):
+    """Continue a checkpointed run (e.g. after a restart) from its last completed step"""
+    if CHECKPOINTS is None:
+        raise HTTPException(status_code=404, detail="Checkpointing is disabled")
+    api_key = resolve_api_key(req)
+    print(f"⏯️ Resume request for run {req.run_id}")
+    try:
+        result = await cancel_on_disconnect(request, resume_chain_async(req.run_id, api_key))
+    except ClientDisconnected:
+        print(f"🔌 Client disconnected, run {req.run_id} cancelled again")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except CheckpointNotFound:
+        raise HTTPException(status_code=404, detail=f"No checkpoint for run {req.run_id}")
+    except CheckpointOutputsMissing as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except Exception as e:
+        print(f"❌ Error in resume_task: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    return build_run_payload(result)
+
+@app.get("/runs/{run_id}")
+async def get_run_checkpoint(run_id: str):
+    """Checkpoint status of a run: last completed step and whether it finished"""
+    checkpoint = await CHECKPOINTS.load_async(run_id) if CHECKPOINTS is not None else None
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail=f"No checkpoint for run {run_id}")
+    state = checkpoint["state"] or {}
+    return {
+        "run_id": run_id,
+        "status": checkpoint["status"],
+        "mode": checkpoint["mode"],
+        "execution": checkpoint["execution"],
+        "steps_completed": checkpoint["step"],
+        "best_score": max((r["score"] for r in state.get("all_responses", [])), default=None),
+        "created_at": checkpoint["created_at"],
+        "updated_at": checkpoint["updated_at"],
+    }
+
+@app.get("/checkpoints/stats")
+async def checkpoint_stats():
+    """Checkpoint store counters and runs by status"""
+    if CHECKPOINTS is None:
+        return {"enabled": False}
+    return {"enabled": True, **CHECKPOINTS.stats()}
+
+# Size of the final-code chunks emitted by /run/stream
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1024"))
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/run/stream")
+async def run_task_stream(req: RunRequest):
+    """Run coding task and stream each chain step as Server-Sent Events
+
+    Emits a `step` event per model (latency, score, current best), then the
+    untrimmed final code as `code` chunks, then a `done` summary.
+    """
+    api_key = resolve_api_key(req)
+    mode = req.mode or "fast"
+    print(f"📡 Streaming request: task='{req.task[:50]}...', mode: {mode}")
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def run_chain():
+        try:
+            result = await run_chain_async(
+                task=req.task,
+                api_key=api_key,
+                mode=mode,
+                execution=req.execution,
+                on_step=lambda event: events.put_nowait(("step", event)),
+                scheduler=req.scheduler,
+                deadline_ms=req.deadline_ms,
+                max_cost=req.max_cost,
+                use_cache=req.use_cache is not False,
+                prompt_token_budget=req.prompt_token_budget
+            )
+            events.put_nowait(("result", result))
+        except Exception as e:
+            print(f"❌ Error in run_task_stream: {str(e)}")
+            events.put_nowait(("error", {"detail": f"Error: {str(e)}"}))
+
+    async def stream():
+        chain = asyncio.create_task(run_chain())
+        try:
+            while True:
+                kind, data = await events.get()
+                if kind == "step":
+                    yield sse_event("step", {k: v for k, v in data.items() if k != "best_output"})
+                elif kind == "error":
+                    yield sse_event("error", data)
+                    return
+                else:
+                    final_output = data["final_output"]
+                    for start in range(0, len(final_output), STREAM_CHUNK_SIZE):
+                        yield sse_event("code", {"chunk": final_output[start:start + STREAM_CHUNK_SIZE]})
+                    yield sse_event("done", {
+                        "total_models": data["total_models"],
+                        "successful_models": data["successful_models"],
+                        "completed_at": data["completed_at"],
+                        "budget": data.get("budget"),
+                    })
+                    return
+        finally:
+            # Client went away (or we finished): don't leave the chain running
+            if not chain.done():
+                chain.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def run_chain_job(params: Dict, on_step) -> Dict:
+    """Job runner: execute one chain and return the /run style payload"""
+    result = await run_chain_async(
+        task=params["task"],
+        api_key=params["api_key"],
+        mode=params["mode"],
+        execution=params["execution"],
+        on_step=on_step,
+        scheduler=params.get("scheduler"),
+        deadline_ms=params.get("deadline_ms"),
+        max_cost=params.get("max_cost"),
+        use_cache=params["use_cache"],
+        prompt_token_budget=params.get("prompt_token_budget")
+    )
+    return build_run_payload(result)
+
+job_queue = JobQueue(
+    runner=run_chain_job,
+    workers=int(os.getenv("CHAIN_WORKERS", "4")),
+    max_queue=int(os.getenv("CHAIN_QUEUE_SIZE", "100")),
+)
+
+batch_scheduler = BatchScheduler(
+    runner=lambda params: run_chain_job(params, None),
+    max_chains=int(os.getenv("BATCH_MAX_CHAINS", "16")),
+    max_items=int(os.getenv("BATCH_MAX_TASKS", "200")),
+)
+
+@app.post("/run/batch")
+async def run_batch(req: BatchRequest):
+    """Run many coding tasks over the shared batch pool, streaming NDJSON results
+
+    One line per task as it finishes (with its index in the request), then a
+    final `stats` line with the batch's throughput.
+    """
+    if not req.tasks:
+        raise HTTPException(status_code=400, detail="tasks must not be empty")
+    if len(req.tasks) > batch_scheduler.max_items:
+        raise HTTPException(status_code=400, detail=f"At most {batch_scheduler.max_items} tasks per batch")
+    api_key = resolve_api_key(req)
+    items = [
+        {
+            "task": item.task,
+            "api_key": api_key,
+            "mode": item.mode or req.mode or "fast",
+            "execution": item.execution or req.execution,
+            "use_cache": req.use_cache is not False,
+            "prompt_token_budget": req.prompt_token_budget,
+            "scheduler": req.scheduler,
+            "deadline_ms": req.deadline_ms,
+            "max_cost": req.max_cost,
+        }
+        for item in req.tasks
+    ]
+
+    async def stream():
+        results = batch_scheduler.run(items)
+        try:
+            async for record in results:
+                if record["type"] == "stats":
+                    record["model_slots"] = MODEL_CONCURRENCY.stats()
+                yield json.dumps(record) + "\n"
+        finally:
+            # Client went away: cancel the chains that are still running
+            await results.aclose()
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/run/batch/stats")
+async def batch_stats():
+    """Shared batch pool occupancy, per-model slot utilisation and recent batch throughput"""
+    return {**batch_scheduler.stats(), "model_slots": MODEL_CONCURRENCY.stats()}
+
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    await job_queue.stop()
+    prescore.shutdown_pool()
+
+@app.post("/jobs", status_code=202)
+async def submit_job(req: RunRequest):
+    """Queue a coding task and return its job id immediately"""
+    api_key = resolve_api_key(req)
+    try:
+        job = job_queue.submit({
+            "task": req.task,
+            "api_key": api_key,
+            "mode": req.mode or "fast",
+            "execution": req.execution,
+            "use_cache": req.use_cache is not False,
+            "prompt_token_budget": req.prompt_token_budget,
+            "scheduler": req.scheduler,
+            "deadline_ms": req.deadline_ms,
+            "max_cost": req.max_cost,
+        })
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    print(f"📥 Queued job {job['job_id']} (mode: {job['mode']}, depth: {job_queue.stats()['queue_depth']})")
+    return job
+
+@app.get("/jobs/stats")
+async def job_stats():
+    """Queue depth, worker utilisation and recent per-job timings"""
+    return job_queue.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, current step and partial results of a queued job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "message": "Backend is running"}
 
+@app.get("/run/stats")
+async def run_coalescing_stats():
+    """How many /run requests were served by an already running identical chain"""
+    return run_coalescer.stats()
+
+@app.get("/models/health")
+async def models_health():
+    """Circuit-breaker state, failure rates and error classes per model"""
+    return {"models": MODEL_HEALTH.snapshot(), "fallbacks": MODEL_FALLBACKS}
+
+@app.get("/clients/stats")
+async def client_pool_stats():
+    """Hit/miss and eviction counters of the pooled genai clients"""
+    return CLIENT_POOL.stats()
+
+@app.get("/cache/stats")
+async def response_cache_stats():
+    """Tier hit rates, size and evictions of the model response cache"""
+    if RESPONSE_CACHE is None:
+        return {"enabled": False}
+    return {"enabled": True, **RESPONSE_CACHE.stats()}
+
+@app.get("/artifacts/stats")
+async def artifact_stats():
+    """Size, segments and dedup/compression counters of the step-output store"""
+    if ARTIFACTS is None:
+        return {"enabled": False}
+    return {"enabled": True, **ARTIFACTS.stats()}
+
+@app.get("/context-cache/stats")
+async def context_cache_stats():
+    """Provider-side cached prompt prefixes: creations, reuses and fallbacks"""
+    if CONTEXT_CACHE is None:
+        return {"enabled": False}
+    return {"enabled": True, **CONTEXT_CACHE.stats()}
+
+@app.get("/ratelimit/stats")
+async def rate_limit_stats():
+    """Per-(key, model) rate-limit budgets, queue lengths and total queue wait"""
+    if RATE_LIMITER is None:
+        return {"enabled": False}
+    return {"enabled": True, **RATE_LIMITER.stats()}
+
+@app.get("/cassette/stats")
+async def cassette_stats():
+    """Record/replay cassette counters (exact, loose and missed replays)"""
+    if CASSETTE is None:
+        return {"enabled": False}
+    return {"enabled": True, **CASSETTE.stats()}
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Learned per-(model, position) gain, latency and failure rate, and the chain each mode would get now"""
+    if MODEL_STATS is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        **MODEL_STATS.stats(),
+        "chains": {
+            mode: ADAPTIVE_SCHEDULER.build_chain(get_model_chain_by_mode(mode), explore=False)
+            for mode in KNOWN_MODES
+        },
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: call/step/run latency histograms, tokens, retries and cache hits"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.options("/run")
 async def run_options():
     """Handle CORS preflight"""
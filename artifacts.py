@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import Callable, Dict, IO, Tuple
+
+# Record: 16-byte blake2b digest of the raw text, compressed length, zlib payload
+HEADER = struct.Struct(">16sI")
+SEGMENT_RE = re.compile(r"^artifacts-(\d{6})\.log$")
+
+
+class ArtifactStore:
+    """Append-only, zlib-compressed, content-addressed store of step outputs
+
+    put() appends an output to the active segment file (unless the same text
+    is already stored) and returns its handle, the hex digest of the text.
+    get() reads a record back through an mmap of its segment. Segments roll
+    over at segment_bytes; once all of them exceed max_bytes the oldest are
+    deleted, and handles pointing into them no longer resolve. The index of
+    handles is rebuilt by scanning the segments on start-up.
+    """
+
+    def __init__(self, path: str, segment_bytes: int = 64 * 1024 * 1024, max_bytes: int = 1024 * 1024 * 1024, level: int = 6):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.level = level
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[int, int, int]] = {}  # handle -> (segment, payload offset, length)
+        self._sizes: Dict[int, int] = {}
+        self._maps: Dict[int, mmap.mmap] = {}
+        self.counters = {"puts": 0, "dedup_hits": 0, "gets": 0, "bytes_in": 0, "bytes_written": 0, "segments_dropped": 0}
+        os.makedirs(path, exist_ok=True)
+        for name in sorted(os.listdir(path)):
+            match = SEGMENT_RE.match(name)
+            if match:
+                self._scan(int(match.group(1)))
+        self._active = max(self._sizes, default=1)
+        self._file = open(self._segment_path(self._active), "ab")
+        self._sizes.setdefault(self._active, 0)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"artifacts-{segment:06d}.log")
+
+    def _scan(self, segment: int):
+        path = self._segment_path(segment)
+        offset = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                digest, length = HEADER.unpack(header)
+                if len(f.read(length)) < length:
+                    break
+                self._index[digest.hex()] = (segment, offset + HEADER.size, length)
+                offset += HEADER.size + length
+        if offset < os.path.getsize(path):
+            # A write was cut short (crash mid-append): drop the partial record
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        self._sizes[segment] = offset
+
+    def put(self, text: str) -> str:
+        """Store text (once per distinct content) and return its handle"""
+        raw = text.encode("utf-8")
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        handle = digest.hex()
+        with self._lock:
+            self.counters["puts"] += 1
+            self.counters["bytes_in"] += len(raw)
+            if handle in self._index:
+                self.counters["dedup_hits"] += 1
+                return handle
+            payload = zlib.compress(raw, self.level)
+            if self._sizes[self._active] and self._sizes[self._active] + HEADER.size + len(payload) > self.segment_bytes:
+                self._roll()
+            offset = self._sizes[self._active]
+            self._file.write(HEADER.pack(digest, len(payload)) + payload)
+            self._file.flush()
+            self._sizes[self._active] = offset + HEADER.size + len(payload)
+            self._index[handle] = (self._active, offset + HEADER.size, len(payload))
+            self.counters["bytes_written"] += HEADER.size + len(payload)
+        return handle
+
+    def get(self, handle: str) -> str:
+        """Text stored under handle; KeyError when unknown or its segment was dropped"""
+        with self._lock:
+            segment, offset, length = self._index[handle]
+            view = self._maps.get(segment)
+            if view is None or len(view) < offset + length:
+                # Segment grew since it was mapped (or never was): map it again
+                if view is not None:
+                    view.close()
+                with open(self._segment_path(segment), "rb") as f:
+                    view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = view
+            payload = view[offset:offset + length]
+            self.counters["gets"] += 1
+        return zlib.decompress(payload).decode("utf-8")
+
+    def __contains__(self, handle: str) -> bool:
+        with self._lock:
+            return handle in self._index
+
+    def _roll(self):
+        self._file.close()
+        self._active += 1
+        self._sizes[self._active] = 0
+        self._file = open(self._segment_path(self._active), "ab")
+        while sum(self._sizes.values()) > self.max_bytes and len(self._sizes) > 1:
+            oldest = min(self._sizes)
+            view = self._maps.pop(oldest, None)
+            if view is not None:
+                view.close()
+            os.remove(self._segment_path(oldest))
+            del self._sizes[oldest]
+            self._index = {h: loc for h, loc in self._index.items() if loc[0] != oldest}
+            self.counters["segments_dropped"] += 1
+
+    async def put_async(self, text: str) -> str:
+        return await asyncio.to_thread(self.put, text)
+
+    async def get_async(self, handle: str) -> str:
+        return await asyncio.to_thread(self.get, handle)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stored = sum(self._sizes.values())
+            return {
+                **self.counters,
+                "path": self.path,
+                "artifacts": len(self._index),
+                "segments": len(self._sizes),
+                "bytes_stored": stored,
+                "compression_ratio": round(self.counters["bytes_in"] / self.counters["bytes_written"], 2) if self.counters["bytes_written"] else None,
+            }
+
+
+STREAMED_LISTS = ("all_steps", "all_responses")
+
+
+def write_result_json(result: Dict, out: IO[str], resolve: Callable[[Dict], str]):
+    """Write a chain result as JSON one field and one step at a time
+
+    Entries of all_steps / all_responses that hold an output_ref get their
+    output from resolve(entry) just before they are written, so only one
+    step's text is in memory at once.
+    """
+    out.write("{")
+    for n, (key, value) in enumerate(result.items()):
+        out.write(("," if n else "") + "\n  " + json.dumps(key) + ": ")
+        if key in STREAMED_LISTS and isinstance(value, list):
+            out.write("[")
+            for i, entry in enumerate(value):
+                if entry.get("output_ref"):
+                    entry = {**{k: v for k, v in entry.items() if k != "output_ref"}, "output": resolve(entry)}
+                out.write(("," if i else "") + "\n    " + json.dumps(entry))
+            out.write("\n  ]" if value else "]")
+        else:
+            out.write(json.dumps(value))
+    out.write("\n}\n")
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+class BatchScheduler:
+    """Runs batches of chains over one pool of chain slots shared by every batch
+
+    All items of a batch are started at once and wait for a slot; with up to
+    max_chains chains in flight their steps interleave on each model, so the
+    per-model concurrency limits stay busy instead of one chain's step at a
+    time. runner(params) is awaited per item and returns the /run payload.
+    run() yields one result per item as it finishes, then a stats record.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Dict], Awaitable[Dict]],
+        max_chains: int = 16,
+        max_items: int = 200,
+        history: int = 50,
+    ):
+        self.runner = runner
+        self.max_chains = max_chains
+        self.max_items = max_items
+        self.active_chains = 0
+        self.recent = deque(maxlen=history)
+        self.counters = {"batches": 0, "items": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_chains)
+        return self._slots
+
+    async def _run_item(self, index: int, params: Dict) -> Dict:
+        slots = self._semaphore()
+        queued = time.monotonic()
+        async with slots:
+            started = time.monotonic()
+            self.active_chains += 1
+            try:
+                payload = await self.runner(params)
+                record = {"type": "result", "index": index, "success": True, **payload}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Batch item {index} failed: {e}")
+                record = {"type": "result", "index": index, "success": False, "error": str(e)}
+            finally:
+                self.active_chains -= 1
+        record["queue_wait_seconds"] = round(started - queued, 3)
+        record["run_seconds"] = round(time.monotonic() - started, 3)
+        return record
+
+    async def run(self, items: List[Dict]) -> AsyncIterator[Dict]:
+        """Yield each item's result in completion order, then the batch's throughput stats
+
+        Closing the iterator early (client went away) cancels the items still running.
+        """
+        batch_id = uuid.uuid4().hex
+        started = time.monotonic()
+        self.counters["batches"] += 1
+        self.counters["items"] += len(items)
+        print(f"📦 Batch {batch_id[:8]}: {len(items)} tasks over {self.max_chains} shared chain slots")
+        tasks = [asyncio.ensure_future(self._run_item(i, params)) for i, params in enumerate(items)]
+        latencies, run_seconds, steps, calls, tokens = [], 0.0, 0, 0, 0
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                record = await next_done
+                latencies.append(record["queue_wait_seconds"] + record["run_seconds"])
+                run_seconds += record["run_seconds"]
+                if record["success"]:
+                    succeeded += 1
+                    steps += len(record.get("messages", []))
+                    for stage in ((record.get("performance_metrics") or {}).get("stages") or {}).values():
+                        calls += stage["calls"]
+                        tokens += stage["input_tokens"] + stage["output_tokens"]
+                yield record
+        finally:
+            pending = [t for t in tasks if not t.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                self.counters["cancelled"] += len(pending)
+            self.counters["succeeded"] += succeeded
+            self.counters["failed"] += len(latencies) - succeeded
+
+        wall = time.monotonic() - started
+        stats = {
+            "type": "stats",
+            "batch_id": batch_id,
+            "tasks": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "wall_seconds": round(wall, 3),
+            "tasks_per_minute": round(len(items) * 60 / wall, 2) if wall else None,
+            "steps": steps,
+            "steps_per_second": round(steps / wall, 3) if wall else None,
+            "model_calls": calls,
+            "calls_per_second": round(calls / wall, 3) if wall else None,
+            "tokens": tokens,
+            "tokens_per_second": round(tokens / wall, 1) if wall else None,
+            "latency_p50_seconds": _percentile(latencies, 50),
+            "latency_p95_seconds": _percentile(latencies, 95),
+            # Sequential time the same chains would have taken, over the batch's wall time
+            "speedup": round(run_seconds / wall, 2) if wall else None,
+        }
+        self.recent.append({k: v for k, v in stats.items() if k != "type"})
+        print(f"✅ Batch {batch_id[:8]} finished: {succeeded}/{len(items)} in {wall:.1f}s")
+        yield stats
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "max_chains": self.max_chains,
+            "active_chains": self.active_chains,
+            "recent_batches": list(self.recent),
+        }
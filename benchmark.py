@@ -0,0 +1,303 @@
+"""Offline load benchmark for the chain engine and the /run endpoint
+
+Every model call is served by fake_gemini, so no quota is used:
+
+    python benchmark.py --modes fast balanced --requests 40 --concurrency 8
+    python benchmark.py --target api --time-scale 0.01 --json bench.json --max-p95 30
+    python benchmark.py --cassette .devgenie/cassette.jsonl --speed 10
+
+With --cassette, the chains recorded in that file (CASSETTE_MODE=record)
+are replayed instead: same tasks and modes, recorded outputs and errors,
+and recorded latencies divided by --speed.
+
+Exits with status 1 when --max-p95 or --max-error-rate is exceeded, so it
+can gate CI runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+
+import agents
+import fake_gemini
+from cassette import Cassette
+
+BENCH_API_KEY = "benchmark-key"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 4)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeper that asked for `interval`"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> Dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return {
+            "samples": len(self.samples),
+            "p50_ms": round((percentile(self.samples, 50) or 0) * 1000, 3),
+            "p99_ms": round((percentile(self.samples, 99) or 0) * 1000, 3),
+            "max_ms": round(max(self.samples, default=0) * 1000, 3),
+        }
+
+
+class MemoryMonitor:
+    """Samples traced memory against the number of chains in flight"""
+
+    def __init__(self, enabled: bool = True, interval: float = 0.05):
+        self.enabled = enabled
+        self.interval = interval
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.samples: List[tuple] = []
+        self._baseline = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.samples.append((self.in_flight, tracemalloc.get_traced_memory()[0]))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if not self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        self._task = asyncio.create_task(self._run())
+
+    def enter(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def exit(self):
+        self.in_flight -= 1
+
+    async def stop(self) -> Dict:
+        if not self.enabled:
+            return {"enabled": False}
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        per_chain = [(used - self._baseline) / flying for flying, used in self.samples if flying]
+        peak = max((used for _, used in self.samples), default=self._baseline)
+        tracemalloc.stop()
+        return {
+            "enabled": True,
+            "peak_in_flight": self.peak_in_flight,
+            "peak_bytes": peak - self._baseline,
+            "bytes_per_chain_p50": int(percentile(per_chain, 50) or 0),
+            "bytes_per_chain_max": int(max(per_chain, default=0)),
+        }
+
+
+async def run_engine_request(mode: str, execution: str, task: str) -> Dict:
+    result = await agents.run_chain_async(task, BENCH_API_KEY, mode, execution=execution, use_cache=False)
+    return {"ok": result["successful_models"] > 0, "steps": len(result["all_steps"])}
+
+
+async def run_api_request(client, mode: str, execution: str, task: str) -> Dict:
+    response = await client.post(
+        "/run",
+        json={"task": task, "mode": mode, "execution": execution, "api_key": BENCH_API_KEY, "use_cache": False},
+    )
+    if response.status_code != 200:
+        return {"ok": False, "steps": 0}
+    return {"ok": True, "steps": len(response.json().get("messages", []))}
+
+
+async def run_load(target: str, mode: str, execution: str, requests: int, concurrency: int, memory: bool, tasks: Optional[List[str]] = None) -> Dict:
+    """Fire `requests` chains of one mode, at most `concurrency` at a time (tasks are reused round-robin)"""
+    client = None
+    if target == "api":
+        try:
+            import httpx
+        except ImportError:
+            sys.exit("The api target needs httpx (pip install httpx)")
+        import api
+        await api.app.router.startup()
+        client = httpx.AsyncClient(app=api.app, base_url="http://benchmark", timeout=None)
+
+    gate = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+    steps = 0
+    lag = LoopLagMonitor()
+    mem = MemoryMonitor(enabled=memory)
+
+    async def one(index: int):
+        nonlocal failures, steps
+        task = tasks[index % len(tasks)] if tasks else f"Write a Python function number {index} that parses a CSV file and reports column statistics"
+        async with gate:
+            mem.enter()
+            started = time.monotonic()
+            try:
+                if client is not None:
+                    outcome = await run_api_request(client, mode, execution, task)
+                else:
+                    outcome = await run_engine_request(mode, execution, task)
+            except Exception as e:
+                print(f"❌ Request {index} failed: {e}")
+                outcome = {"ok": False, "steps": 0}
+            finally:
+                mem.exit()
+            latencies.append(time.monotonic() - started)
+            failures += 0 if outcome["ok"] else 1
+            steps += outcome["steps"]
+
+    # Spawn the pre-scoring processes up front so their start-up isn't billed to the first chains
+    await agents.local_prescore_async("warm-up", "warm-up")
+    lag.start()
+    mem.start()
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*[one(i) for i in range(requests)])
+    finally:
+        wall = time.monotonic() - started
+        memory_stats = await mem.stop()
+        lag_stats = await lag.stop()
+        if client is not None:
+            await client.aclose()
+            await api.app.router.shutdown()
+
+    return {
+        "target": target,
+        "mode": mode,
+        "execution": execution,
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "rps": round(requests / wall, 3) if wall else None,
+        "error_rate": round(failures / requests, 4) if requests else 0.0,
+        "steps_per_request": round(steps / requests, 2) if requests else 0,
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": round(statistics.mean(latencies), 4) if latencies else None,
+        },
+        "event_loop_lag": lag_stats,
+        "memory": memory_stats,
+    }
+
+
+def print_report(report: Dict):
+    latency = report["latency"]
+    lag = report["event_loop_lag"]
+    print(
+        f"📊 {report['target']:6} {report['mode']:11} {report['execution']:10} "
+        f"rps={report['rps']:<8} p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s "
+        f"errors={report['error_rate']:.2%} lag_p99={lag['p99_ms']}ms"
+        + (f" mem/chain={report['memory']['bytes_per_chain_p50'] / 1024:.0f}KiB" if report["memory"]["enabled"] else "")
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline chain benchmark against a fake Gemini")
+    parser.add_argument("--target", choices=("engine", "api", "both"), default="engine")
+    parser.add_argument("--modes", nargs="+", help="modes to run (default: fast balanced, or the cassette's modes)")
+    parser.add_argument("--execution", choices=agents.EXECUTION_MODES, default="sequential")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--time-scale", type=float, default=0.01, help="multiplier on simulated model latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profiles", help="JSON file overriding fake_gemini.DEFAULT_PROFILES")
+    parser.add_argument("--cassette", help="replay the chains recorded in this cassette instead of the fake")
+    parser.add_argument("--speed", type=float, default=1.0, help="cassette replay speed-up (0 = no delays)")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows the run down)")
+    parser.add_argument("--json", help="write the reports to this file")
+    parser.add_argument("--max-p95", type=float, help="fail when any mode's p95 latency exceeds this many seconds")
+    parser.add_argument("--max-error-rate", type=float, help="fail when any mode's error rate exceeds this fraction")
+    args = parser.parse_args(argv)
+
+    profiles = None
+    if args.profiles:
+        with open(args.profiles) as f:
+            profiles = {name: {**profile, "latency": tuple(profile["latency"]), "output_tokens": tuple(profile["output_tokens"]),
+                               "errors": {int(code): p for code, p in profile.get("errors", {}).items()}}
+                        for name, profile in json.load(f).items()}
+    cassette = None
+    if args.cassette:
+        cassette = Cassette(args.cassette, mode="replay", speed=args.speed)
+        agents.CLIENT_POOL.clear()
+        agents.CLIENT_POOL.factory = cassette.wrap(agents.CLIENT_POOL.factory)
+        if args.speed:
+            agents.CALL_RETRY_BASE_DELAY /= args.speed
+            if agents.RATE_LIMITER is not None:
+                agents.RATE_LIMITER.scale *= args.speed
+        else:
+            agents.RATE_LIMITER = None
+    else:
+        fake_gemini.install(profiles, time_scale=args.time_scale, seed=args.seed)
+        # Backoff and rate limits run on real time; scale them with the simulated latencies
+        agents.CALL_RETRY_BASE_DELAY *= args.time_scale
+        if agents.RATE_LIMITER is not None:
+            agents.RATE_LIMITER.scale /= args.time_scale
+
+    runs = cassette.runs() if cassette is not None else []
+    modes = args.modes or (list(dict.fromkeys(run["mode"] for run in runs)) if runs else ["fast", "balanced"])
+    targets = ("engine", "api") if args.target == "both" else (args.target,)
+    reports = []
+    for target in targets:
+        for mode in modes:
+            tasks = [run["task"] for run in runs if run["mode"] == mode]
+            if cassette is not None:
+                cassette.rewind()
+            report = asyncio.run(run_load(
+                target, mode, args.execution, len(tasks) if tasks else args.requests,
+                args.concurrency, not args.no_memory, tasks
+            ))
+            if cassette is not None:
+                report["cassette"] = cassette.stats()
+            print_report(report)
+            reports.append(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"time_scale": args.time_scale, "seed": args.seed, "reports": reports}, f, indent=2)
+        print(f"💾 Benchmark results saved to: {args.json}")
+
+    failed = [
+        r for r in reports
+        if (args.max_p95 is not None and (r["latency"]["p95"] or 0) > args.max_p95)
+        or (args.max_error_rate is not None and r["error_rate"] > args.max_error_rate)
+    ]
+    for report in failed:
+        print(f"❌ Threshold exceeded: {report['target']} {report['mode']} (p95 {report['latency']['p95']}s, errors {report['error_rate']:.2%})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+CASSETTE_MODES = ("record", "replay")
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def _pack(text: str) -> str:
+    return base64.b64encode(zlib.compress(text.encode("utf-8"))).decode("ascii")
+
+
+def _unpack(blob: str) -> str:
+    return zlib.decompress(base64.b64decode(blob)).decode("utf-8")
+
+
+class CassetteError(Exception):
+    """A recorded provider error, re-raised on replay (classify_error reads .code)"""
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+
+class Cassette:
+    """Record model calls to a JSONL file, or serve them back in place of Gemini
+
+    Each "call" line holds the model, a hash of the prompt, the zlib+base64
+    output, latency, error and token usage; "run" lines hold the task, mode
+    and execution of every chain started while recording.
+
+    On replay a call is matched by (model, prompt hash) in recorded order.
+    With loose=True a prompt that was never recorded (e.g. because a
+    scheduling change picked a different best output) takes the next unused
+    call of the same model instead. Recorded latency is slept, divided by
+    speed; speed=0 replays without delays.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", speed: float = 1.0, loose: bool = True):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}. Expected one of {', '.join(CASSETTE_MODES)}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.loose = loose
+        self._lock = threading.Lock()
+        self._exact: Dict[tuple, deque] = defaultdict(deque)
+        self._by_model: Dict[str, deque] = defaultdict(deque)
+        self._runs: List[Dict] = []
+        self.counters = {"recorded": 0, "exact_hits": 0, "loose_hits": 0, "misses": 0}
+        if mode == "replay":
+            self._load()
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("type") == "run":
+                    self._runs.append(entry)
+                    continue
+                entry["used"] = False
+                self._exact[(entry["model"], entry["prompt_hash"])].append(entry)
+                self._by_model[entry["model"]].append(entry)
+
+    def _append(self, entry: Dict):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def record_run(self, task: str, mode: str, execution: str):
+        if self.mode == "record":
+            self._append({"type": "run", "task": task, "mode": mode, "execution": execution, "at": time.time()})
+
+    def record_call(self, model: str, prompt: str, latency: float, response=None, error: Optional[BaseException] = None):
+        usage = getattr(response, "usage_metadata", None)
+        entry = {
+            "type": "call",
+            "model": model,
+            "prompt_hash": prompt_hash(prompt),
+            "output": _pack(response.text or "") if response is not None else None,
+            "latency": round(latency, 4),
+            "error": str(error) if error is not None else None,
+            "error_code": getattr(error, "code", None) if isinstance(getattr(error, "code", None), int) else None,
+            "input_tokens": getattr(usage, "prompt_token_count", None),
+            "output_tokens": getattr(usage, "candidates_token_count", None),
+            "at": time.time(),
+        }
+        self._append(entry)
+        with self._lock:
+            self.counters["recorded"] += 1
+
+    def runs(self) -> List[Dict]:
+        """Chains seen while recording (task, mode, execution), in order"""
+        return list(self._runs)
+
+    def take(self, model: str, prompt: str) -> Optional[Dict]:
+        """Next unused recorded call for this model and prompt (None on a miss)"""
+        with self._lock:
+            for entry in self._exact.get((model, prompt_hash(prompt)), ()):
+                if not entry["used"]:
+                    entry["used"] = True
+                    self.counters["exact_hits"] += 1
+                    return entry
+            if self.loose:
+                for entry in self._by_model.get(model, ()):
+                    if not entry["used"]:
+                        entry["used"] = True
+                        self.counters["loose_hits"] += 1
+                        return entry
+            self.counters["misses"] += 1
+            return None
+
+    def rewind(self):
+        """Make every recorded call available again (e.g. before another replay pass)"""
+        with self._lock:
+            self.counters.update(exact_hits=0, loose_hits=0, misses=0)
+            for calls in self._by_model.values():
+                for entry in calls:
+                    entry["used"] = False
+
+    def delay(self, entry: Dict) -> float:
+        return entry["latency"] / self.speed if self.speed else 0.0
+
+    def respond(self, model: str, entry: Optional[Dict]):
+        if entry is None:
+            raise CassetteError(f"Cassette miss: no recorded call left for {model}")
+        if entry["error"] is not None:
+            raise CassetteError(entry["error"], entry["error_code"])
+        return SimpleNamespace(
+            text=_unpack(entry["output"]),
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=entry.get("input_tokens"),
+                candidates_token_count=entry.get("output_tokens"),
+                cached_content_token_count=None,
+            ),
+        )
+
+    def wrap(self, factory: Callable[[str], Any]) -> Callable[[str], Any]:
+        """Client factory for ClientPool: records through the real client, or replays without one"""
+        if self.mode == "replay":
+            client = CassetteClient(self, None)
+            return lambda api_key: client
+        return lambda api_key: CassetteClient(self, factory(api_key))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            remaining = sum(1 for calls in self._by_model.values() for entry in calls if not entry["used"])
+            return {"path": self.path, "mode": self.mode, "speed": self.speed, **self.counters, "unused_calls": remaining}
+
+
+class _CassetteModels:
+    def __init__(self, cassette: Cassette, inner, is_async: bool):
+        self._cassette = cassette
+        self._inner = inner
+        self._async = is_async
+
+    def generate_content(self, model: str, contents, **kwargs):
+        if self._async:
+            return self._generate_async(model, contents, **kwargs)
+        prompt = str(contents)
+        if self._cassette.mode == "replay":
+            entry = self._cassette.take(model, prompt)
+            if entry is not None:
+                time.sleep(self._cassette.delay(entry))
+            return self._cassette.respond(model, entry)
+        started = time.monotonic()
+        try:
+            response = self._inner.generate_content(model=model, contents=contents, **kwargs)
+        except Exception as e:
+            self._cassette.record_call(model, prompt, time.monotonic() - started, error=e)
+            raise
+        self._cassette.record_call(model, prompt, time.monotonic() - started, response=response)
+        return response
+
+    async def _generate_async(self, model: str, contents, **kwargs):
+        prompt = str(contents)
+        if self._cassette.mode == "replay":
+            entry = self._cassette.take(model, prompt)
+            if entry is not None:
+                await asyncio.sleep(self._cassette.delay(entry))
+            return self._cassette.respond(model, entry)
+        started = time.monotonic()
+        try:
+            response = await self._inner.generate_content(model=model, contents=contents, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._cassette.record_call(model, prompt, time.monotonic() - started, error=e)
+            raise
+        self._cassette.record_call(model, prompt, time.monotonic() - started, response=response)
+        return response
+
+
+class CassetteClient:
+    """genai.Client look-alike whose generate_content goes through a Cassette"""
+
+    def __init__(self, cassette: Cassette, inner):
+        self._inner = inner
+        self.models = _CassetteModels(cassette, inner.models if inner is not None else None, is_async=False)
+        self.aio = SimpleNamespace(
+            models=_CassetteModels(cassette, inner.aio.models if inner is not None else None, is_async=True)
+        )
+        # Keep the real transport reachable so the pool can still enable keep-alive on it
+        if inner is not None and hasattr(inner, "_api_client"):
+            self._api_client = inner._api_client
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+
+class CheckpointStore:
+    """SQLite store of in-progress chain state, one row per run
+
+    The engine overwrites a run's row after every step with its state
+    (zlib-compressed JSON), so a restarted process can pick the run up from
+    the last completed step. Finished rows are kept for `ttl` seconds.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.counters = {"saves": 0, "loads": 0, "resumes": 0, "bytes_written": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS checkpoints (
+                run_id TEXT PRIMARY KEY,
+                task TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                execution TEXT NOT NULL,
+                key_hash TEXT NOT NULL,
+                options TEXT NOT NULL,
+                status TEXT NOT NULL,
+                step INTEGER NOT NULL DEFAULT 0,
+                state BLOB,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS checkpoints_updated ON checkpoints(updated_at)")
+
+    def start(self, run_id: str, task: str, mode: str, execution: str, key_hash: str, options: Dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                """INSERT OR REPLACE INTO checkpoints
+                   (run_id, task, mode, execution, key_hash, options, status, step, state, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, 'running', 0, NULL, ?, ?)""",
+                (run_id, task, mode, execution, key_hash, json.dumps(options), now, now),
+            )
+            self._db.execute(
+                "DELETE FROM checkpoints WHERE status != 'running' AND updated_at < ?", (now - self.ttl,)
+            )
+
+    def save(self, run_id: str, state: Dict):
+        blob = zlib.compress(json.dumps(state).encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "UPDATE checkpoints SET step = ?, state = ?, status = 'running', updated_at = ? WHERE run_id = ?",
+                (state.get("steps_run", 0), blob, time.time(), run_id),
+            )
+            self.counters["saves"] += 1
+            self.counters["bytes_written"] += len(blob)
+
+    def finish(self, run_id: str, status: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE checkpoints SET status = ?, updated_at = ? WHERE run_id = ?", (status, time.time(), run_id)
+            )
+
+    def load(self, run_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                """SELECT task, mode, execution, key_hash, options, status, step, state, created_at, updated_at
+                   FROM checkpoints WHERE run_id = ?""",
+                (run_id,),
+            ).fetchone()
+            self.counters["loads"] += 1
+        if row is None:
+            return None
+        return {
+            "run_id": run_id,
+            "task": row[0],
+            "mode": row[1],
+            "execution": row[2],
+            "key_hash": row[3],
+            "options": json.loads(row[4]),
+            "status": row[5],
+            "step": row[6],
+            "state": json.loads(zlib.decompress(row[7]).decode("utf-8")) if row[7] is not None else None,
+            "created_at": row[8],
+            "updated_at": row[9],
+        }
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        query = "SELECT run_id, mode, execution, status, step, created_at, updated_at FROM checkpoints"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        query += " ORDER BY updated_at DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, params + (limit,)).fetchall()
+        return [
+            {"run_id": r[0], "mode": r[1], "execution": r[2], "status": r[3], "step": r[4], "created_at": r[5], "updated_at": r[6]}
+            for r in rows
+        ]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            by_status = dict(self._db.execute("SELECT status, COUNT(*) FROM checkpoints GROUP BY status").fetchall())
+        return {**self.counters, "runs": by_status, "path": self.path}
+
+    async def start_async(self, *args):
+        await asyncio.to_thread(self.start, *args)
+
+    async def save_async(self, run_id: str, state: Dict):
+        await asyncio.to_thread(self.save, run_id, state)
+
+    async def finish_async(self, run_id: str, status: str):
+        await asyncio.to_thread(self.finish, run_id, status)
+
+    async def load_async(self, run_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.load, run_id)
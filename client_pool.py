@@ -0,0 +1,159 @@
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Set to a dict around a model call; the keep-alive transport stores the
+# time until response headers arrived under "ttfb" (asyncio.to_thread
+# carries the context into the SDK's worker thread)
+REQUEST_TIMING: contextvars.ContextVar = contextvars.ContextVar("devgenie_request_timing", default=None)
+
+
+def hash_api_key(api_key: str) -> str:
+    """Stable, non-reversible identifier for an API key (safe to log and use as a dict key)"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+
+def _new_keepalive_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _enable_keepalive(client: Any, session: requests.Session) -> bool:
+    """Route the SDK's unauthenticated (API-key) requests through a persistent session
+
+    google-genai 0.2.x opens a fresh requests.Session for every call, which
+    redoes TCP and TLS setup each time. SDK versions without that code path
+    manage their own connections and are left untouched.
+    """
+    api_client = getattr(client, "_api_client", None)
+    if api_client is None or not hasattr(api_client, "_request_unauthorized"):
+        return False
+
+    try:
+        from google.genai import errors
+        from google.genai._api_client import HttpResponse, RequestJsonEncoder
+    except ImportError:
+        return False
+
+    def _request_unauthorized(http_request, stream: bool = False):
+        data = None
+        if http_request.data:
+            if not isinstance(http_request.data, bytes):
+                data = json.dumps(http_request.data, cls=RequestJsonEncoder)
+            else:
+                data = http_request.data
+
+        response = session.request(
+            method=http_request.method,
+            url=http_request.url,
+            headers=http_request.headers,
+            data=data,
+            stream=stream,
+        )
+        timing = REQUEST_TIMING.get()
+        if timing is not None:
+            timing["ttfb"] = response.elapsed.total_seconds()
+        errors.APIError.raise_for_response(response)
+        return HttpResponse(
+            response.headers, response if stream else [response.text]
+        )
+
+    api_client._request_unauthorized = _request_unauthorized
+    return True
+
+
+class ClientPool:
+    """LRU pool of genai clients keyed by a hash of the API key
+
+    Entries idle for longer than idle_ttl seconds are dropped on access, and
+    the pool never holds more than max_size clients. Safe to use from the
+    event loop and from executor threads.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Any],
+        max_size: int = 64,
+        idle_ttl: float = 900.0,
+        connections_per_client: int = 32,
+    ):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.connections_per_client = connections_per_client
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, api_key: str) -> Any:
+        key = hash_api_key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._expire_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry["last_used"] = now
+                self._entries.move_to_end(key)
+                return entry["client"]
+
+            self.misses += 1
+            client = self.factory(api_key)
+            session = _new_keepalive_session(self.connections_per_client)
+            if not _enable_keepalive(client, session):
+                session.close()
+                session = None
+            self._entries[key] = {"client": client, "session": session, "last_used": now}
+            while len(self._entries) > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._close(evicted)
+                self.evictions += 1
+            return client
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                self._close(entry)
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "idle_ttl_seconds": self.idle_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _expire_idle(self, now: float):
+        # Entries are in LRU order, so the idle ones are all at the front
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry["last_used"] <= self.idle_ttl:
+                break
+            del self._entries[key]
+            self._close(entry)
+            self.expirations += 1
+
+    @staticmethod
+    def _close(entry: Dict):
+        if entry.get("session") is not None:
+            entry["session"].close()
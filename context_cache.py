@@ -0,0 +1,124 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from client_pool import hash_api_key
+from prompt_builder import estimate_tokens
+from singleflight import SingleFlight
+
+
+class ContextCache:
+    """Registers prompt prefixes repeated across calls as provider cached content
+
+    The second time an (API key, model) pair is called with the same prefix,
+    and only when the prefix has at least the model's min_tokens (the
+    provider's floor for cached content), it is uploaded once through
+    client.aio.caches.create. Later calls send only the rest of the prompt
+    and refer to the cache by name. Entries are re-created shortly before
+    their ttl runs out. When creation fails (the client has no caches API,
+    the model doesn't support caching, the key lacks permission) the pair is
+    left alone for retry_after seconds and calls carry the full prompt.
+    """
+
+    def __init__(
+        self,
+        min_tokens: Dict[str, int],
+        default_min_tokens: int = 4096,
+        ttl: float = 600.0,
+        retry_after: float = 300.0,
+        max_entries: int = 512,
+    ):
+        self.min_tokens = min_tokens
+        self.default_min_tokens = default_min_tokens
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str], Dict]" = OrderedDict()
+        self._blocked: Dict[Tuple[str, str], float] = {}
+        self._creates = SingleFlight()
+        self.counters = {"hits": 0, "created": 0, "create_failures": 0, "invalidated": 0, "too_small": 0, "first_sightings": 0}
+
+    def min_tokens_for(self, model: str) -> int:
+        prefix = max((p for p in self.min_tokens if model.startswith(p)), key=len, default=None)
+        return self.min_tokens[prefix] if prefix is not None else self.default_min_tokens
+
+    def _key(self, api_key: str, model: str, prefix: str) -> Tuple[str, str, str]:
+        return hash_api_key(api_key), model, hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    async def resolve(self, client: Any, api_key: str, model: str, prefix: str) -> Optional[str]:
+        """Name of the cached content holding prefix for this key and model, or None to send the full prompt"""
+        if estimate_tokens(prefix) < self.min_tokens_for(model):
+            self.counters["too_small"] += 1
+            return None
+        key = self._key(api_key, model, prefix)
+        now = time.monotonic()
+        if self._blocked.get(key[:2], 0.0) > now:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self._remember(key, {"name": None, "expires": 0.0, "uses": 0, "tokens": None})
+            self.counters["first_sightings"] += 1
+            return None
+        self._entries.move_to_end(key)
+        if entry["name"] is None or entry["expires"] <= now:
+            name = await self._creates.do("|".join(key), lambda: self._create(client, key, model, prefix))
+            if name is None:
+                return None
+        else:
+            self.counters["hits"] += 1
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry["uses"] += 1
+        return entry["name"]
+
+    async def _create(self, client: Any, key: Tuple[str, str, str], model: str, prefix: str) -> Optional[str]:
+        try:
+            cached = await client.aio.caches.create(
+                model=model,
+                contents=prefix,
+                config={"ttl": f"{int(self.ttl)}s", "display_name": f"devgenie-{key[2][:16]}"},
+            )
+        except Exception as e:
+            self.counters["create_failures"] += 1
+            self._blocked[key[:2]] = time.monotonic() + self.retry_after
+            print(f"⚠️ Context cache unavailable for {model} ({type(e).__name__}: {e}); sending full prompts")
+            return None
+        usage = getattr(cached, "usage_metadata", None)
+        self._remember(key, {
+            "name": cached.name,
+            # Stop referring to it a little early so no call races the provider-side expiry
+            "expires": time.monotonic() + self.ttl * 0.9,
+            "uses": 0,
+            "tokens": getattr(usage, "total_token_count", None),
+        })
+        self.counters["created"] += 1
+        print(f"🧊 Cached {estimate_tokens(prefix)}-token prompt prefix for {model} as {cached.name}")
+        return cached.name
+
+    def _remember(self, key: Tuple[str, str, str], entry: Dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, api_key: str, model: str, prefix: str):
+        """Forget the cached content for prefix (the provider no longer knows it); the next call re-creates it"""
+        entry = self._entries.get(self._key(api_key, model, prefix))
+        if entry is not None and entry["name"] is not None:
+            entry["name"] = None
+            entry["expires"] = 0.0
+            self.counters["invalidated"] += 1
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        live = [e for e in self._entries.values() if e["name"] is not None and e["expires"] > now]
+        return {
+            **self.counters,
+            "ttl": self.ttl,
+            "live_caches": len(live),
+            "tracked_prefixes": len(self._entries),
+            "cached_tokens_registered": sum(e["tokens"] or 0 for e in live),
+            "blocked": sum(1 for until in self._blocked.values() if until > now),
+        }
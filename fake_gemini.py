@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import math
+import random
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+# Per-model behaviour of the stand-in, matched by longest name prefix.
+# latency: median seconds and lognormal sigma; output_tokens: mean and spread;
+# errors: HTTP status -> probability per call
+DEFAULT_PROFILES = {
+    "gemini-2.5-pro": {"latency": (18.0, 0.5), "output_tokens": (2200, 600), "errors": {503: 0.03, 429: 0.02}},
+    "gemini-pro": {"latency": (18.0, 0.5), "output_tokens": (2200, 600), "errors": {503: 0.03, 429: 0.02}},
+    "gemini-2.0-flash-thinking": {"latency": (12.0, 0.5), "output_tokens": (1800, 500), "errors": {404: 0.02, 503: 0.03}},
+    "gemini-2.5-flash-lite": {"latency": (2.5, 0.4), "output_tokens": (900, 300), "errors": {503: 0.01}},
+    "gemini-2.0-flash-lite": {"latency": (2.0, 0.4), "output_tokens": (800, 250), "errors": {503: 0.01}},
+    "gemini-flash-lite": {"latency": (2.5, 0.4), "output_tokens": (900, 300), "errors": {503: 0.01}},
+    "gemini-2.5-flash": {"latency": (6.0, 0.45), "output_tokens": (1500, 400), "errors": {503: 0.02, 429: 0.01}},
+    "gemini-2.0-flash": {"latency": (4.0, 0.4), "output_tokens": (1200, 350), "errors": {503: 0.02}},
+    "gemini-flash": {"latency": (6.0, 0.45), "output_tokens": (1500, 400), "errors": {503: 0.02}},
+    "gemma": {"latency": (8.0, 0.6), "output_tokens": (1000, 400), "errors": {500: 0.03}},
+    "": {"latency": (5.0, 0.5), "output_tokens": (1000, 300), "errors": {503: 0.02}},
+}
+
+ERROR_STATUS = {
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+}
+
+# The judge prompt from agents.build_evaluation_prompt ends with this line
+JUDGE_MARKER = "Your score (number only):"
+
+
+class FakeAPIError(Exception):
+    """Stand-in for google.genai.errors.APIError (classify_error reads .code)"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {ERROR_STATUS.get(code, 'ERROR')}. {message}")
+        self.code = code
+
+
+def profile_for(model: str, profiles: Dict[str, Dict]) -> Dict:
+    prefix = max((p for p in profiles if model.startswith(p)), key=len, default=None)
+    if prefix is None:
+        return DEFAULT_PROFILES[""]
+    return profiles[prefix]
+
+
+class FakeModels:
+    """Sync/async generate_content with latency, failures and output sizes drawn per model"""
+
+    def __init__(self, client: "FakeGeminiClient", is_async: bool):
+        self._client = client
+        self._async = is_async
+
+    def _plan(self, model: str, prompt: str):
+        profile = profile_for(model, self._client.profiles)
+        rng = self._client.rng
+        median, sigma = profile["latency"]
+        latency = median * math.exp(rng.gauss(0, sigma)) * self._client.time_scale
+        error = None
+        roll = rng.random()
+        for code, probability in profile.get("errors", {}).items():
+            if roll < probability:
+                error = FakeAPIError(code, f"fake failure for {model}")
+                break
+            roll -= probability
+        return latency, error, profile
+
+    def _respond(self, model: str, prefix: str, contents: str, profile: Dict):
+        self._client.calls += 1
+        prompt = prefix + contents
+        if JUDGE_MARKER in prompt:
+            score = 55 + int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16) % 41
+            return FakeResponse(str(score), prompt, prefix)
+        mean, spread = profile["output_tokens"]
+        tokens = max(20, int(self._client.rng.gauss(mean, spread)))
+        return FakeResponse(fake_output(model, prompt, tokens, self._client.rng), prompt, prefix)
+
+    def generate_content(self, model: str, contents, config=None):
+        cached_name = config.get("cached_content") if isinstance(config, dict) else getattr(config, "cached_content", None)
+        prefix = self._client.cached_prefix(cached_name, model) if cached_name else ""
+        latency, error, profile = self._plan(model, prefix + str(contents))
+        if self._async:
+            return self._generate_async(model, prefix, str(contents), latency, error, profile)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return self._respond(model, prefix, str(contents), profile)
+
+    async def _generate_async(self, model: str, prefix: str, contents: str, latency: float, error, profile: Dict):
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return self._respond(model, prefix, contents, profile)
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt: str, cached_prefix: str = ""):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=(len(prompt) + 3) // 4,
+            candidates_token_count=(len(text) + 3) // 4,
+            cached_content_token_count=(len(cached_prefix) + 3) // 4 if cached_prefix else None,
+        )
+
+
+class FakeCaches:
+    """caches.create / delete: cached content the fake models prepend to the request contents"""
+
+    def __init__(self, client: "FakeGeminiClient", is_async: bool):
+        self._client = client
+        self._async = is_async
+
+    def _create(self, model: str, contents, config=None) -> SimpleNamespace:
+        text = str(contents)
+        tokens = (len(text) + 3) // 4
+        if tokens < self._client.min_cache_tokens:
+            raise FakeAPIError(400, f"Cached content is too small: {tokens} tokens, min {self._client.min_cache_tokens}")
+        ttl = (config.get("ttl") if isinstance(config, dict) else getattr(config, "ttl", None)) or "3600s"
+        name = f"cachedContents/fake-{len(self._client.cached_contents) + 1}"
+        self._client.cached_contents[name] = {
+            "model": model,
+            "text": text,
+            "expires": time.monotonic() + float(str(ttl).rstrip("s")) * self._client.time_scale,
+        }
+        return SimpleNamespace(name=name, model=model, usage_metadata=SimpleNamespace(total_token_count=tokens))
+
+    def create(self, *, model: str, contents, config=None):
+        if self._async:
+            return self._create_async(model, contents, config)
+        return self._create(model, contents, config)
+
+    async def _create_async(self, model: str, contents, config=None):
+        return self._create(model, contents, config)
+
+    def delete(self, *, name: str, config=None):
+        self._client.cached_contents.pop(name, None)
+        if self._async:
+            return asyncio.sleep(0)
+
+
+def fake_output(model: str, prompt: str, tokens: int, rng: random.Random) -> str:
+    """Markdown answer of roughly `tokens` tokens: a short explanation and a code block"""
+    tag = hashlib.sha1(f"{model}\0{prompt}\0{rng.random()}".encode("utf-8")).hexdigest()[:8]
+    lines = [
+        f"Here is the improved solution ({model}, revision {tag}).",
+        "",
+        "```python",
+        f'"""Solution revision {tag}."""',
+        "",
+    ]
+    size = sum(len(line) + 1 for line in lines)
+    index = 0
+    while size < tokens * 4:
+        line = f"def step_{tag}_{index}(value):\n    \"\"\"Handle part {index}.\"\"\"\n    return value + {index}\n"
+        lines.append(line)
+        size += len(line) + 1
+        index += 1
+    lines.extend(["```", "", "The code handles errors and documents each function."])
+    return "\n".join(lines)
+
+
+class FakeGeminiClient:
+    """Local stand-in for genai.Client: .models (blocking) and .aio.models (async)
+
+    time_scale multiplies every simulated latency, so a realistic profile can
+    be replayed quickly. seed makes latency, failure and size draws repeatable.
+    .caches / .aio.caches accept cached content of at least min_cache_tokens;
+    its ttl is scaled by time_scale too.
+    """
+
+    def __init__(self, profiles: Optional[Dict[str, Dict]] = None, time_scale: float = 1.0, seed: Optional[int] = None, min_cache_tokens: int = 1024):
+        self.profiles = profiles or DEFAULT_PROFILES
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.min_cache_tokens = min_cache_tokens
+        self.cached_contents: Dict[str, Dict] = {}
+        self.models = FakeModels(self, is_async=False)
+        self.caches = FakeCaches(self, is_async=False)
+        self.aio = SimpleNamespace(models=FakeModels(self, is_async=True), caches=FakeCaches(self, is_async=True))
+
+    def cached_prefix(self, name: str, model: str) -> str:
+        entry = self.cached_contents.get(name)
+        if entry is None or entry["expires"] <= time.monotonic():
+            raise FakeAPIError(404, f"CachedContent not found (or expired): {name}")
+        if entry["model"] != model:
+            raise FakeAPIError(400, f"Model {model} does not match cached content model {entry['model']}")
+        return entry["text"]
+
+
+def install(profiles: Optional[Dict[str, Dict]] = None, time_scale: float = 1.0, seed: Optional[int] = None, min_cache_tokens: int = 1024) -> FakeGeminiClient:
+    """Serve every agents.get_client() call from one FakeGeminiClient"""
+    import agents
+
+    client = FakeGeminiClient(profiles, time_scale, seed, min_cache_tokens)
+    agents.CLIENT_POOL.clear()
+    agents.CLIENT_POOL.factory = lambda api_key: client
+    return client
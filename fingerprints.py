@@ -0,0 +1,78 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from prompt_builder import split_segments
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SHINGLE_SIZE = 3
+
+
+class Fingerprint(NamedTuple):
+    exact: str  # sha1 of the normalized code
+    simhash: int  # 64-bit simhash of its token shingles
+
+
+def normalize_code(text: str) -> str:
+    """The output's code blocks (or the whole text if it has none), fences dropped and whitespace collapsed"""
+    code = [block for kind, block in split_segments(text) if kind == "code"]
+    source = "\n".join(re.sub(r"^```[^\n]*\n?|```\s*$", "", block) for block in code) if code else (text or "")
+    lines = (" ".join(line.split()) for line in source.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def simhash(text: str) -> int:
+    tokens = TOKEN_RE.findall(text)
+    shingles = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))]
+    bits = [
+        format(int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big"), "064b")
+        for s in shingles
+    ]
+    half = len(bits) / 2
+    # Column-wise vote: a bit is set when most shingle hashes have it set
+    return int("".join("1" if column.count("1") > half else "0" for column in zip(*bits)), 2)
+
+
+@lru_cache(maxsize=256)
+def fingerprint(text: str) -> Fingerprint:
+    """Exact hash and simhash of an output's normalized code (memoized: lookups and inserts share the work)"""
+    normalized = normalize_code(text)
+    return Fingerprint(hashlib.sha1(normalized.encode("utf-8")).hexdigest(), simhash(normalized))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class FingerprintIndex:
+    """Fingerprints of already scored outputs, for exact and near-duplicate lookups
+
+    A near duplicate is an output whose simhash differs in at most
+    max_distance of its 64 bits. Chains hold a few dozen outputs at most, so
+    near lookups scan them all.
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        self._exact: Dict[str, object] = {}
+        self._near: List[Tuple[int, object]] = []
+
+    def copy(self) -> "FingerprintIndex":
+        index = FingerprintIndex(self.max_distance)
+        index._exact = dict(self._exact)
+        index._near = list(self._near)
+        return index
+
+    def add(self, fp: Fingerprint, value):
+        self._exact.setdefault(fp.exact, value)
+        self._near.append((fp.simhash, value))
+
+    def lookup(self, fp: Fingerprint) -> Optional[Tuple[str, object]]:
+        """("exact" | "near", value) of the first matching output, or None"""
+        if fp.exact in self._exact:
+            return "exact", self._exact[fp.exact]
+        for other, value in self._near:
+            if hamming(fp.simhash, other) <= self.max_distance:
+                return "near", value
+        return None
@@ -0,0 +1,171 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+class JobQueue:
+    """Bounded queue of chain jobs worked off by a fixed pool of asyncio workers
+
+    runner(params, on_step) is awaited for each job and must return the final
+    payload; on_step(event) records per-step progress on the job.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Dict, Callable[[Dict], None]], Awaitable[Dict]],
+        workers: int = 4,
+        max_queue: int = 100,
+        max_finished: int = 500,
+        timing_window: int = 200,
+    ):
+        self.runner = runner
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self.jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self.timings = deque(maxlen=timing_window)
+        self.counters = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0}
+        self.busy_workers = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Create the queue and spawn the worker pool on the running loop"""
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [
+            asyncio.create_task(self._worker(n), name=f"chain-worker-{n}")
+            for n in range(self.workers)
+        ]
+        print(f"🧵 Job queue started: {self.workers} workers, queue size {self.max_queue}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, params: Dict) -> Dict:
+        """Enqueue a job and return its public view; raises JobQueueFull when at capacity"""
+        if self._queue is None:
+            raise RuntimeError("JobQueue.start() has not been awaited")
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "mode": params.get("mode"),
+            "task_preview": params.get("task", "")[:100],
+            "submitted_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "queue_wait_seconds": None,
+            "run_seconds": None,
+            "current_step": 0,
+            "total_steps": None,
+            "current_model": None,
+            "best_model": None,
+            "best_score": None,
+            "partial_output": None,
+            "steps": [],
+            "result": None,
+            "error": None,
+            "_params": params,
+            "_submitted": time.monotonic(),
+        }
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise JobQueueFull(f"Job queue is full ({self.max_queue} waiting)")
+
+        self.jobs[job_id] = job
+        self.counters["submitted"] += 1
+        self._evict_finished()
+        return self.view(job)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        job = self.jobs.get(job_id)
+        return self.view(job) if job is not None else None
+
+    @staticmethod
+    def view(job: Dict) -> Dict:
+        """Public representation of a job (never includes the request's API key)"""
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def stats(self) -> Dict:
+        queue_waits = [t["queue_wait_seconds"] for t in self.timings]
+        run_times = [t["run_seconds"] for t in self.timings]
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "workers": self.workers,
+            "busy_workers": self.busy_workers,
+            **self.counters,
+            "queue_wait_seconds": {"p50": _percentile(queue_waits, 50), "p95": _percentile(queue_waits, 95)},
+            "run_seconds": {"p50": _percentile(run_times, 50), "p95": _percentile(run_times, 95)},
+            "recent_jobs": list(self.timings)[-20:],
+        }
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def _record_step(self, job: Dict, event: Dict):
+        job["current_step"] = event["step"]
+        job["total_steps"] = event["total_steps"]
+        job["current_model"] = event["model"]
+        job["best_model"] = event["best_model"]
+        job["best_score"] = event["best_score"]
+        job["partial_output"] = event["best_output"]
+        job["steps"].append({k: v for k, v in event.items() if k != "best_output"})
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self._queue.get()
+            started = time.monotonic()
+            job["status"] = "running"
+            job["started_at"] = datetime.now().isoformat()
+            job["queue_wait_seconds"] = round(started - job["_submitted"], 3)
+            self.busy_workers += 1
+            try:
+                job["result"] = await self.runner(job["_params"], lambda event: self._record_step(job, event))
+                job["status"] = "succeeded"
+                self.counters["succeeded"] += 1
+            except asyncio.CancelledError:
+                job["status"] = "failed"
+                job["error"] = "Cancelled"
+                raise
+            except Exception as e:
+                print(f"❌ Job {job['job_id']} failed: {str(e)}")
+                job["status"] = "failed"
+                job["error"] = str(e)
+                self.counters["failed"] += 1
+            finally:
+                self.busy_workers -= 1
+                job["finished_at"] = datetime.now().isoformat()
+                job["run_seconds"] = round(time.monotonic() - started, 3)
+                job.pop("_params", None)
+                self.timings.append({
+                    "job_id": job["job_id"],
+                    "mode": job["mode"],
+                    "status": job["status"],
+                    "queue_wait_seconds": job["queue_wait_seconds"],
+                    "run_seconds": job["run_seconds"],
+                })
+                self._queue.task_done()
@@ -0,0 +1,282 @@
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Seconds; covers fast judge calls up to the slowest pro/thinking deadlines
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 240.0)
+RUN_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 2400.0)
+
+STAGES = ("generation", "evaluation")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition layout"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], Dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._series[labels] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {count}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, inf)} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(round(series['sum'], 6))}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them for the /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+CALL_SECONDS = REGISTRY.histogram(
+    "devgenie_model_call_seconds", "Wall time of model calls, retries included", ("model", "mode", "stage")
+)
+CALL_TTFB_SECONDS = REGISTRY.histogram(
+    "devgenie_model_ttfb_seconds", "Time until the provider's response headers arrived", ("model", "mode", "stage")
+)
+STEP_SECONDS = REGISTRY.histogram(
+    "devgenie_chain_step_seconds", "Wall time of one chain step (generation plus scoring)", ("mode", "execution")
+)
+RUN_SECONDS = REGISTRY.histogram(
+    "devgenie_chain_run_seconds", "Wall time of a whole chain run", ("mode", "execution"), RUN_BUCKETS
+)
+CALLS = REGISTRY.counter(
+    "devgenie_model_calls_total", "Model calls by outcome (success, error, cached, skipped)", ("model", "mode", "stage", "outcome")
+)
+RETRIES = REGISTRY.counter(
+    "devgenie_model_retries_total", "Extra attempts spent on retryable errors", ("model", "stage")
+)
+HEDGES = REGISTRY.counter(
+    "devgenie_model_hedges_total", "Calls whose backup request was sent, by which side answered", ("model", "stage", "winner")
+)
+TOKENS = REGISTRY.counter(
+    "devgenie_model_tokens_total", "Tokens reported in the response usage metadata", ("model", "stage", "direction")
+)
+RUNS = REGISTRY.counter(
+    "devgenie_chain_runs_total", "Finished chain runs (success, error, cancelled)", ("mode", "execution", "outcome")
+)
+STEPS_SAVED = REGISTRY.counter(
+    "devgenie_chain_steps_saved_total", "Chain steps never run because their run was cancelled", ("mode", "execution")
+)
+CALLS_ABANDONED = REGISTRY.counter(
+    "devgenie_model_calls_abandoned_total", "In-flight model calls abandoned when their run was cancelled", ("model",)
+)
+
+
+def call_outcome(result: Dict) -> str:
+    if result.get("cached"):
+        return "cached"
+    if result.get("skipped"):
+        return "skipped"
+    return "success" if result.get("success") else "error"
+
+
+class RunMetrics:
+    """Per-request collector behind the /run performance_metrics field"""
+
+    def __init__(self, mode: str, execution: str):
+        self.mode = mode
+        self.execution = execution
+        self.started = time.monotonic()
+        self.calls: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, result: Dict):
+        with self._lock:
+            self.calls.append({"stage": stage, **{k: v for k, v in result.items() if k != "output"}})
+
+    def tokens_used(self) -> int:
+        """Input + output tokens reported so far (cache hits cost nothing)"""
+        with self._lock:
+            return sum((c.get("input_tokens") or 0) + (c.get("output_tokens") or 0) for c in self.calls if not c.get("cached"))
+
+    def summary(self, steps: Optional[List[Dict]] = None) -> Dict:
+        with self._lock:
+            calls = list(self.calls)
+        stages = {}
+        models = {}
+        for stage in STAGES:
+            stage_calls = [c for c in calls if c["stage"] == stage]
+            timed = [c["ttfb"] for c in stage_calls if c.get("ttfb") is not None]
+            stages[stage] = {
+                "calls": len(stage_calls),
+                "cache_hits": sum(1 for c in stage_calls if c.get("cached")),
+                "failures": sum(1 for c in stage_calls if not c.get("success")),
+                "retries": sum(max(0, c.get("attempts", 1) - 1) for c in stage_calls),
+                "wall_time": round(sum(c.get("latency") or 0 for c in stage_calls), 3),
+                "avg_ttfb": round(sum(timed) / len(timed), 3) if timed else None,
+                "queue_wait": round(sum(c.get("queue_wait") or 0 for c in stage_calls), 3),
+                "input_tokens": sum(c.get("input_tokens") or 0 for c in stage_calls),
+                "output_tokens": sum(c.get("output_tokens") or 0 for c in stage_calls),
+                # Part of input_tokens served from provider-side cached content
+                "cached_input_tokens": sum(c.get("cached_input_tokens") or 0 for c in stage_calls),
+            }
+        for call in calls:
+            entry = models.setdefault(call["model"], {"calls": 0, "wall_time": 0.0, "input_tokens": 0, "output_tokens": 0, "cached_input_tokens": 0})
+            entry["calls"] += 1
+            entry["wall_time"] = round(entry["wall_time"] + (call.get("latency") or 0), 3)
+            entry["input_tokens"] += call.get("input_tokens") or 0
+            entry["output_tokens"] += call.get("output_tokens") or 0
+            entry["cached_input_tokens"] += call.get("cached_input_tokens") or 0
+        return {
+            "mode": self.mode,
+            "execution": self.execution,
+            "wall_time": round(time.monotonic() - self.started, 3),
+            "stages": stages,
+            "models": models,
+            "steps": [
+                {
+                    "step": step["step"],
+                    "model": step["model"],
+                    "latency": step.get("latency"),
+                    "ttfb": step.get("ttfb"),
+                    "queue_wait": step.get("queue_wait"),
+                    "input_tokens": step.get("input_tokens"),
+                    "output_tokens": step.get("output_tokens"),
+                    "cached_input_tokens": step.get("cached_input_tokens"),
+                    "attempts": step.get("attempts", 1),
+                    "cached": bool(step.get("cached")),
+                }
+                for step in steps or []
+            ],
+        }
+
+
+CURRENT_RUN: contextvars.ContextVar = contextvars.ContextVar("devgenie_current_run", default=None)
+
+
+@contextmanager
+def collect_run(mode: str, execution: str):
+    """Collect the model calls made inside the block (and tasks it spawns) into a RunMetrics"""
+    run = RunMetrics(mode, execution)
+    token = CURRENT_RUN.set(run)
+    outcome = "error"
+    try:
+        yield run
+        outcome = "success"
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        CURRENT_RUN.reset(token)
+        RUNS.inc((mode, execution, outcome))
+        RUN_SECONDS.observe((mode, execution), time.monotonic() - run.started)
+
+
+def record_cancelled(mode: str, execution: str, steps_saved: int):
+    """Count the steps a cancelled run did not have to run"""
+    STEPS_SAVED.inc((mode, execution), max(0, steps_saved))
+
+
+def record_call(stage: str, result: Dict):
+    """Feed one model call result (a call_model / call_model_async dict) into the metrics"""
+    run = CURRENT_RUN.get()
+    mode = run.mode if run is not None else "none"
+    model = result.get("model", "unknown")
+    outcome = call_outcome(result)
+    CALLS.inc((model, mode, stage, outcome))
+    if outcome in ("success", "error") and result.get("latency") is not None:
+        CALL_SECONDS.observe((model, mode, stage), result["latency"])
+    if result.get("ttfb") is not None:
+        CALL_TTFB_SECONDS.observe((model, mode, stage), result["ttfb"])
+    if result.get("attempts", 1) > 1:
+        RETRIES.inc((model, stage), result["attempts"] - 1)
+    if result.get("hedge_fired"):
+        HEDGES.inc((result.get("requested_model", model), stage, "backup" if result.get("backup_won") else "primary"))
+    if result.get("input_tokens"):
+        TOKENS.inc((model, stage, "input"), result["input_tokens"])
+    if result.get("output_tokens"):
+        TOKENS.inc((model, stage, "output"), result["output_tokens"])
+    if result.get("cached_input_tokens"):
+        TOKENS.inc((model, stage, "cached_input"), result["cached_input_tokens"])
+    if run is not None:
+        run.record(stage, result)
+
+
+def record_steps(mode: str, execution: str, steps: List[Dict]):
+    for step in steps:
+        if step.get("latency") is not None:
+            STEP_SECONDS.observe((mode, execution), step["latency"])
@@ -0,0 +1,227 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+
+# Error classes that say the model itself is unusable, not that this call was unlucky
+FATAL_ERROR_CLASSES = ("not_found", "invalid_model")
+# Error classes that belong to the API key (quota) rather than the model
+KEY_ERROR_CLASSES = ("rate_limited", "permission_denied")
+
+_STATUS_RE = re.compile(r"\b([45]\d\d)\b")
+
+
+def classify_error(error) -> str:
+    """Map an SDK exception (or its message) to a coarse error class"""
+    code = getattr(error, "code", None)
+    message = str(error)
+    if not isinstance(code, int):
+        match = _STATUS_RE.search(message)
+        code = int(match.group(1)) if match else None
+    upper = message.upper()
+
+    if isinstance(error, TimeoutError) or "DEADLINE_EXCEEDED" in upper or "TIMED OUT" in upper:
+        return "timeout"
+    if code == 404 or "NOT_FOUND" in upper:
+        return "not_found"
+    if code == 429 or "RESOURCE_EXHAUSTED" in upper:
+        return "rate_limited"
+    if code in (401, 403) or "PERMISSION_DENIED" in upper or "API_KEY_INVALID" in upper:
+        return "permission_denied"
+    if code == 400 and "MODEL" in upper:
+        return "invalid_model"
+    if code == 400:
+        return "invalid_argument"
+    if code is not None and code >= 500:
+        return "server_error"
+    return "other"
+
+
+class ModelHealthRegistry:
+    """Process-wide per-model failure tracking with a circuit breaker
+
+    closed: calls flow; the breaker opens when the failure rate over the last
+    `window` calls reaches failure_threshold (after min_calls), or at once on
+    a fatal error such as a retired model (404). Quota errors are recorded
+    but never trip it, since they belong to the key rather than the model.
+    open: calls are refused until `cooldown` seconds pass.
+    half_open: a single probe call is let through; success closes the
+    breaker, failure re-opens it with the cooldown doubled (up to max_cooldown).
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        failure_threshold: float = 0.5,
+        min_calls: int = 4,
+        cooldown: float = 60.0,
+        max_cooldown: float = 900.0,
+        latency_window: int = 200,
+    ):
+        self.window = window
+        self.latency_window = latency_window
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._models: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, model: str) -> Dict:
+        entry = self._models.get(model)
+        if entry is None:
+            entry = {
+                "state": "closed",
+                "calls": 0,
+                "failures": 0,
+                "recent": deque(maxlen=self.window),
+                "errors": Counter(),
+                "last_error": None,
+                "last_error_at": None,
+                "opened_at": None,
+                "cooldown": self.cooldown,
+                "probe_in_flight": False,
+                "skipped": 0,
+                "latencies": deque(maxlen=self.latency_window),
+            }
+            self._models[model] = entry
+        return entry
+
+    def allow(self, model: str) -> bool:
+        """Whether a call to model may go out now (may claim the half-open probe slot)"""
+        with self._lock:
+            entry = self._entry(model)
+            if entry["state"] == "open" and time.monotonic() - entry["opened_at"] >= entry["cooldown"]:
+                entry["state"] = "half_open"
+            if entry["state"] == "closed":
+                return True
+            if entry["state"] == "half_open" and not entry["probe_in_flight"]:
+                entry["probe_in_flight"] = True
+                return True
+            entry["skipped"] += 1
+            return False
+
+    def release(self, model: str):
+        """Give back a half-open probe slot when the call ended without an outcome (e.g. cancelled)"""
+        with self._lock:
+            self._entry(model)["probe_in_flight"] = False
+
+    def record_success(self, model: str, latency: Optional[float] = None):
+        with self._lock:
+            entry = self._entry(model)
+            entry["calls"] += 1
+            entry["recent"].append(True)
+            if latency is not None:
+                entry["latencies"].append(latency)
+            if entry["state"] != "closed":
+                print(f"🟢 Circuit closed for {model}")
+            entry["state"] = "closed"
+            entry["probe_in_flight"] = False
+            entry["cooldown"] = self.cooldown
+
+    def record_failure(self, model: str, error_class: str, error: Optional[str] = None):
+        with self._lock:
+            entry = self._entry(model)
+            entry["calls"] += 1
+            entry["failures"] += 1
+            entry["errors"][error_class] += 1
+            entry["last_error"] = (error or "")[:300]
+            entry["last_error_at"] = time.time()
+            if error_class in KEY_ERROR_CLASSES:
+                entry["probe_in_flight"] = False
+                return
+            entry["recent"].append(False)
+
+            if entry["state"] == "half_open":
+                entry["cooldown"] = min(self.max_cooldown, entry["cooldown"] * 2)
+                self._open(model, entry)
+            elif entry["state"] == "closed":
+                failures = entry["recent"].count(False)
+                rate = failures / len(entry["recent"])
+                if error_class in FATAL_ERROR_CLASSES or (
+                    len(entry["recent"]) >= self.min_calls and rate >= self.failure_threshold
+                ):
+                    self._open(model, entry)
+
+    def _open(self, model: str, entry: Dict):
+        entry["state"] = "open"
+        entry["opened_at"] = time.monotonic()
+        entry["probe_in_flight"] = False
+        print(f"🔴 Circuit open for {model} for {entry['cooldown']:.0f}s ({entry['last_error']})")
+
+    def latency_percentile(self, model: str, pct: float, min_samples: int = 20) -> Optional[float]:
+        """Latency percentile of recent successful calls, or None with fewer than min_samples"""
+        with self._lock:
+            entry = self._models.get(model)
+            if entry is None or len(entry["latencies"]) < min_samples:
+                return None
+            return self._percentile(entry["latencies"], pct)
+
+    def state(self, model: str) -> str:
+        with self._lock:
+            return self._entry(model)["state"]
+
+    @staticmethod
+    def _percentile(values, pct: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 3)
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for model, entry in sorted(self._models.items()):
+                recent = entry["recent"]
+                models[model] = {
+                    "state": entry["state"],
+                    "calls": entry["calls"],
+                    "failures": entry["failures"],
+                    "recent_failure_rate": round(recent.count(False) / len(recent), 3) if recent else None,
+                    "errors": dict(entry["errors"]),
+                    "last_error": entry["last_error"],
+                    "last_error_at": entry["last_error_at"],
+                    "skipped_calls": entry["skipped"],
+                    "latency_p50": self._percentile(entry["latencies"], 50),
+                    "latency_p95": self._percentile(entry["latencies"], 95),
+                    "retry_in_seconds": (
+                        round(max(0.0, entry["cooldown"] - (now - entry["opened_at"])), 1)
+                        if entry["state"] == "open" else None
+                    ),
+                }
+            return models
+
+
+class StageLatencies:
+    """Recent latencies of successful calls per (stage, model), for planning chains
+
+    Generation and judge calls are kept apart: a model that also serves as
+    the judge answers its short scoring prompts much faster than a step.
+    """
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._latencies: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, model: str, latency: float):
+        with self._lock:
+            self._latencies.setdefault((stage, model), deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, stage: str, model: str, pct: float, min_samples: int = 5) -> Optional[float]:
+        """pct latency of model in stage, or None with fewer than min_samples"""
+        with self._lock:
+            values = list(self._latencies.get((stage, model), ()))
+        return ModelHealthRegistry._percentile(values, pct) if len(values) >= min_samples else None
+
+    def pooled_percentile(self, stage: str, pct: float, min_samples: int = 5) -> Optional[float]:
+        """pct latency over every model of stage: the prior for a model without samples of its own"""
+        with self._lock:
+            values = [v for (s, _), latencies in self._latencies.items() if s == stage for v in latencies]
+        return ModelHealthRegistry._percentile(values, pct) if len(values) >= min_samples else None
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {f"{stage}:{model}": len(values) for (stage, model), values in sorted(self._latencies.items())}
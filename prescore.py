@@ -0,0 +1,173 @@
+import ast
+import asyncio
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Tuple
+
+# Fenced blocks: ```lang\n ... ``` (an unterminated last fence is captured too)
+CODE_BLOCK_RE = re.compile(r"```([\w+#.-]*)[^\n]*\n(.*?)(?:```|\Z)", re.DOTALL)
+PYTHON_TAGS = ("", "python", "py", "python3")
+TASK_WORD_RE = re.compile(r"[a-zA-Z_]{4,}")
+MAIN_GUARD_RE = re.compile(r"^if\s+__name__\s*==\s*['\"]__main__['\"]\s*:", re.MULTILINE)
+
+PRESCORE_WORKERS = int(os.getenv("PRESCORE_WORKERS", "2"))
+
+_pool = None
+_in_process = False  # set once the pool cannot be used: score on a thread instead
+
+
+def extract_code_blocks(text: str) -> List[Tuple[str, str]]:
+    """Return (language, code) for every fenced code block in a model output"""
+    return [(lang.lower(), code) for lang, code in CODE_BLOCK_RE.findall(text or "")]
+
+
+def _python_metrics(code: str) -> Dict:
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return {"parsed": False}
+
+    definitions = [
+        node for node in ast.walk(tree)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    ]
+    documented = sum(1 for node in definitions if ast.get_docstring(node))
+    return {
+        "parsed": True,
+        "definitions": len(definitions),
+        "documented": documented,
+        "try_blocks": sum(1 for node in ast.walk(tree) if isinstance(node, ast.Try)),
+        "raises": sum(1 for node in ast.walk(tree) if isinstance(node, ast.Raise)),
+    }
+
+
+def _looks_truncated(text: str) -> bool:
+    stripped = (text or "").rstrip()
+    if not stripped:
+        return True
+    if stripped.count("```") % 2:
+        return True  # unterminated code fence
+    return stripped[-1] in ",([{:\\" or stripped.endswith(("...", "and", "the"))
+
+
+def local_prescore(output: str, task: str) -> Dict:
+    """Deterministic 1-100 estimate of a response's quality, mirroring the judge rubric
+
+    Task completion 30, code quality 25, documentation 20, error handling 15
+    and completeness 10, measured from the text and the parsed code only.
+    """
+    blocks = extract_code_blocks(output)
+    python_blocks = [code for lang, code in blocks if lang in PYTHON_TAGS]
+    metrics = [_python_metrics(code) for code in python_blocks]
+    parsed = [m for m in metrics if m["parsed"]]
+    code_lines = [line for _, code in blocks for line in code.splitlines() if line.strip()]
+    comment_lines = [line for line in code_lines if line.lstrip().startswith(("#", "//"))]
+
+    task_words = {w.lower() for w in TASK_WORD_RE.findall(task or "")}
+    output_lower = (output or "").lower()
+    coverage = (sum(1 for w in task_words if w in output_lower) / len(task_words)) if task_words else 1.0
+
+    # Task completion (30)
+    completion = 10 * bool(blocks) + 20 * coverage
+
+    # Code quality (25): compiles, is structured, no absurdly long lines
+    syntax_ratio = (len(parsed) / len(metrics)) if metrics else (1.0 if blocks else 0.0)
+    definitions = sum(m["definitions"] for m in parsed)
+    long_lines = sum(1 for line in code_lines if len(line) > 120)
+    quality = 15 * syntax_ratio + 5 * bool(definitions) + 5 * (1 - min(1.0, long_lines / max(1, len(code_lines))))
+
+    # Documentation (20): docstrings, comments, surrounding explanation
+    docstring_ratio = (sum(m["documented"] for m in parsed) / definitions) if definitions else 0.0
+    comment_ratio = len(comment_lines) / len(code_lines) if code_lines else 0.0
+    prose = CODE_BLOCK_RE.sub("", output or "").strip()
+    documentation = 10 * docstring_ratio + 5 * min(1.0, comment_ratio / 0.1) + 5 * (len(prose) > 80)
+
+    # Error handling (15)
+    try_blocks = sum(m["try_blocks"] for m in parsed)
+    raises = sum(m["raises"] for m in parsed)
+    error_handling = 8 * bool(try_blocks) + 7 * bool(raises)
+
+    # Completeness (10)
+    truncated = _looks_truncated(output)
+    completeness = 0 if truncated else 10
+
+    score = completion + quality + documentation + error_handling + completeness
+    return {
+        "score": int(min(100, max(1, round(score)))),
+        "code_blocks": len(blocks),
+        "syntax_ok": syntax_ratio == 1.0,
+        "docstring_ratio": round(docstring_ratio, 3),
+        "comment_ratio": round(comment_ratio, 3),
+        "has_error_handling": bool(try_blocks or raises),
+        "truncated": truncated,
+        "task_coverage": round(coverage, 3),
+    }
+
+
+def _main_is_spawn_safe() -> bool:
+    """Whether spawned workers can re-import __main__ without re-running the caller's script
+
+    Spawn workers import the parent's main module as __mp_main__. Package
+    __main__ modules and interactive sessions are skipped; a script is only
+    safe when its top-level code sits behind an if __name__ == "__main__" guard.
+    """
+    main = sys.modules.get("__main__")
+    spec = getattr(main, "__spec__", None)
+    if spec is not None and (spec.name == "__main__" or spec.name.endswith(".__main__")):
+        return True
+    path = getattr(main, "__file__", None)
+    if path is None:
+        return True
+    try:
+        with open(path, encoding="utf-8") as f:
+            return MAIN_GUARD_RE.search(f.read()) is not None
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def _fall_back_in_process(reason: str):
+    global _in_process
+    if not _in_process:
+        _in_process = True
+        print(f"⚠️ Prescoring in-process on a thread ({reason})")
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the API process has live threads, which fork does not copy safely
+        _pool = ProcessPoolExecutor(
+            max_workers=PRESCORE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def local_prescore_async(output: str, task: str) -> Dict:
+    """Run local_prescore in the process pool so parsing never stalls the event loop
+
+    Falls back to a thread when the caller's main module would be re-run by
+    spawned workers or the pool cannot start.
+    """
+    if _pool is None and not _in_process and not _main_is_spawn_safe():
+        _fall_back_in_process("__main__ has no if __name__ == \"__main__\" guard")
+    if not _in_process:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(_get_pool(), local_prescore, output, task)
+        except (BrokenProcessPool, OSError) as e:
+            shutdown_pool()
+            _fall_back_in_process(f"process pool unavailable: {type(e).__name__}: {e}")
+    return await asyncio.to_thread(local_prescore, output, task)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+_in_process = False  # set once the pool cannot be used: score on a thread instead
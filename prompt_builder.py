@@ -0,0 +1,79 @@
+import hashlib
+import re
+from typing import List, Tuple
+
+# Fenced code blocks, kept verbatim when a previous output is compacted
+FENCE_RE = re.compile(r"```.*?(?:```|\Z)", re.DOTALL)
+
+# Prose kept alongside the code when compacting, as a short change summary
+CHANGE_SUMMARY_TOKENS = 200
+COMPACTION_NOTE = "[Earlier explanation condensed: code kept in full, repeated prose dropped]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count (about four characters per token)"""
+    return (len(text or "") + 3) // 4
+
+
+def _paragraph_key(paragraph: str) -> str:
+    normalized = " ".join(paragraph.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def split_segments(text: str) -> List[Tuple[str, str]]:
+    """Split an output into ordered ("code", block) and ("prose", paragraph) segments"""
+    segments = []
+    position = 0
+    for match in FENCE_RE.finditer(text or ""):
+        segments.extend(("prose", p) for p in re.split(r"\n\s*\n", text[position:match.start()]) if p.strip())
+        segments.append(("code", match.group(0)))
+        position = match.end()
+    segments.extend(("prose", p) for p in re.split(r"\n\s*\n", (text or "")[position:]) if p.strip())
+    return segments
+
+
+class PromptCompactor:
+    """Keeps the previous output in a step prompt within a token budget
+
+    Outputs under the budget pass through untouched. Larger ones are reduced
+    to their code blocks plus a short summary made of prose paragraphs that
+    no earlier step already produced.
+    """
+
+    def __init__(self, token_budget: int = None):
+        self.token_budget = token_budget
+        # paragraph key -> key of the output that first produced it
+        self._paragraph_origin = {}
+
+    def observe(self, output: str):
+        """Remember an output's prose so later steps can drop paragraphs that repeat it"""
+        origin = _paragraph_key(output)
+        for kind, segment in split_segments(output):
+            if kind == "prose":
+                self._paragraph_origin.setdefault(_paragraph_key(segment), origin)
+
+    def compact(self, output: str) -> Tuple[str, int]:
+        """Return (text to embed in the prompt, estimated input tokens saved)"""
+        original_tokens = estimate_tokens(output)
+        if not self.token_budget or original_tokens <= self.token_budget:
+            return output, 0
+
+        origin = _paragraph_key(output)
+        segments = split_segments(output)
+        code_tokens = sum(estimate_tokens(s) for kind, s in segments if kind == "code")
+        prose_budget = min(CHANGE_SUMMARY_TOKENS, max(0, self.token_budget - code_tokens))
+
+        kept = [COMPACTION_NOTE]
+        for kind, segment in segments:
+            if kind == "code":
+                kept.append(segment)
+                continue
+            if self._paragraph_origin.get(_paragraph_key(segment), origin) != origin:
+                continue  # carried over from an earlier step
+            cost = estimate_tokens(segment)
+            if cost <= prose_budget:
+                kept.append(segment.strip())
+                prose_budget -= cost
+
+        compacted = "\n\n".join(kept)
+        return compacted, max(0, original_tokens - estimate_tokens(compacted))
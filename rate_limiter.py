@@ -0,0 +1,278 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Tuple
+
+import metrics
+from client_pool import hash_api_key
+
+QUEUE_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    "devgenie_rate_limit_wait_seconds",
+    "Time model calls spent queued for their (API key, model) rate limit",
+    ("model",),
+    (0.0, 0.05, 0.25, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+)
+THROTTLED = metrics.REGISTRY.counter(
+    "devgenie_rate_limit_throttled_total", "Model calls that had to wait for rate-limit budget", ("model",)
+)
+
+# (flow id, weight) of the request a model call belongs to
+CURRENT_FLOW: contextvars.ContextVar = contextvars.ContextVar("devgenie_rate_limit_flow", default=None)
+_flow_ids = itertools.count(1)
+
+
+@contextmanager
+def flow(weight: float = 1.0):
+    """Mark the calls made inside the block (and tasks it spawns) as one fair-queuing flow"""
+    token = CURRENT_FLOW.set((next(_flow_ids), weight))
+    try:
+        yield
+    finally:
+        CURRENT_FLOW.reset(token)
+
+
+class TokenBucket:
+    """Refills at `rate` units per second up to `capacity`; may run into debt after settle()"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self.refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+
+class _Lane:
+    """Buckets and fair queue of one (API key, model) pair"""
+
+    def __init__(self, rpm: float, tpm: float, burst_seconds: float = 60.0):
+        # Requests may burst burst_seconds' worth (the provider counts per minute); tokens a full minute's
+        self.requests = TokenBucket(rpm / 60.0, max(1.0, rpm * burst_seconds / 60.0))
+        self.tokens = TokenBucket(tpm / 60.0, tpm)
+        self.waiters = []  # heap of (finish tag, seq, future, tokens)
+        self.virtual_time = 0.0
+        self.flow_finish: Dict[int, float] = {}
+        self.pump: Optional[asyncio.Task] = None
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def take(self, tokens: float):
+        self.requests.tokens -= 1
+        self.tokens.tokens -= min(tokens, self.tokens.capacity)
+
+
+class RateLimiter:
+    """Token buckets per (API key, model) for RPM and TPM, with weighted fair queuing
+
+    A call that finds budget and no queue goes straight out. Otherwise it
+    waits in the lane's queue, ordered by weighted-fair-queuing finish tag:
+    each request (flow) is charged for the tokens it sends divided by its
+    weight, so a long chain's stream of calls cannot starve a short one.
+    limits maps model-name prefixes to (rpm, tpm); scale multiplies them all.
+    Up to burst_seconds' worth of requests may go out back to back.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], default: Tuple[float, float], scale: float = 1.0, burst_seconds: float = 60.0):
+        self.limits = limits
+        self.default = default
+        self.scale = scale
+        self.burst_seconds = burst_seconds
+        self._lanes: Dict[Tuple[str, str], _Lane] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.counters = {"acquired": 0, "throttled": 0, "wait_seconds": 0.0, "penalties": 0, "refunds": 0}
+
+    def limits_for(self, model: str) -> Tuple[float, float]:
+        prefix = max((p for p in self.limits if model.startswith(p)), key=len, default=None)
+        rpm, tpm = self.limits[prefix] if prefix is not None else self.default
+        return rpm * self.scale, tpm * self.scale
+
+    def _lane(self, api_key: str, model: str) -> _Lane:
+        key = (hash_api_key(api_key), model)
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = _Lane(*self.limits_for(model), burst_seconds=self.burst_seconds)
+                self._lanes[key] = lane
+            return lane
+
+    async def acquire(self, api_key: str, model: str, tokens: float) -> float:
+        """Wait for budget to send ~tokens to model; returns seconds spent queued"""
+        lane = self._lane(api_key, model)
+        started = time.monotonic()
+        if not any(not w[2].done() for w in lane.waiters) and lane.wait_time(tokens, started) == 0:
+            lane.take(tokens)
+            self._record(model, 0.0)
+            return 0.0
+
+        flow_id, weight = CURRENT_FLOW.get() or (None, 1.0)
+        start_tag = max(lane.virtual_time, lane.flow_finish.get(flow_id, 0.0))
+        finish_tag = start_tag + tokens / max(weight, 1e-6)
+        if flow_id is not None:
+            lane.flow_finish[flow_id] = finish_tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.waiters, (finish_tag, next(self._seq), future, tokens, start_tag))
+        if lane.pump is None or lane.pump.done():
+            lane.pump = asyncio.ensure_future(self._pump(lane))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Budget was granted just as the caller went away
+                self.refund(api_key, model, tokens)
+            raise
+        waited = time.monotonic() - started
+        self._record(model, waited)
+        return waited
+
+    async def _pump(self, lane: _Lane):
+        while lane.waiters:
+            _, _, future, tokens, start_tag = lane.waiters[0]
+            if future.done():  # waiter was cancelled
+                heapq.heappop(lane.waiters)
+                continue
+            delay = lane.wait_time(tokens, time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(lane.waiters)
+            lane.take(tokens)
+            lane.virtual_time = max(lane.virtual_time, start_tag)
+            future.set_result(None)
+        # Flows whose finish tag is behind the virtual clock carry no credit any more
+        lane.flow_finish = {f: tag for f, tag in lane.flow_finish.items() if tag > lane.virtual_time}
+
+    def settle(self, api_key: str, model: str, estimated: float, actual: Optional[float]):
+        """Charge the token bucket for the difference between estimated and reported usage"""
+        if actual is None:
+            return
+        lane = self._lane(api_key, model)
+        lane.tokens.refill(time.monotonic())
+        lane.tokens.tokens -= actual - min(estimated, lane.tokens.capacity)
+
+    def refund(self, api_key: str, model: str, tokens: float):
+        """Give back the request and tokens reserved for a call that never completed (e.g. cancelled)"""
+        lane = self._lane(api_key, model)
+        now = time.monotonic()
+        lane.requests.refill(now)
+        lane.tokens.refill(now)
+        lane.requests.tokens = min(lane.requests.capacity, lane.requests.tokens + 1)
+        lane.tokens.tokens = min(lane.tokens.capacity, lane.tokens.tokens + min(tokens, lane.tokens.capacity))
+        self.counters["refunds"] += 1
+        if lane.pump is not None and not lane.pump.done():
+            # The pump may be sleeping on a wait computed before the refund: restart it
+            lane.pump.cancel()
+            lane.pump = asyncio.ensure_future(self._pump(lane))
+
+    def penalize(self, api_key: str, model: str):
+        """The provider said 429: empty the request bucket so the lane backs off"""
+        lane = self._lane(api_key, model)
+        lane.requests.refill(time.monotonic())
+        lane.requests.tokens = min(lane.requests.tokens, 0.0)
+        self.counters["penalties"] += 1
+
+    def _record(self, model: str, waited: float):
+        self.counters["acquired"] += 1
+        if waited > 0:
+            self.counters["throttled"] += 1
+            self.counters["wait_seconds"] += waited
+            THROTTLED.inc((model,))
+        QUEUE_WAIT_SECONDS.observe((model,), waited)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lanes = list(self._lanes.items())
+        now = time.monotonic()
+        return {
+            **self.counters,
+            "wait_seconds": round(self.counters["wait_seconds"], 3),
+            "scale": self.scale,
+            "lanes": [
+                {
+                    "key": key_hash[:12],
+                    "model": model,
+                    "queued": sum(1 for w in lane.waiters if not w[2].done()),
+                    "requests_available": round(min(lane.requests.capacity, lane.requests.tokens + (now - lane.requests.updated) * lane.requests.rate), 2),
+                    "tokens_available": int(min(lane.tokens.capacity, lane.tokens.tokens + (now - lane.tokens.updated) * lane.tokens.rate)),
+                }
+                for (key_hash, model), lane in lanes
+            ],
+        }
+
+
+class ModelConcurrency:
+    """Caps the number of in-flight provider calls per model
+
+    limits maps model-name prefixes to a slot count (default for the rest).
+    Slots are process-wide, so concurrent chains interleave their steps on
+    each model and a big batch keeps every model busy without flooding it.
+    """
+
+    def __init__(self, limits: Dict[str, int], default: int):
+        self.limits = limits
+        self.default = default
+        self._slots: Dict[str, Dict] = {}
+        self._started = time.monotonic()
+
+    def limit_for(self, model: str) -> int:
+        prefix = max((p for p in self.limits if model.startswith(p)), key=len, default=None)
+        return self.limits[prefix] if prefix is not None else self.default
+
+    def _entry(self, model: str) -> Dict:
+        loop = asyncio.get_running_loop()
+        entry = self._slots.get(model)
+        if entry is None:
+            entry = {"in_use": 0, "peak": 0, "waiting": 0, "calls": 0, "busy_seconds": 0.0}
+            self._slots[model] = entry
+        if entry.get("loop") is not loop:
+            # Semaphores are bound to one event loop; start a fresh one on a new loop
+            entry["loop"] = loop
+            entry["semaphore"] = asyncio.Semaphore(self.limit_for(model))
+        return entry
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        entry = self._entry(model)
+        entry["waiting"] += 1
+        try:
+            await entry["semaphore"].acquire()
+        finally:
+            entry["waiting"] -= 1
+        entry["in_use"] += 1
+        entry["peak"] = max(entry["peak"], entry["in_use"])
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            entry["in_use"] -= 1
+            entry["calls"] += 1
+            entry["busy_seconds"] += time.monotonic() - started
+            entry["semaphore"].release()
+
+    def stats(self) -> Dict:
+        elapsed = max(1e-6, time.monotonic() - self._started)
+        return {
+            model: {
+                "limit": self.limit_for(model),
+                "in_use": entry["in_use"],
+                "waiting": entry["waiting"],
+                "peak": entry["peak"],
+                "calls": entry["calls"],
+                # Average fraction of the model's slots that were busy since start-up
+                "utilization": round(entry["busy_seconds"] / (elapsed * self.limit_for(model)), 4),
+            }
+            for model, entry in sorted(self._slots.items())
+        }
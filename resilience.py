@@ -0,0 +1,87 @@
+import asyncio
+import random
+from typing import Awaitable, Callable, Iterable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Error classes (see model_health.classify_error) worth another attempt
+RETRYABLE_ERROR_CLASSES = ("rate_limited", "server_error", "timeout")
+
+
+async def with_deadline(awaitable: Awaitable[T], timeout: Optional[float], label: str = "call") -> T:
+    """Await with a deadline, raising TimeoutError with a readable message when it passes"""
+    if not timeout:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"{label} timed out after {timeout:.0f}s") from None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Full-jitter exponential backoff for the given (1-based) failed attempt"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+async def retry_async(
+    attempt: Callable[[], Awaitable[T]],
+    classify: Callable[[BaseException], str],
+    max_attempts: int = 3,
+    base_delay: float = 1.0,
+    max_delay: float = 20.0,
+    retryable: Iterable[str] = RETRYABLE_ERROR_CLASSES,
+    on_retry: Optional[Callable[[int, BaseException, float], None]] = None,
+) -> Tuple[T, int]:
+    """Run attempt() until it succeeds, retrying only errors whose class is retryable
+
+    Returns (result, attempts_used); the last error is re-raised once
+    attempts run out or an error is not retryable.
+    """
+    retryable = tuple(retryable)
+    for number in range(1, max_attempts + 1):
+        try:
+            return await attempt(), number
+        except Exception as e:
+            if number == max_attempts or classify(e) not in retryable:
+                raise
+            delay = backoff_delay(number, base_delay, max_delay)
+            if on_retry is not None:
+                on_retry(number, e, delay)
+            await asyncio.sleep(delay)
+
+
+async def hedge_async(
+    primary: Callable[[], Awaitable[T]],
+    backup: Callable[[], Awaitable[T]],
+    hedge_after: float,
+) -> Tuple[T, bool, bool]:
+    """Start primary; if it hasn't finished after hedge_after seconds, also start backup
+
+    Returns (result, hedge_fired, backup_won): whether backup was started and
+    whether its answer was used. The first successful answer wins and the
+    loser is cancelled; an error from one side only surfaces if the other
+    side fails too.
+    """
+    primary_task = asyncio.ensure_future(primary())
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=hedge_after)
+    except asyncio.CancelledError:
+        primary_task.cancel()
+        raise
+    if done:
+        return primary_task.result(), False, False
+
+    backup_task = asyncio.ensure_future(backup())
+    pending = {primary_task, backup_task}
+    first_error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), True, task is backup_task
+                first_error = first_error or task.exception()
+        raise first_error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def cache_key(model_name: str, prompt: str) -> str:
+    """Content address of a model call: sha256 over model name and prompt"""
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache of successful model outputs
+
+    An in-memory LRU sits in front of an optional SQLite file. Disk entries
+    are zlib-compressed, expire after ttl seconds, and the least recently
+    used ones are evicted once the file holds more than max_disk_bytes.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        memory_entries: int = 256,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        ttl: float = 7 * 24 * 3600,
+    ):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_bytes = 0
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                output BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry["expires_at"] > now:
+                    entry["hits"] += 1
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry["output"]
+                del self._memory[key]
+                self.counters["expired"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT output, expires_at, hits FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._db.execute(
+                        "UPDATE responses SET hits = hits + 1, last_access = ? WHERE key = ?", (now, key)
+                    )
+                    output = zlib.decompress(row[0]).decode("utf-8")
+                    self._remember(key, output, row[1], row[2] + 1)
+                    self.counters["disk_hits"] += 1
+                    return output
+                if row is not None:
+                    self._delete(key)
+                    self.counters["expired"] += 1
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key: str, model_name: str, output: str):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, output, expires_at, 0)
+            self.counters["puts"] += 1
+            if self._db is None:
+                return
+            blob = zlib.compress(output.encode("utf-8"))
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                """INSERT OR REPLACE INTO responses (key, model, output, size, created_at, expires_at, last_access, hits)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, 0)""",
+                (key, model_name, blob, len(blob), now, expires_at, now),
+            )
+            self._disk_bytes += len(blob) - (previous[0] if previous else 0)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict(now)
+
+    def entry_stats(self, key: str) -> Optional[Dict]:
+        """Hit statistics of a single entry, or None if it is not cached"""
+        with self._lock:
+            memory = self._memory.get(key)
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT model, size, created_at, expires_at, last_access, hits FROM responses WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None:
+                    return {
+                        "model": row[0],
+                        "compressed_size": row[1],
+                        "created_at": row[2],
+                        "expires_at": row[3],
+                        "last_access": row[4],
+                        "hits": row[5] + (memory["hits"] if memory else 0),
+                    }
+            if memory is not None:
+                return {"expires_at": memory["expires_at"], "hits": memory["hits"]}
+            return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            disk_entries = (
+                self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] if self._db is not None else 0
+            )
+            return {
+                **self.counters,
+                "hit_ratio": round(hits / lookups, 4) if lookups else None,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "path": self.path,
+            }
+
+    async def get_async(self, key: str) -> Optional[str]:
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def put_async(self, key: str, model_name: str, output: str):
+        if self._db is None:
+            return self.put(key, model_name, output)
+        await asyncio.to_thread(self.put, key, model_name, output)
+
+    def _remember(self, key: str, output: str, expires_at: float, hits: int):
+        self._memory[key] = {"output": output, "expires_at": expires_at, "hits": hits}
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _delete(self, key: str):
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._disk_bytes -= row[0]
+
+    def _evict(self, now: float):
+        # Drop expired rows first, then least recently used ones down to 90% of the budget
+        for key, size in self._db.execute("SELECT key, size FROM responses WHERE expires_at <= ?", (now,)).fetchall():
+            self._delete(key)
+            self.counters["expired"] += 1
+        target = int(self.max_disk_bytes * 0.9)
+        if self._disk_bytes <= target:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if self._disk_bytes <= target:
+                break
+            self._delete(key)
+            self._memory.pop(key, None)
+            self.counters["evictions"] += 1
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+SCHEDULERS = ("static", "adaptive")
+
+
+class ModelStatsStore:
+    """SQLite table of per-(model, chain position) outcomes across runs
+
+    Each row accumulates how many steps the model ran at that position, how
+    many failed, their total latency and the total (and squared) judge-score
+    gain over the best output before the step. Positions past max_position
+    share the last bucket.
+    """
+
+    def __init__(self, path: str, max_position: int = 12):
+        self.path = path
+        self.max_position = max_position
+        self._lock = threading.Lock()
+        self.counters = {"recorded_steps": 0, "recorded_runs": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS model_stats (
+                model TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                steps INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                scored INTEGER NOT NULL DEFAULT 0,
+                gain_sum REAL NOT NULL DEFAULT 0,
+                gain_sq_sum REAL NOT NULL DEFAULT 0,
+                latency_sum REAL NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (model, position)
+            )"""
+        )
+        self._rows = self._load()
+
+    def _load(self) -> Dict[Tuple[str, int], Dict]:
+        rows = self._db.execute(
+            "SELECT model, position, steps, failures, scored, gain_sum, gain_sq_sum, latency_sum FROM model_stats"
+        ).fetchall()
+        return {
+            (r[0], r[1]): {"steps": r[2], "failures": r[3], "scored": r[4], "gain_sum": r[5], "gain_sq_sum": r[6], "latency_sum": r[7]}
+            for r in rows
+        }
+
+    def bucket(self, position: int) -> int:
+        return min(max(1, position), self.max_position)
+
+    def record(self, observations: List[Dict]):
+        """Add one run's steps: dicts with model, position, success, latency and gain (None when unscored)"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            for obs in observations:
+                key = (obs["model"], self.bucket(obs["position"]))
+                failed = 0 if obs["success"] else 1
+                scored = 1 if obs.get("gain") is not None else 0
+                gain = obs.get("gain") or 0.0
+                self._db.execute(
+                    """INSERT INTO model_stats (model, position, steps, failures, scored, gain_sum, gain_sq_sum, latency_sum, updated_at)
+                       VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(model, position) DO UPDATE SET
+                         steps = steps + 1, failures = failures + excluded.failures, scored = scored + excluded.scored,
+                         gain_sum = gain_sum + excluded.gain_sum, gain_sq_sum = gain_sq_sum + excluded.gain_sq_sum,
+                         latency_sum = latency_sum + excluded.latency_sum, updated_at = excluded.updated_at""",
+                    (key[0], key[1], failed, scored, gain, gain * gain, obs["latency"], now),
+                )
+                row = self._rows.setdefault(key, {"steps": 0, "failures": 0, "scored": 0, "gain_sum": 0.0, "gain_sq_sum": 0.0, "latency_sum": 0.0})
+                row["steps"] += 1
+                row["failures"] += failed
+                row["scored"] += scored
+                row["gain_sum"] += gain
+                row["gain_sq_sum"] += gain * gain
+                row["latency_sum"] += obs["latency"]
+            self._db.execute("COMMIT")
+            self.counters["recorded_steps"] += len(observations)
+            self.counters["recorded_runs"] += 1
+
+    async def record_async(self, observations: List[Dict]):
+        await asyncio.to_thread(self.record, observations)
+
+    def snapshot(self) -> Dict[Tuple[str, int], Dict]:
+        with self._lock:
+            return {key: dict(row) for key, row in self._rows.items()}
+
+    def stats(self) -> Dict:
+        rows = self.snapshot()
+        return {
+            **self.counters,
+            "path": self.path,
+            "models": [
+                {
+                    "model": model,
+                    "position": position,
+                    "steps": row["steps"],
+                    "failure_rate": round(row["failures"] / row["steps"], 4) if row["steps"] else None,
+                    "avg_latency": round(row["latency_sum"] / row["steps"], 3) if row["steps"] else None,
+                    "avg_gain": round(row["gain_sum"] / row["scored"], 3) if row["scored"] else None,
+                    "gain_stddev": round(max(0.0, row["gain_sq_sum"] / row["scored"] - (row["gain_sum"] / row["scored"]) ** 2) ** 0.5, 3) if row["scored"] else None,
+                }
+                for (model, position), row in sorted(rows.items())
+            ],
+        }
+
+
+def chain_observations(result: Dict, start_after: int = 0) -> List[Dict]:
+    """Per-step (model, position, success, latency, score gain) of a finished chain result
+
+    The gain is the step's raw judge score minus the best raw score of the
+    steps it built on (earlier steps; earlier rounds in a tournament). Cached
+    steps and steps at or before start_after (already recorded before a
+    resume) are left out.
+    """
+    scores = {r["step"]: r["score"] - r["step"] for r in result.get("all_responses", [])}
+    rounds = {s["step"]: s.get("round") for s in result.get("all_steps", [])}
+    observations = []
+    for step in result.get("all_steps", []):
+        if step["step"] <= start_after or step.get("cached") or step.get("skipped"):
+            continue
+        number = step["step"]
+        before = [
+            score for other, score in scores.items()
+            if other < number and (rounds.get(number) is None or rounds.get(other) != rounds.get(number))
+        ]
+        gain = scores[number] - max(before, default=0) if number in scores else None
+        observations.append({
+            "model": step.get("requested_model") or step["model"],
+            "position": number,
+            "success": bool(step["success"]),
+            "latency": step.get("latency") or 0.0,
+            "gain": gain,
+        })
+    return observations
+
+
+class AdaptiveScheduler:
+    """Builds a mode's chain from learned per-(model, position) score gain and latency
+
+    The mode's static chain is the prior: at each position its own model is
+    assumed to gain prior_gain / position points, the mode's other models half
+    that, all at prior_latency seconds and prior_success, each worth
+    prior_weight observations. Positions are filled greedily with the model
+    of highest expected gain x success rate / latency, as long as the chain's
+    expected time stays within the static chain's and, once measured often
+    enough, the expected gain is at least min_gain. A share `exploration` of
+    the chains swaps one random position to another of the mode's models,
+    so alternatives keep being measured.
+    """
+
+    def __init__(
+        self,
+        store: ModelStatsStore,
+        exploration: float = 0.1,
+        prior_weight: float = 3.0,
+        prior_gain: float = 20.0,
+        prior_latency: float = 10.0,
+        prior_success: float = 0.95,
+        min_gain: float = 0.5,
+        seed: Optional[int] = None,
+    ):
+        self.store = store
+        self.exploration = exploration
+        self.prior_weight = prior_weight
+        self.prior_gain = prior_gain
+        self.prior_latency = prior_latency
+        self.prior_success = prior_success
+        self.min_gain = min_gain
+        self.rng = random.Random(seed)
+
+    def _model_totals(self, rows: Dict, model: str) -> Tuple[int, int, float]:
+        steps = failures = 0
+        latency = 0.0
+        for (name, _), row in rows.items():
+            if name == model:
+                steps += row["steps"]
+                failures += row["failures"]
+                latency += row["latency_sum"]
+        return steps, failures, latency
+
+    def estimate(self, rows: Dict, static_chain: List[str], model: str, position: int) -> Dict:
+        """Expected gain, latency and success rate of model at position (1-based), priors blended in"""
+        w = self.prior_weight
+        static_model = static_chain[position - 1] if position <= len(static_chain) else None
+        prior_gain = self.prior_gain / position * (1.0 if model == static_model else 0.5)
+        row = rows.get((model, self.store.bucket(position)))
+        scored, gain_sum = (row["scored"], row["gain_sum"]) if row else (0, 0.0)
+        # Latency and failures hardly depend on the position, so pool them per model
+        steps, failures, latency_sum = self._model_totals(rows, model)
+        gain = (w * prior_gain + gain_sum) / (w + scored)
+        latency = (w * self.prior_latency + latency_sum) / (w + steps)
+        success = (w * self.prior_success + steps - failures) / (w + steps)
+        return {"gain": gain, "latency": max(latency, 1e-3), "success": success, "evidence": scored >= w}
+
+    def build_chain(self, static_chain: List[str], explore: bool = True) -> Dict:
+        """Pick the chain for one run; returns {"models", "explored" positions, "expected_seconds", "budget_seconds"}"""
+        rows = self.store.snapshot()
+        candidates = list(dict.fromkeys(static_chain))
+        budget = sum(self.estimate(rows, static_chain, m, p)["latency"] for p, m in enumerate(static_chain, 1))
+        models, explored = [], []
+        elapsed = 0.0
+        explore_at = self.rng.randint(1, len(static_chain)) if explore and self.rng.random() < self.exploration else None
+        for position in range(1, len(static_chain) + 1):
+            estimates = {m: self.estimate(rows, static_chain, m, position) for m in candidates}
+            fitting = [m for m in candidates if elapsed + estimates[m]["latency"] <= budget * 1.0001]
+            if not fitting:
+                break
+            # A negative expected gain divided by latency would favour slow models; rank them all as zero
+            best = max(fitting, key=lambda m: max(0.0, estimates[m]["gain"]) * estimates[m]["success"] / estimates[m]["latency"])
+            if position > 1 and estimates[best]["evidence"] and estimates[best]["gain"] * estimates[best]["success"] < self.min_gain:
+                # Measured, not just assumed: later steps have stopped paying off
+                break
+            choice = best
+            others = [m for m in fitting if m != best]
+            if position == explore_at and others:
+                choice = self.rng.choice(others)
+                explored.append(position)
+            models.append(choice)
+            elapsed += estimates[choice]["latency"]
+        return {
+            "models": models or static_chain[:1],
+            "explored": explored,
+            "expected_seconds": round(elapsed, 3),
+            "budget_seconds": round(budget, 3),
+        }
@@ -0,0 +1,61 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict
+
+
+def request_key(task: str, mode: str, api_key: str, *extra) -> str:
+    """Coalescing key for a run: hashes of the task and API key plus the mode and options"""
+    task_hash = hashlib.sha256(task.encode("utf-8")).hexdigest()
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    return "|".join([task_hash, (mode or "").lower(), key_hash, *map(str, extra)])
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls onto one running task
+
+    Every caller of do() with the same key awaits the same task. Callers are
+    reference counted: when a waiter is cancelled it detaches, and the shared
+    task is only cancelled once no waiters are left.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Dict] = {}
+        self.counters = {"requests": 0, "coalesced": 0, "executions": 0, "cancelled": 0}
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        self.counters["requests"] += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = {"task": asyncio.ensure_future(factory()), "waiters": 0}
+            self._flights[key] = flight
+            flight["task"].add_done_callback(lambda _: self._forget(key, flight))
+            self.counters["executions"] += 1
+        else:
+            self.counters["coalesced"] += 1
+            print(f"🔗 Coalesced request onto running chain ({flight['waiters']} already waiting)")
+
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"])
+        except asyncio.CancelledError:
+            if not flight["task"].done() and flight["waiters"] == 1:
+                # Last waiter gone: new arrivals must start a fresh run, not join a cancelled one
+                self._forget(key, flight)
+                flight["task"].cancel()
+                self.counters["cancelled"] += 1
+            raise
+        finally:
+            flight["waiters"] -= 1
+
+    def _forget(self, key: str, flight: Dict):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict:
+        requests = self.counters["requests"]
+        return {
+            **self.counters,
+            "in_flight": len(self._flights),
+            "waiters": sum(f["waiters"] for f in self._flights.values()),
+            "coalescing_ratio": round(self.counters["coalesced"] / requests, 4) if requests else None,
+        }
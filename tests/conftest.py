@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+# agents reads its configuration at import time: keep test runs away from the
+# working copy's .devgenie and from any real API
+os.environ.setdefault("DEVGENIE_DATA_DIR", tempfile.mkdtemp(prefix="devgenie-tests-"))
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+os.environ.setdefault("MODEL_STATS_ENABLED", "0")
+os.environ["CASSETTE_MODE"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import agents  # noqa: E402
+import fake_gemini  # noqa: E402
+
+# Every fake model answers without failures, so outcomes depend only on the code under test
+RELIABLE_PROFILES = {name: {**profile, "errors": {}} for name, profile in fake_gemini.DEFAULT_PROFILES.items()}
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    """A fast, failure-free fake Gemini behind every agents.get_client() call"""
+    monkeypatch.setattr(agents, "CALL_RETRY_BASE_DELAY", agents.CALL_RETRY_BASE_DELAY * 0.01)
+    return fake_gemini.install(RELIABLE_PROFILES, time_scale=0.001, seed=7)
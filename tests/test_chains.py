@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+import agents
+import fake_gemini
+from model_health import StageLatencies
+
+API_KEY = "test-key"
+TASK = "Write a Python function that parses a CSV line, handling quoted fields."
+
+
+def run(**options):
+    return asyncio.run(agents.run_chain_async(TASK, API_KEY, mode="fast", use_cache=False, **options))
+
+
+@pytest.mark.parametrize("execution", ["sequential", "pipelined", "tournament"])
+def test_execution_modes_run_the_whole_chain(fake_client, execution):
+    result = run(execution=execution)
+    steps = result["all_steps"]
+    assert result["execution"] == execution
+    assert [s["step"] for s in steps] == list(range(1, len(agents.MODEL_CHAIN3) + 1))
+    assert all(s["success"] for s in steps)
+    assert len(result["all_responses"]) == len(steps)
+    assert result["final_output"] == agents.find_best_response(result["all_responses"])[0]
+    if execution == "tournament":
+        assert [r["models"] for r in result["rounds"]] == agents.split_into_rounds(agents.MODEL_CHAIN3, agents.CHAIN_ROUND_SIZES["fast"])
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.mark.parametrize("execution", ["sequential", "tournament"])
+def test_resume_continues_after_the_last_checkpoint(fake_client, execution):
+    def crash_after_step_two(event):
+        if event["step"] == 2:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        run(execution=execution, run_id=f"resume-{execution}", on_step=crash_after_step_two)
+    calls_before = fake_client.calls
+
+    result = asyncio.run(agents.resume_chain_async(f"resume-{execution}", API_KEY))
+    assert result["resumed_from_step"] == 2
+    assert [s["step"] for s in result["all_steps"]] == list(range(1, len(agents.MODEL_CHAIN3) + 1))
+    # Only the remaining steps (and their judging) were sent again
+    assert fake_client.calls - calls_before <= 2 * (len(agents.MODEL_CHAIN3) - 2)
+
+
+def test_resume_with_another_api_key_is_refused(fake_client):
+    run(run_id="resume-key")
+    with pytest.raises(PermissionError):
+        asyncio.run(agents.resume_chain_async("resume-key", "other-key"))
+
+
+def test_deadline_cuts_the_chain_to_what_fits(fake_client, monkeypatch):
+    # No latency measured yet: every step is planned at DEFAULT_STEP_SECONDS
+    monkeypatch.setattr(agents, "STAGE_LATENCIES", StageLatencies())
+    result = run(deadline_ms=int(agents.DEFAULT_STEP_SECONDS * 1000 * 1.5))
+    budget = result["budget"]
+    assert budget["models_planned"] == 1
+    assert len(budget["models_dropped"]) == len(agents.MODEL_CHAIN3) - 1
+    assert len(result["all_steps"]) == 1
+
+
+def test_deadline_returns_the_best_output_so_far(fake_client, monkeypatch):
+    monkeypatch.setattr(agents, "STAGE_LATENCIES", StageLatencies())
+    monkeypatch.setattr(agents, "DEFAULT_STEP_SECONDS", 0.01)
+    fake_client.time_scale = 0.05  # ~0.13s per Flash-Lite step, ~0.3s per judge call
+    models = ["gemini-2.5-flash-lite"] * 6
+    result = run(deadline_ms=1200, models=models)
+    assert result["budget"]["stopped_by"] == "deadline"
+    assert result["budget"]["elapsed_ms"] < 1200
+    assert 1 <= len(result["all_responses"]) and len(result["all_steps"]) < len(models)
+    assert result["final_output"] == agents.find_best_response(result["all_responses"])[0]
+
+
+def test_steps_saved_before_a_deadline_stop_reach_on_step(fake_client, monkeypatch):
+    monkeypatch.setattr(agents, "STAGE_LATENCIES", StageLatencies())
+    monkeypatch.setattr(agents, "DEFAULT_STEP_SECONDS", 0.01)
+    fake_client.time_scale = 0.05
+    events = []
+    result = run(deadline_ms=1200, models=["gemini-2.5-flash-lite"] * 6, on_step=events.append)
+    assert result["budget"]["stopped_by"] == "deadline"
+    assert result["all_steps"]
+    assert [e["step"] for e in events] == [s["step"] for s in result["all_steps"]]
+
+
+def test_deadline_at_the_selection_reserve_is_rejected(fake_client):
+    with pytest.raises(ValueError):
+        run(deadline_ms=int(agents.DEADLINE_SELECTION_RESERVE * 1000))
+
+
+def test_max_cost_drops_models_that_would_overrun(fake_client):
+    one_step = agents.estimate_step_tokens(TASK, 1)
+    result = run(max_cost=int(one_step * 1.5))
+    budget = result["budget"]
+    assert budget["models_planned"] == 1
+    assert len(result["all_steps"]) == 1
+
+
+def test_duplicate_outputs_reuse_the_judge_score(fake_client, monkeypatch):
+    monkeypatch.setattr(fake_gemini, "fake_output", lambda model, prompt, tokens, rng: "```python\ndef parse(line):\n    return line.split(',')\n```")
+    result = run(prescore=False)
+    steps = len(agents.MODEL_CHAIN3)
+    assert result["judge_calls"] == 1
+    assert result["duplicate_steps"] == steps - 1
+    scores = {r["score"] - r["step"] for r in result["all_responses"]}
+    assert len(scores) == 1
+
+
+def test_resume_fails_cleanly_when_outputs_were_evicted(fake_client):
+    result = run(run_id="resume-evicted")
+    with agents.ARTIFACTS._lock:
+        agents.ARTIFACTS._index.pop(result["all_steps"][0]["output_ref"])
+    with pytest.raises(agents.CheckpointOutputsMissing):
+        asyncio.run(agents.resume_chain_async("resume-evicted", API_KEY))
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+import agents
+from context_cache import ContextCache
+
+API_KEY = "test-key"
+MODEL = "gemini-2.5-flash"
+# Long enough for the fake's 1024-token floor once the rubric is added
+LONG_TASK = "Write a rate limiter for an HTTP client. " * 120
+SHORT_TASK = "Write a function that reverses a string."
+
+
+@pytest.fixture
+def context_cache(monkeypatch):
+    cache = ContextCache({MODEL: 1024}, ttl=600)
+    monkeypatch.setattr(agents, "CONTEXT_CACHE", cache)
+    return cache
+
+
+def call(task: str, response: str = "def answer(): pass"):
+    prompt = agents.build_evaluation_prompt(response, task)
+    return agents.generate_once(MODEL, prompt, API_KEY, cache_prefix=agents.build_chain_prefix(task))
+
+
+def test_step_and_judge_prompts_share_the_chain_prefix():
+    prefix = agents.build_chain_prefix(SHORT_TASK)
+    assert agents.build_step_prompt(1, 3, SHORT_TASK, None, SHORT_TASK).startswith(prefix)
+    assert agents.build_step_prompt(2, 3, SHORT_TASK, MODEL, "previous output").startswith(prefix)
+    assert agents.build_evaluation_prompt("response", SHORT_TASK).startswith(prefix)
+
+
+def test_short_prefix_is_sent_inline(fake_client, context_cache):
+    asyncio.run(call(SHORT_TASK))
+    asyncio.run(call(SHORT_TASK))
+    assert context_cache.counters["too_small"] == 2
+    assert fake_client.cached_contents == {}
+
+
+def test_second_use_creates_and_later_calls_reuse(fake_client, context_cache):
+    async def scenario():
+        first = await call(LONG_TASK, "first")
+        second = await call(LONG_TASK, "second")
+        third = await call(LONG_TASK, "third")
+        return first, second, third
+
+    (_, first_usage), (_, second_usage), (_, third_usage) = asyncio.run(scenario())
+    assert first_usage["cached_input_tokens"] is None
+    assert context_cache.counters["first_sightings"] == 1
+    assert context_cache.counters["created"] == 1
+    assert context_cache.counters["hits"] == 1
+    assert len(fake_client.cached_contents) == 1
+    assert second_usage["cached_input_tokens"] and third_usage["cached_input_tokens"]
+
+
+def test_expired_cache_falls_back_to_the_full_prompt_and_is_recreated(fake_client, context_cache):
+    async def scenario():
+        await call(LONG_TASK, "first")
+        await call(LONG_TASK, "second")
+        for entry in fake_client.cached_contents.values():
+            entry["expires"] = 0.0  # the provider dropped it before our ttl ran out
+        fallback = await call(LONG_TASK, "third")
+        recreated = await call(LONG_TASK, "fourth")
+        return fallback, recreated
+
+    (output, usage), (_, recreated_usage) = asyncio.run(scenario())
+    assert output.strip().isdigit()
+    assert usage["cached_input_tokens"] is None
+    assert context_cache.counters["invalidated"] == 1
+    assert context_cache.counters["created"] == 2
+    assert recreated_usage["cached_input_tokens"]
+
+
+def test_local_ttl_expiry_recreates_the_cache(fake_client, monkeypatch):
+    cache = ContextCache({MODEL: 1024}, ttl=1)
+    monkeypatch.setattr(agents, "CONTEXT_CACHE", cache)
+    fake_client.time_scale = 1.0
+
+    async def scenario():
+        await call(LONG_TASK, "first")
+        await call(LONG_TASK, "second")
+        await asyncio.sleep(0.95)
+        return await call(LONG_TASK, "third")
+
+    fake_client.profiles = {"": {"latency": (0.0, 0.0), "output_tokens": (50, 0), "errors": {}}}
+    _, usage = asyncio.run(scenario())
+    assert cache.counters["created"] == 2
+    assert cache.counters["invalidated"] == 0
+    assert usage["cached_input_tokens"]
+
+
+def test_failed_create_blocks_the_model_and_sends_full_prompts(fake_client, context_cache):
+    fake_client.min_cache_tokens = 10 ** 6  # the provider refuses every cache
+
+    async def scenario():
+        return [await call(LONG_TASK, f"response {i}") for i in range(3)]
+
+    results = asyncio.run(scenario())
+    assert all(output.strip().isdigit() for output, _ in results)
+    assert all(usage["cached_input_tokens"] is None for _, usage in results)
+    assert context_cache.counters["create_failures"] == 1
+    assert context_cache.stats()["blocked"] == 1
+
+
+def test_chain_generation_and_judging_share_one_cache(fake_client, context_cache):
+    result = asyncio.run(agents.run_chain_async(LONG_TASK, API_KEY, models=[MODEL, MODEL, MODEL], use_cache=False, prescore=False))
+    assert result["successful_models"] == 3
+    assert context_cache.counters["created"] == 1
+    assert context_cache.counters["hits"] >= 3
+    assert len(fake_client.cached_contents) == 1
@@ -0,0 +1,30 @@
+import asyncio
+
+import agents
+from model_health import ModelHealthRegistry
+
+MODEL = "gemini-2.5-flash"
+
+
+def test_retried_call_is_one_breaker_failure(fake_client, monkeypatch):
+    health = ModelHealthRegistry()
+    monkeypatch.setattr(agents, "MODEL_HEALTH", health)
+    fake_client.profiles = {"": {"latency": (0.0, 0.0), "output_tokens": (50, 0), "errors": {503: 1.0}}}
+
+    result = asyncio.run(agents.call_model_async(MODEL, "prompt", "test-key", use_cache=False))
+    assert not result["success"]
+    assert fake_client.calls == 0  # every attempt failed before answering
+    entry = health._models[MODEL]
+    assert entry["calls"] == 1 and entry["failures"] == 1
+
+
+def test_retry_that_recovers_is_one_success(fake_client, monkeypatch):
+    health = ModelHealthRegistry()
+    monkeypatch.setattr(agents, "MODEL_HEALTH", health)
+    fake_client.profiles = {"": {"latency": (0.0, 0.0), "output_tokens": (50, 0), "errors": {503: 0.5}}}
+    fake_client.rng.seed(2)  # first attempt fails, the retry answers
+
+    result = asyncio.run(agents.call_model_async(MODEL, "prompt", "test-key", use_cache=False))
+    assert result["success"] and result["attempts"] > 1
+    entry = health._models[MODEL]
+    assert entry["calls"] == 1 and entry["failures"] == 0
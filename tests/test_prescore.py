@@ -0,0 +1,29 @@
+import asyncio
+import sys
+import types
+
+import prescore
+
+
+def fake_main(monkeypatch, tmp_path, source: str):
+    script = tmp_path / "script.py"
+    script.write_text(source)
+    main = types.ModuleType("__main__")
+    main.__file__ = str(script)
+    main.__spec__ = None
+    monkeypatch.setitem(sys.modules, "__main__", main)
+
+
+def test_unguarded_script_prescores_on_a_thread(monkeypatch, tmp_path):
+    fake_main(monkeypatch, tmp_path, "import prescore\nprescore.run()\n")
+    monkeypatch.setattr(prescore, "_pool", None)
+    monkeypatch.setattr(prescore, "_in_process", False)
+    result = asyncio.run(prescore.local_prescore_async("```python\ndef f():\n    return 1\n```", "write f"))
+    assert result["syntax_ok"]
+    assert prescore._in_process
+    assert prescore._pool is None
+
+
+def test_guarded_script_is_spawn_safe(monkeypatch, tmp_path):
+    fake_main(monkeypatch, tmp_path, "import prescore\n\nif __name__ == \"__main__\":\n    prescore.run()\n")
+    assert prescore._main_is_spawn_safe()
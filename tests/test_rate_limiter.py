@@ -0,0 +1,45 @@
+import asyncio
+
+from rate_limiter import RateLimiter, flow
+
+MODEL = "gemini-2.5-flash"
+# 10 requests per second, one at a time, so queued calls leave in a visible order
+LIMITS = {MODEL: (600, 10 ** 9)}
+
+
+def test_short_chain_is_not_starved_by_a_long_one():
+    limiter = RateLimiter(LIMITS, default=(600, 10 ** 9), burst_seconds=0.1)
+    order = []
+
+    async def call(name: str):
+        await limiter.acquire("key", MODEL, 100)
+        order.append(name)
+
+    async def scenario():
+        tasks = []
+        with flow(weight=1 / 10):  # a 10-step chain queues its calls first
+            tasks += [asyncio.ensure_future(call(f"long-{i}")) for i in range(5)]
+        await asyncio.sleep(0)
+        with flow(weight=1 / 2):
+            tasks += [asyncio.ensure_future(call(f"short-{i}")) for i in range(2)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    # long-0 found budget; the short chain's calls then go ahead of the long chain's backlog
+    assert order[:3] == ["long-0", "short-0", "short-1"]
+    assert order[3:] == [f"long-{i}" for i in range(1, 5)]
+
+
+def test_cancelled_waiter_leaves_the_queue_and_budget_intact():
+    limiter = RateLimiter(LIMITS, default=(600, 10 ** 9), burst_seconds=0.1)
+
+    async def scenario():
+        await limiter.acquire("key", MODEL, 100)
+        waiter = asyncio.ensure_future(limiter.acquire("key", MODEL, 100))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return await asyncio.wait_for(limiter.acquire("key", MODEL, 100), timeout=1)
+
+    assert asyncio.run(scenario()) < 0.2
+    assert limiter.stats()["lanes"][0]["queued"] == 0
@@ -0,0 +1,49 @@
+import asyncio
+
+from singleflight import SingleFlight
+
+
+def test_cancelling_one_waiter_keeps_the_shared_call_running():
+    flights = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        first = asyncio.ensure_future(flights.do("key", work))
+        second = asyncio.ensure_future(flights.do("key", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    result, first_cancelled = asyncio.run(scenario())
+    assert (result, first_cancelled) == ("done", True)
+    assert len(runs) == 1
+    assert flights.counters == {"requests": 2, "coalesced": 1, "executions": 1, "cancelled": 0}
+
+
+def test_cancelling_every_waiter_cancels_the_call_and_the_next_one_starts_fresh():
+    flights = SingleFlight()
+    started, finished = [], []
+
+    async def work():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return len(started)
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(flights.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return await flights.do("key", work)
+
+    assert asyncio.run(scenario()) == 2
+    assert len(finished) == 1  # only the fresh execution ran to completion
+    assert flights.counters["cancelled"] == 1
+    assert flights.stats()["in_flight"] == 0